@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import dispatcher
+import image_comparison
+import timeline
 import worker
-import zmq_sock_utils
 
 import assisipy
 
@@ -33,6 +35,53 @@ and much more.
 
 COMPARE_BIN_FILENAME = find_app ("compare")
 
+def convert_compare_thomas (mask, image1, image2, threshold = image_comparison.THOMAS_THRESHOLD):
+    """
+    Compare two images using the convert program developed by Thomas Schmickl.  This program computes the pixel count difference between two images in a region of interest.
+    See function image_comparison.subtract_threshold_count for the equivalent NumPy computation.
+    """
+    command = [
+        CONVERT_BIN_FILENAME,
+        image1,
+        image2,
+        '-compose', 'Subtract',
+        '-composite',
+        '-threshold', str (threshold),
+        mask,
+        '-compose', 'ModulusSubtract',
+        '-composite',
+        '-print', '%[fx:w*h*mean]',
+        'null:'
+        ]
+    #import functools
+    #print "Running", functools.reduce (lambda x, y: x + " " + y, command)
+    process = subprocess.Popen (command, stdout=subprocess.PIPE)
+    out, _ = process.communicate ()
+    #print mask, image1, image2, out
+    return float (out)
+
+def convert_compare_plsm (mask, image1, image2, same_colour_threshold):
+    """
+    Compare two images using the convert program from the ImageMagick suite.  This program computes the pixel count difference between two images in a region of interest.
+    The same colour threshold is a percentage string, such as '25%'.
+    See function image_comparison.count_different_pixels for the equivalent NumPy computation.
+    """
+    command = [
+        CONVERT_BIN_FILENAME,
+        '(', mask, image1, '-compose', 'multiply', '-composite', ')',
+        '(', mask, image2, '-compose', 'multiply', '-composite', ')',
+        '-metric', 'AE', '-fuzz', same_colour_threshold, '-compare',
+        '-format', '%[distortion]', 'info:'
+        ]
+    process = subprocess.Popen (command, stdout=subprocess.PIPE)
+    out, err = process.communicate ()
+    try:
+        value = int (out)
+    except:
+        print ("Result is [" + out + "]")
+        raise
+    return int (out)
+
 def ask_casu_number (name, worker_settings):
     """
     Ask the user the CASU number of a CASU with the given name relative to the background image.
@@ -53,6 +102,21 @@ def ask_casu_number (name, worker_settings):
         except ValueError:
             print ("Invalid number")
 
+def print_program_reply (reply):
+    """
+    Callback that prints the reply of a worker to a program and how late its actions ran.
+    """
+    if reply.error is None:
+        if len (reply.value) != 3:
+            dispatcher.print_reply (reply)
+            return
+        (answer, _, timings) = reply.value
+        lateness = [actual - planned for planned, actual in timings]
+        if len (lateness) == 0:
+            lateness = [0]
+        print ("Worker responsible for casu #%d responded with: %d, ran %d actions, mean lateness %.1fms, maximum lateness %.1fms" % (
+            reply.worker_settings.casu_number, answer, len (timings), 1000.0 * sum (lateness) / len (lateness), 1000.0 * max (lateness)))
+
 class AbstractArena:
     """
     This class represents an abstract arena.  The attributes of this class represent the ZMQ sockets
@@ -64,10 +128,23 @@ class AbstractArena:
         """
         self.workers = [ask_casu_number (name, worker_settings) for name in casu_names]
         self.episode_path = episode_path
+        self.background_filename = image_comparison.background_filename (episode_path)
+        self.background_image = None
         self.img_path = img_path
         self.index = index
         self.same_colour_threshold = '%d%%' % (config.same_colour_threshold)
+        self.same_colour_threshold_value = config.same_colour_threshold
         self.delta_image = int (config.frame_per_second / config.interval_current_previous_frame)
+        self.comparison_backend = config.comparison_backend
+        self.pixel_format = config.pixel_format
+        self.image_width = config.image_width
+        self.image_height = config.image_height
+        self.analysis_scale = config.analysis_scale
+        self.compiled_masks = None
+        self.compiled_masks_geometry = None
+        self.frame_cache = None
+        self.background_regions = None
+        self.selected_worker_index = 0
 
     def unselect_workers (self):
         """If the user does not like the arena, the workers that have been
@@ -79,14 +156,23 @@ class AbstractArena:
     def status (self):
         """
         Return the suitability of this arena to run a vibration pattern.  The CASU temperature must be below a minimum threshold.  The suitability is a function of the CASU ring temperature sensor.
+        The temperatures published by the workers are used if they are recent, otherwise they are requested from the workers.
         """
         value = 0
-        temps = []
+        temps = [ws.temperature () for (_, _, ws) in self.workers]
         good = True
-        for (_, socket, _) in self.workers:
-            temperature = zmq_sock_utils.send_recv (socket, [worker.CASU_STATUS])
-            temps.append (temperature)
-            if temperature > worker.CASU_TEMPERATURE + 1 or temperature < worker.CASU_TEMPERATURE - 1:
+        missing = [index for index in xrange (len (temps)) if temps [index] is None]
+        if len (missing) > 0:
+            a_dispatcher = dispatcher.Dispatcher ()
+            replies = a_dispatcher.request_all ([self.workers [index][2] for index in missing], [worker.CASU_STATUS])
+            a_dispatcher.wait ()
+            for index, reply in zip (missing, replies):
+                if reply.error is None:
+                    temps [index] = reply.value
+        for temperature in temps:
+            if temperature is None:
+                good = False
+            elif temperature > worker.CASU_TEMPERATURE + 1 or temperature < worker.CASU_TEMPERATURE - 1:
                 good = False
             else:
                 value += worker.CASU_TEMPERATURE + 1 - temperature
@@ -105,81 +191,69 @@ class AbstractArena:
         Pick a random worker and send the chromosome with the vibration pattern.
         This worker will be the active CASU, while the others are the passive CASU.
         Waits for the response from all workers.  Workers respond when they finish their role.
+        Responses are handled as they arrive, and workers that do not respond within the duration of the iteration video plus a margin are reconnected.
+        If the configuration says so, workers are sent the program of timed CASU actions computed from the timeline of the iteration video.
         """
         #self.selected_worker_index = random.randrange (len (self.workers))
         self.selected_worker_index = 0
+        a_dispatcher = dispatcher.Dispatcher ()
+        a_timeline = timeline.Timeline (config)
+        timeout = a_timeline.duration () + dispatcher.DEADLINE_MARGIN
+        replies = []
         for i in xrange (len (self.workers)):
-            (_, socket, _) = self.workers [i]
-            if i == self.selected_worker_index:
-                zmq_sock_utils.send (socket, [worker.ACTIVE_CASU, chromosome])
+            (_, _, ws) = self.workers [i]
+            active = i == self.selected_worker_index
+            if config.worker_program:
+                if active and config.sound_hardware == 'Zagreb':
+                    message = [worker.PROGRAM, a_timeline.program (config.vibration_pattern (chromosome))]
+                else:
+                    message = [worker.PROGRAM, a_timeline.program ()]
+                replies.append (a_dispatcher.request (ws, message, timeout, print_program_reply))
             else:
-                zmq_sock_utils.send (socket, [worker.PASSIVE_CASU])
+                if active:
+                    message = [worker.ACTIVE_CASU, chromosome]
+                else:
+                    message = [worker.PASSIVE_CASU]
+                replies.append (a_dispatcher.request (ws, message, timeout, dispatcher.print_reply))
         if config.sound_hardware == 'Graz':
             time.sleep (2.0 / config.frame_per_second)
             config.run_vibration_model (chromosome, self.selected_worker_index, config.evaluation_run_time)
+        a_dispatcher.wait ()
         time_start_vibration_pattern = None
-        for (number, socket, _) in self.workers:
-            answer = zmq_sock_utils.recv (socket)
-            if len (answer) == 2:
-                time_start_vibration_pattern = answer [1]
-            print ("Worker responsible for casu #%d responded with: %s" % (number, str (answer)))
+        for reply in replies:
+            if reply.error is None and len (reply.value) >= 2 and reply.value [1] is not None:
+                time_start_vibration_pattern = reply.value [1]
         return time_start_vibration_pattern
 
     def __compare_image_thomas (self, mask, image1, image2):
         """
         Compare two images using the convert program developed by Thomas Schmickl.  This program computes the pixel count difference between two images in a region of interest.
         """
-        command = [
-            CONVERT_BIN_FILENAME,
-            image1,
-            image2,
-            '-compose', 'Subtract',
-            '-composite',
-            '-threshold', '40000',
-            mask,
-            '-compose', 'ModulusSubtract',
-            '-composite',
-            '-print', '%[fx:w*h*mean]',
-            'null:'
-            ]
-        #import functools
-        #print "Running", functools.reduce (lambda x, y: x + " " + y, command)
-        process = subprocess.Popen (command, stdout=subprocess.PIPE)
-        out, _ = process.communicate ()
-        #print mask, image1, image2, out
-        return float (out)
+        return convert_compare_thomas (mask, image1, image2)
         
     def __compare_image_plsm (self, mask, image1, image2):
         """
         Compare two images using the convert program from the ImageMagick suite.  This program computes the pixel count difference between two images in a region of interest.
         """
-        command = [
-            CONVERT_BIN_FILENAME,
-            '(', mask, image1, '-compose', 'multiply', '-composite', ')',
-            '(', mask, image2, '-compose', 'multiply', '-composite', ')',
-            '-metric', 'AE', '-fuzz', self.same_colour_threshold, '-compare',
-            '-format', '%[distortion]', 'info:'
-            ]
-        process = subprocess.Popen (command, stdout=subprocess.PIPE)
-        out, err = process.communicate ()
-        try:
-            value = int (out)
-        except:
-            print ("Result is [" + out + "]")
-            raise
-        return int (out)
+        return convert_compare_plsm (mask, image1, image2, self.same_colour_threshold)
         
-    def compare_images (self, ith_image):
+    def compare_images (self, ith_image, columns = image_comparison.ALL_COLUMNS):
         """
         Compare the background image with the ith image from an iteration video.
+        Comparisons that are not in the given columns are not done and their value is -1.
         """
+        if self.comparison_backend == 'numpy':
+            return self.__compare_images_numpy (ith_image, columns)
         result = []
         for index in xrange (len (self.workers)):
             mask = "%sMask-%d.jpg" % (self.img_path, index)
-            image1 = self.episode_path + 'Background.jpg'
+            image1 = self.background_filename
             image2 = "tmp/iteration-image-%04d.jpg" % (ith_image)
-            result.append (self.__compare_image_plsm (mask, image1, image2))
-            if ith_image > self.delta_image:
+            if image_comparison.BACKGROUND in columns:
+                result.append (self.__compare_image_plsm (mask, image1, image2))
+            else:
+                result.append (-1)
+            if ith_image > self.delta_image and image_comparison.PREVIOUS in columns:
                 mask = "%sMask-%d.jpg" % (self.img_path, index)
                 image1 = "tmp/iteration-image-%04d.jpg" % ith_image
                 image2 = "tmp/iteration-image-%04d.jpg" % (ith_image - self.delta_image)
@@ -187,6 +261,116 @@ class AbstractArena:
             else:
                 result.append (-1)
         return result
+
+    def __compare_images_numpy (self, ith_image, columns):
+        """
+        Compare the background image with the ith image from an iteration video without spawning convert processes.
+        Each iteration image is decoded once and kept in the frame cache while it is needed as the previous frame.
+        """
+        if self.frame_cache is None:
+            self.create_frame_cache ()
+        current = self.frame_cache.get (ith_image)
+        if current is None:
+            current = self.frame_cache.add (ith_image, image_comparison.read_image ("tmp/iteration-image-%04d.jpg" % (ith_image), self.pixel_format, self.analysis_scale))
+        return self.compare_frame_regions (ith_image, current, columns)
+
+    def compare_video_frames (self, frames, selection):
+        """
+        Compare the frames of an iteration video given by an iterator of tuples with the frame index and the frame, such as the one returned by function image_comparison.frame_range.
+        Only the frames in the given selection are kept in the frame cache.
+        This is a generator that yields tuples with the frame index and the result of method compare_images for each selected row.
+        """
+        self.create_frame_cache ()
+        for ith_image, image in frames:
+            if selection.needs_frame (ith_image):
+                current = self.frame_cache.add (ith_image, image)
+                if selection.needs_row (ith_image):
+                    yield (ith_image, self.compare_frame_regions (ith_image, current, selection.columns))
+
+    def compare_frame_regions (self, ith_image, current, columns = image_comparison.ALL_COLUMNS):
+        """
+        Compare the regions of interest of the ith frame with the background and with the frame delta_image frames before.
+        The previous frame is taken from the frame cache.
+        """
+        previous = None
+        if ith_image > self.delta_image and image_comparison.PREVIOUS in columns:
+            previous = self.frame_cache.get (ith_image - self.delta_image)
+            if previous is None:
+                previous = self.frame_cache.crop (image_comparison.read_image ("tmp/iteration-image-%04d.jpg" % (ith_image - self.delta_image), self.pixel_format, self.analysis_scale))
+        return image_comparison.compare_regions (self.compiled_masks, self.background_regions, current, previous, self.same_colour_threshold_value, columns)
+
+    def compare_frames_parallel (self, frame_source, selection, number_processes):
+        """
+        Compare the selected frames of an iteration video using the pool of processes started by function image_comparison.start_comparison_pool.
+
+        The selected rows are split in contiguous ranges, one per process.
+        Each process also decodes the delta_image frames before its range,
+        so that the first frames of the range have a previous frame.
+        Returns a list of tuples with the frame index and the row, in frame
+        order.
+        """
+        self.create_frame_cache ()
+        if len (selection.rows) == 0:
+            return []
+        first_row, last_row = selection.rows [0], selection.rows [-1]
+        shard_length = (last_row - first_row + number_processes) // number_processes
+        tasks = [
+            (self.compiled_masks, self.background_regions, self.same_colour_threshold_value, frame_source, selection,
+             first_frame, min (first_frame + shard_length - 1, last_row))
+            for first_frame in xrange (first_row, last_row + 1, shard_length)]
+        pool = image_comparison.comparison_pool ()
+        if pool is None:
+            raise RuntimeError ("The pool of image comparison processes was not started")
+        shards = pool.map (image_comparison.compare_frame_range, tasks)
+        return [row for shard in shards for row in shard]
+
+    def reset_frame_cache (self):
+        """
+        Empty the frame cache.  This must be done before comparing the images of a new iteration video.
+        """
+        self.frame_cache = None
+
+    def create_frame_cache (self):
+        """
+        Create an empty frame cache for the compiled masks.
+        The background regions are cropped once per episode and kept while the masks do not change.
+        They are taken from the background image kept in memory by the episode, if there is one, otherwise from the background image file.
+        """
+        self.compile_masks ()
+        self.frame_cache = image_comparison.FrameCache (self.compiled_masks, self.delta_image)
+        if self.background_regions is None:
+            if self.background_image is not None:
+                background = image_comparison.downscale_image (image_comparison.convert_image (self.background_image, self.pixel_format), self.analysis_scale)
+            else:
+                background = image_comparison.read_image (self.background_filename, self.pixel_format, self.analysis_scale)
+            self.background_regions = self.frame_cache.crop (background)
+
+    def compile_masks (self):
+        """
+        Compile the regions of interest of this arena into boolean masks cropped to their bounding boxes.
+
+        The compiled masks are saved in file masks.npz next to the arena
+        properties and are reused while the arena geometry does not change.
+        If the analysis scale is greater than one, the masks are compiled for
+        the downscaled images.
+        """
+        geometry = (self.image_width, self.image_height, self.analysis_scale, self.region_of_interests ())
+        if self.compiled_masks is not None and self.compiled_masks_geometry == geometry:
+            return
+        filename = self.img_path + 'masks.npz'
+        masks = image_comparison.load_compiled_masks (filename, geometry)
+        if masks is None:
+            masks = [
+                image_comparison.compile_mask (
+                    self.image_width // self.analysis_scale,
+                    self.image_height // self.analysis_scale,
+                    image_comparison.scale_region_of_interest (roi, self.analysis_scale))
+                for roi in geometry [3]]
+            image_comparison.save_compiled_masks (filename, geometry, masks)
+        self.compiled_masks = masks
+        self.compiled_masks_geometry = geometry
+        self.frame_cache = None
+        self.background_regions = None
         
     def x__write_properties (self, fp):
         fp.write ("""arena_left : %d
@@ -234,14 +418,14 @@ class StadiumBorderArena (AbstractArena):
         """
         subprocess.check_call ([
             CONVERT_BIN_FILENAME,
-            self.episode_path + 'Background.jpg',
+            self.background_filename,
             '-crop', str (self.arena_right - self.arena_left) + 'x' + str (self.arena_bottom - self.arena_top) + '+' + str (self.arena_left) + '+' + str (self.arena_top),
             '-fill', 'rgb(255,255,0)',
             '-tint', '100',
             'Measured-Area-tmp-2.jpg'])
         subprocess.check_call ([
             CONVERT_BIN_FILENAME,
-            self.episode_path + 'Background.jpg',
+            self.background_filename,
             '-draw', 'image SrcOver %d,%d %d,%d Measured-Area-tmp-2.jpg' % (self.arena_left, self.arena_top,  self.arena_right - self.arena_left, self.arena_bottom - self.arena_top),
             'Measured-Area-tmp-3.jpg'])
         x0, y0 = self.arena_left,  self.arena_border_coordinate,
@@ -263,7 +447,7 @@ class StadiumBorderArena (AbstractArena):
         """
         subprocess.check_call ([
             CONVERT_BIN_FILENAME,
-            self.episode_path + 'Background.jpg',
+            self.background_filename,
             '-fill', 'rgb(0,0,0)',
             '-draw', 'rectangle 0,0 %d,%d' % (config.image_width, config.image_height),
             '-fill', 'rgb(255,255,255)',
@@ -271,7 +455,7 @@ class StadiumBorderArena (AbstractArena):
             self.img_path + 'Mask-0.jpg'])
         subprocess.check_call ([
             CONVERT_BIN_FILENAME,
-            self.episode_path + 'Background.jpg',
+            self.background_filename,
             '-fill', 'rgb(0,0,0)',
             '-draw', 'rectangle 0,0 %d,%d' % (config.image_width, config.image_height),
             '-fill', 'rgb(255,255,255)',
@@ -279,18 +463,27 @@ class StadiumBorderArena (AbstractArena):
             self.img_path + 'Mask-1.jpg'])
         subprocess.check_call ([
             CONVERT_BIN_FILENAME,
-            self.episode_path + 'Background.jpg',
+            self.background_filename,
             self.img_path + 'Mask-0.jpg',
             '-compose', 'multiply',
             '-composite',
             self.img_path + 'Arena-Top-CASU.jpg'])
         subprocess.check_call ([
             CONVERT_BIN_FILENAME,
-            self.episode_path + 'Background.jpg',
+            self.background_filename,
             self.img_path + 'Mask-1.jpg',
             '-compose', 'multiply',
             '-composite',
             self.img_path + 'Arena-Bot-CASU.jpg'])
+        self.compile_masks ()
+
+    def region_of_interests (self):
+        """
+        Return the geometry of the regions of interest of the top and bottom CASUs.
+        """
+        return [
+            ('rectangle', self.arena_left, self.arena_top, self.arena_right, self.arena_border_coordinate),
+            ('rectangle', self.arena_left, self.arena_border_coordinate, self.arena_right, self.arena_bottom)]
 
     def image_processing_header (self):
         return ["background_top", "previous_iteration_top", "background_bottom", "previous_iteration_bottom"]
@@ -332,7 +525,7 @@ class CircularArena (AbstractArena):
     def create_region_of_interests_image (self):
         subprocess.check_call ([
             CONVERT_BIN_FILENAME,
-            self.episode_path + 'Background.jpg',
+            self.background_filename,
             '-fill', '#FFFF007F',
             '-draw', 'circle %d,%d %d,%d' % (self.arena_center_x, self.arena_center_y, self.arena_center_x, self.arena_center_y + self.arena_radius), 
             self.img_path + 'Region-of-Interests.jpg'])
@@ -345,7 +538,14 @@ class CircularArena (AbstractArena):
             '-fill', '#FFFFFF',
             '-draw', 'circle %d,%d %d,%d' % (self.arena_center_x, self.arena_center_y, self.arena_center_x, self.arena_center_y + self.arena_radius), 
             self.img_path + 'Mask-0.jpg'])
-            
+        self.compile_masks ()
+
+    def region_of_interests (self):
+        """
+        Return the geometry of the circular region of interest.
+        """
+        return [('circle', self.arena_center_x, self.arena_center_y, self.arena_radius)]
+
     def image_processing_header (self):
         return ["background", "previous_iteration"]
 
@@ -398,7 +598,7 @@ class TwoBoxesArena (AbstractArena):
     def create_region_of_interests_image (self):
         subprocess.check_call ([
             CONVERT_BIN_FILENAME,
-            self.episode_path + 'Background.jpg',
+            self.background_filename,
             '-fill', '#FFFF007F',
             '-draw', 'rectangle %d,%d %d,%d' % (self.roi_left [0], self.roi_top [0], self.roi_right [0], self.roi_bottom [0]),
             '-draw', 'rectangle %d,%d %d,%d' % (self.roi_left [1], self.roi_top [1], self.roi_right [1], self.roi_bottom [1]),
@@ -413,6 +613,15 @@ class TwoBoxesArena (AbstractArena):
                 '-fill', '#FFFFFF',
                 '-draw', 'rectangle %d,%d %d,%d' % (self.roi_left [index], self.roi_top [index], self.roi_right [index], self.roi_bottom [index]),
                 self.img_path + 'Mask-%d.jpg' % (index)])
+        self.compile_masks ()
+
+    def region_of_interests (self):
+        """
+        Return the geometry of the two boxes.
+        """
+        return [
+            ('rectangle', self.roi_left [index], self.roi_top [index], self.roi_right [index], self.roi_bottom [index])
+            for index in xrange (2)]
 
     def image_processing_header (self):
         return ["background_first", "previous_iteration_first", "background_second", "previous_iteration_second"]
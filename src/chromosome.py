@@ -55,8 +55,19 @@ class AbstractChromosome:
     """
     All chromosomes used by the incremental evolution algorithm must have the following set of static methods:
     run_vibration_model (chromosome, casu, evaluation_run_time)
+    vibration_pattern (chromosome)
     random_generator (random, args)
     """
+    @staticmethod
+    def pulse_vibration_pattern (pulse):
+        """
+        Return the vibration pattern of a single pulse as a tuple with the periods, frequencies and amplitudes.
+        """
+        vibe_periods = [pulse.vibration_period,  pulse.pause_period]
+        vibe_freqs   = [       pulse.frequency,                   1]
+        vibe_amps    = [       pulse.amplitude,                   0]
+        return (vibe_periods, vibe_freqs, vibe_amps)
+
     @staticmethod
     def run_vibration_model_Zagreb_SinglePulse (the_casu, vibration_run_time, no_stimuli_run_time, number_repetitions, pulse):
         '''
@@ -66,9 +77,7 @@ class AbstractChromosome:
         number_repetitions times.  Finally the CASU vibrates for vibration_run_time seconds.
         '''
         print 'running vibration model', vibration_run_time, no_stimuli_run_time, number_repetitions, pulse
-        vibe_periods = [pulse.vibration_period,  pulse.pause_period]
-        vibe_freqs   = [       pulse.frequency,                   1]
-        vibe_amps    = [       pulse.amplitude,                   0]
+        (vibe_periods, vibe_freqs, vibe_amps) = AbstractChromosome.pulse_vibration_pattern (pulse)
         for _ in xrange (number_repetitions):
             the_casu.set_vibration_pattern (vibe_periods, vibe_freqs, vibe_amps)
             time.sleep (vibration_run_time)
@@ -113,6 +122,16 @@ class SinglePulseGenePause (AbstractChromosome):
         """
         Run the vibration model represented by the given SinglePulseGenePause chromosome.
         """
+        (vibe_periods, vibe_freqs, vibe_amps) = SinglePulseGenePause.vibration_pattern (chromosome)
+        the_casu.set_vibration_pattern (vibe_periods, vibe_freqs, vibe_amps)
+        time.sleep (evaluation_run_time)
+        the_casu.speaker_standby ()
+
+    @staticmethod
+    def vibration_pattern (chromosome):
+        """
+        Return the vibration pattern of the given SinglePulseGenePause chromosome as a tuple with the periods, frequencies and amplitudes.
+        """
         pause_period = chromosome [0]
         if pause_period < assisipy.casu.VIBE_PERIOD_MIN:
             vibe_periods = [SinglePulseGenePause.VIBRATION_PERIOD]
@@ -122,9 +141,7 @@ class SinglePulseGenePause (AbstractChromosome):
             vibe_periods = [SinglePulseGenePause.VIBRATION_PERIOD,    pause_period]
             vibe_freqs   = [SinglePulseGenePause.VIBRATION_FREQUENCY,            0]
             vibe_amps    = [SinglePulseGenePause.VIBRATION_INTENSITY,            0]
-        the_casu.set_vibration_pattern (vibe_periods, vibe_freqs, vibe_amps)
-        time.sleep (evaluation_run_time)
-        the_casu.speaker_standby ()
+        return (vibe_periods, vibe_freqs, vibe_amps)
 
     @staticmethod
     def run_vibration_model_v2 (chromosome, index, evaluation_run_time):
@@ -190,11 +207,25 @@ class SinglePulseGeneFrequency (AbstractChromosome):
         """
         AbstractChromosome.run_vibration_model_Zagreb_SinglePulse (
             the_casu, vibration_run_time, no_stimuli_run_time, number_repetitions,
-            Pulse (
-                frequency        = chromosome [0],
-                pause_period     = SinglePulseGeneFrequency.PAUSE_PERIOD,
-                vibration_period = SinglePulseGeneFrequency.VIBRATION_PERIOD,
-                amplitude        = SinglePulseGeneFrequency.VIBRATION_INTENSITY))
+            SinglePulseGeneFrequency.pulse (chromosome))
+
+    @staticmethod
+    def pulse (chromosome):
+        """
+        Return the pulse represented by the given SinglePulseGeneFrequency chromosome.
+        """
+        return Pulse (
+            frequency        = chromosome [0],
+            pause_period     = SinglePulseGeneFrequency.PAUSE_PERIOD,
+            vibration_period = SinglePulseGeneFrequency.VIBRATION_PERIOD,
+            amplitude        = SinglePulseGeneFrequency.VIBRATION_INTENSITY)
+
+    @staticmethod
+    def vibration_pattern (chromosome):
+        """
+        Return the vibration pattern of the given SinglePulseGeneFrequency chromosome as a tuple with the periods, frequencies and amplitudes.
+        """
+        return AbstractChromosome.pulse_vibration_pattern (SinglePulseGeneFrequency.pulse (chromosome))
 
     @staticmethod
     def run_vibration_model_v2 (chromosome, index, evaluation_run_time):
@@ -254,6 +285,16 @@ class SinglePulseGenesPulse (AbstractChromosome):
         """
         Run the vibration model represented by the given SinglePulseGenesPulse chromosome.
         """
+        (vibe_periods, vibe_freqs, vibe_amps) = SinglePulseGenesPulse.vibration_pattern (chromosome)
+        the_casu.set_vibration_pattern (vibe_periods, vibe_freqs, vibe_amps)
+        time.sleep (evaluation_run_time)
+        the_casu.speaker_standby ()
+
+    @staticmethod
+    def vibration_pattern (chromosome):
+        """
+        Return the vibration pattern of the given SinglePulseGenesPulse chromosome as a tuple with the periods, frequencies and amplitudes.
+        """
         frequency       = chromosome [0]
         duration_period = chromosome [1]
         pause_period    = chromosome [2]
@@ -266,9 +307,7 @@ class SinglePulseGenesPulse (AbstractChromosome):
             vibe_periods = [duration_period,  pause_period]
             vibe_freqs   = [frequency,        1]
             vibe_amps    = [intensity,        0]
-        the_casu.set_vibration_pattern (vibe_periods, vibe_freqs, vibe_amps)
-        time.sleep (evaluation_run_time)
-        the_casu.speaker_standby ()
+        return (vibe_periods, vibe_freqs, vibe_amps)
 
     @staticmethod
     def run_vibration_model_v2 (chromosome, index, evaluation_run_time):
@@ -347,11 +386,25 @@ class SinglePulse1sGenesFrequencyPause (AbstractChromosome):
         """
         AbstractChromosome.run_vibration_model_Zagreb_SinglePulse (
             the_casu, vibration_run_time, no_stimuli_run_time, number_repetitions,
-            Pulse (
-                frequency        = chromosome [0],
-                pause_period     = chromosome [1],
-                vibration_period = SinglePulse1sGenesFrequencyPause.PULSE_PERIOD - chromosome [1],
-                amplitude        = SinglePulse1sGenesFrequencyPause.VIBRATION_AMPLITUDE))
+            SinglePulse1sGenesFrequencyPause.pulse (chromosome))
+
+    @staticmethod
+    def pulse (chromosome):
+        """
+        Return the pulse represented by the given SinglePulse1sGenesFrequencyPause chromosome.
+        """
+        return Pulse (
+            frequency        = chromosome [0],
+            pause_period     = chromosome [1],
+            vibration_period = SinglePulse1sGenesFrequencyPause.PULSE_PERIOD - chromosome [1],
+            amplitude        = SinglePulse1sGenesFrequencyPause.VIBRATION_AMPLITUDE)
+
+    @staticmethod
+    def vibration_pattern (chromosome):
+        """
+        Return the vibration pattern of the given SinglePulse1sGenesFrequencyPause chromosome as a tuple with the periods, frequencies and amplitudes.
+        """
+        return AbstractChromosome.pulse_vibration_pattern (SinglePulse1sGenesFrequencyPause.pulse (chromosome))
 
     @staticmethod
     def run_vibration_model_v2 (chromosome, index, evaluation_run_time):
@@ -425,11 +478,25 @@ class SinglePulse1sGenesPulse (AbstractChromosome):
         """
         AbstractChromosome.run_vibration_model_Zagreb_SinglePulse (
             the_casu, vibration_run_time, no_stimuli_run_time, number_repetitions,
-            Pulse (
-                frequency        = chromosome [0],
-                pause_period     = chromosome [1],
-                vibration_period = SinglePulse1sGenesPulse.PULSE_PERIOD - chromosome [1],
-                amplitude        = chromosome [2]))
+            SinglePulse1sGenesPulse.pulse (chromosome))
+
+    @staticmethod
+    def pulse (chromosome):
+        """
+        Return the pulse represented by the given SinglePulse1sGenesPulse chromosome.
+        """
+        return Pulse (
+            frequency        = chromosome [0],
+            pause_period     = chromosome [1],
+            vibration_period = SinglePulse1sGenesPulse.PULSE_PERIOD - chromosome [1],
+            amplitude        = chromosome [2])
+
+    @staticmethod
+    def vibration_pattern (chromosome):
+        """
+        Return the vibration pattern of the given SinglePulse1sGenesPulse chromosome as a tuple with the periods, frequencies and amplitudes.
+        """
+        return AbstractChromosome.pulse_vibration_pattern (SinglePulse1sGenesPulse.pulse (chromosome))
 
     @staticmethod
     def run_vibration_model_v2 (chromosome, index, evaluation_run_time):
@@ -480,6 +547,7 @@ class Method:
         self.run_vibration_model = {
             'Zagreb' : class_name.run_vibration_model    ,
             'Graz'   : class_name.run_vibration_model_v2 }
+        self.vibration_pattern = class_name.vibration_pattern
         self.variator = class_name.get_variator
         self.generator = class_name.random_generator
         self.get_genes = class_name.get_genes
@@ -100,6 +100,67 @@ Which chromosome type (vibration pattern) to use''',
                 'same_colour_threshold',                'Threshold to use when computing difference in pixel color',                 path_in_dictionary = ['image_processing'],
                 parse_data = functools.partial (best_config.compose, f = functools.partial (best_config.between, min_value = 0, max_value = 0), g = int), default_value = 25),
             Parameter ('interval_current_previous_frame',      'Time distance between compared frames',                                     path_in_dictionary = ['image_processing'], default_value = 1),
+            Parameter (
+                'comparison_backend',
+                '''1 - convert program from the ImageMagick suite
+2 - in-process comparison with NumPy
+Which program to use when comparing images''',
+                path_in_dictionary = ['image_processing'],
+                parse_data = lambda x : best_config.list_element (
+                    [
+                        'convert',
+                        'numpy'
+                    ],
+                    x),
+                default_value = 'convert'),
+            Parameter (
+                'frame_source',
+                '''1 - split the iteration video into images in folder tmp
+2 - decode the iteration video through a pipe
+Where the images compared by the NumPy backend come from''',
+                path_in_dictionary = ['image_processing'],
+                parse_data = lambda x : best_config.list_element (
+                    [
+                        'split',
+                        'stream'
+                    ],
+                    x),
+                default_value = 'split'),
+            Parameter (
+                'pixel_format',
+                '''1 - RGB
+2 - grayscale
+Pixel format of the images compared by the NumPy backend''',
+                path_in_dictionary = ['image_processing'],
+                parse_data = lambda x : best_config.list_element (
+                    [
+                        'rgb24',
+                        'gray'
+                    ],
+                    x),
+                default_value = 'rgb24'),
+            Parameter ('live_analysis', 'Compare images and compute the evaluation while the iteration video is being recorded', path_in_dictionary = ['image_processing'], parse_data = best_config.str2bool, default_value = False),
+            Parameter ('background_scoring', 'Compare the images and compute the value of an evaluation in a background thread while the next evaluation of the chromosome runs', path_in_dictionary = ['image_processing'], parse_data = best_config.str2bool, default_value = False),
+            Parameter ('image_processing_workers', 'Number of processes used to compare the images of an iteration video', path_in_dictionary = ['image_processing'], parse_data = int, default_value = 1),
+            Parameter ('lazy_frame_selection', 'Compare only the frames and regions used by the fitness function, the other pixel counts are written as -1', path_in_dictionary = ['image_processing'], parse_data = best_config.str2bool, default_value = False),
+            Parameter ('image_processing_csv', 'Also write the pixel counts of each evaluation in a CSV file', path_in_dictionary = ['image_processing'], parse_data = best_config.str2bool, default_value = True),
+            Parameter ('analysis_scale', 'Integer factor by which the NumPy backend downscales the images before comparing them', path_in_dictionary = ['image_processing'], parse_data = int, default_value = 1),
+            Parameter (
+                'background_model',
+                '''1 - single frame extracted from a one frame video
+2 - per pixel median of several frames
+3 - per pixel mean of several frames
+How the background image of an episode is computed''',
+                path_in_dictionary = ['image_processing'],
+                parse_data = lambda x : best_config.list_element (
+                    [
+                        'single',
+                        'median',
+                        'mean'
+                    ],
+                    x),
+                default_value = 'single'),
+            Parameter ('background_number_frames', 'Number of frames used to compute a median or mean background image', path_in_dictionary = ['image_processing'], parse_data = int, default_value = 25),
             Parameter (
                 'sound_hardware',
                 '''1 - CASU
@@ -126,6 +187,29 @@ Which method to use when computing the chromosome fitness from a set of evaluati
                     x),
                 default_value = 'average'
             ),
+            Parameter (
+                'evaluation_cache',
+                '''1 - always evaluate a chromosome
+2 - reuse previous evaluations of a chromosome with the same genes
+3 - reuse previous evaluations and evaluate until there are evaluation_cache_replicates evaluations
+When to reuse the evaluations of a chromosome done in previous generations''',
+                path_in_dictionary = ['evaluation'],
+                parse_data = lambda x : best_config.list_element (
+                    [
+                        'always',
+                        'reuse',
+                        'top_up'
+                    ],
+                    x),
+                default_value = 'always'),
+            Parameter ('evaluation_cache_replicates', 'Number of evaluations of a chromosome with the top up evaluation cache policy, at least the number of evaluations per chromosome', path_in_dictionary = ['evaluation'], parse_data = int, default_value = 0),
+            Parameter ('evaluation_cache_max_age', 'Maximum age in generations of a reused evaluation, a negative value means no limit', path_in_dictionary = ['evaluation'], parse_data = int, default_value = -1),
+            Parameter ('racing', 'Stop evaluating a chromosome when an upper confidence bound of its fitness is below the fitness of the worst survivor, requires the average evaluation values reduce function', path_in_dictionary = ['evaluation'], parse_data = best_config.str2bool, default_value = False),
+            Parameter ('racing_z', 'Number of standard errors above the mean evaluation value used as the racing upper confidence bound', path_in_dictionary = ['evaluation'], parse_data = float, default_value = 2.0),
+            Parameter ('racing_minimum_evaluations', 'Minimum number of evaluations of a chromosome before racing can stop its evaluation', path_in_dictionary = ['evaluation'], parse_data = int, default_value = 1),
+            Parameter ('telemetry_staleness', 'Maximum age in seconds of the CASU temperatures published by the workers, older temperatures are requested from the workers, zero means always request them', path_in_dictionary = ['evaluation'], parse_data = float, default_value = 5.0),
+            Parameter ('worker_program', 'Send the workers the timed CASU actions of an iteration video computed from the frame timeline instead of the active and passive CASU commands', path_in_dictionary = ['evaluation'], parse_data = best_config.str2bool, default_value = False),
+            Parameter ('concurrent_arenas', 'Evaluate chromosomes in all the arenas with suitable CASU temperatures at the same time', path_in_dictionary = ['evaluation'], parse_data = best_config.str2bool, default_value = False),
             Parameter ('vibration_period',  'vibration period used in chromosome with single gene that represents vibration frequency', path_in_dictionary = ['chromosome', 'single_pulse_gene_frequency'], parse_data = int, default_value = -1),
             Parameter ('image_width',  'Image width in pixels',  parse_data = int, default_value = 600),
             Parameter ('image_height', 'Image height in pixels', parse_data = int, default_value = 600),
@@ -141,6 +225,7 @@ Which method to use when computing the chromosome fitness from a set of evaluati
             cm = None
             cm = chromosome.CHROMOSOME_METHODS [self.chromosome_type]
             self.run_vibration_model = cm.run_vibration_model [self.sound_hardware]
+            self.vibration_pattern = cm.vibration_pattern
         except KeyError as e:
             if cm is None:
                 print ('Invalid chromosome type', self.chromosome_type)
@@ -153,6 +238,39 @@ Which method to use when computing the chromosome fitness from a set of evaluati
             self.parameters_as_dict ['vibration_run_time'].value = self.evaluation_run_time
             print ('\nUsing deprecated configuration parameter \'evaluation_run_time\' for parameter \'vibration_run_time\'')
             raw_input ('Press ENTER to continue')
+        if self.frame_source == 'stream' and self.comparison_backend != 'numpy':
+            print ('Decoding the iteration video through a pipe requires the numpy comparison backend')
+            sys.exit (1)
+        if self.live_analysis and self.comparison_backend != 'numpy':
+            print ('Live analysis requires the numpy comparison backend')
+            sys.exit (1)
+        if self.image_processing_workers > 1 and self.comparison_backend != 'numpy':
+            print ('Comparing images with several processes requires the numpy comparison backend')
+            sys.exit (1)
+        if self.analysis_scale < 1:
+            print ('The analysis scale must be a positive integer')
+            sys.exit (1)
+        if self.analysis_scale > 1 and self.comparison_backend != 'numpy':
+            print ('Downscaling images requires the numpy comparison backend')
+            sys.exit (1)
+        if self.analysis_scale > 1:
+            # pixel counts in downscaled images are smaller by the square of the scale
+            area_scale = self.analysis_scale * self.analysis_scale
+            for name in ['pixel_count_background_threshold', 'pixel_count_previous_frame_threshold', 'bee_area_pixels']:
+                self.parameters_as_dict [name].value = int (round (float (self.parameters_as_dict [name].value) / area_scale))
+            print ('\nImages are downscaled by %d, pixel count thresholds and bee area are divided by %d' % (self.analysis_scale, area_scale))
+        if not self.has_blip and not self.worker_program:
+            print ('The active and passive CASU commands always blip, blips are kept in the timeline unless workers run programs')
+        if self.concurrent_arenas and self.racing:
+            print ('Racing is not available with concurrent arenas')
+            sys.exit (1)
+        if self.racing and self.evaluation_values_reduce != 'average':
+            # the racing bound is on the mean evaluation value, which is only on the scale of the fitness with the average
+            print ('Racing requires the average evaluation values reduce function')
+            sys.exit (1)
+        if self.concurrent_arenas and (self.live_analysis or self.sound_hardware == 'Graz'):
+            print ('Concurrent arenas require the CASU sound hardware and no live analysis')
+            sys.exit (1)
         self._evaluation_run_time = self.number_repetitions * (self.vibration_run_time + self.no_stimuli_run_time) + self.vibration_run_time
 
     def status (self):
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Dispatch commands to several workers and handle their replies as they arrive.
+
+The master sends a command to each worker through its REQ socket and
+then waits for the replies.  Instead of receiving from each socket in
+turn, the dispatcher polls all the sockets with pending requests and
+handles each reply as soon as it arrives, so a slow CASU does not delay
+the others.  Each request has a deadline.  A worker that does not reply
+before its deadline is reported and its socket is reconnected, as a REQ
+socket cannot send again until it receives a reply.  If the worker is
+running the command of the request, the command is aborted.  Requests
+that do not own the worker, such as CASU_STATUS sent while a command is
+running, are dropped without aborting anything.
+
+Method request returns a Reply, which is a future of the reply of the
+worker.  Callers can send commands to several workers, do other work, and
+then wait for the replies.
+"""
+
+import worker
+import zmq_sock_utils
+
+import time
+import zmq
+
+DEADLINE_MARGIN = 30
+"""
+Seconds added to the expected duration of a command to get its deadline.
+"""
+
+COMMAND_TIMEOUTS = {
+    worker.INITIALISE   : 60,
+    worker.CASU_STATUS  : 10,
+    worker.STANDBY_CASU : DEADLINE_MARGIN,
+    worker.TERMINATE    : 60,
+    }
+"""
+Default timeout in seconds of commands whose duration does not depend on their arguments.
+Commands that are not in this dictionary have no default timeout.
+"""
+
+LONG_COMMANDS = [
+    worker.ACTIVE_CASU,
+    worker.PASSIVE_CASU,
+    worker.VIBRATION_PATTERN_440_09_01,
+    worker.SPREAD_BEES,
+    worker.PROGRAM,
+    ]
+"""
+Commands that take time and own the worker while they run.
+Only these commands are aborted when their request times out.
+"""
+
+class WorkerTimeout (Exception):
+    """
+    Raised by method Reply.result when a worker did not reply before the deadline of the request.
+    """
+    def __init__ (self, worker_settings, message, timeout):
+        Exception.__init__ (self, "Worker responsible for casu #%d did not reply to %s within %ds" % (worker_settings.casu_number, str (message), timeout))
+        self.worker_settings = worker_settings
+
+class Reply:
+    """
+    Future of the reply of a worker to a request.
+    """
+    def __init__ (self, a_dispatcher, worker_settings, message, timeout, callback):
+        self.dispatcher = a_dispatcher
+        self.worker_settings = worker_settings
+        self.message = message
+        self.timeout = timeout
+        self.time_sent = time.time ()
+        self.deadline = None if timeout is None else self.time_sent + timeout
+        self.callback = callback
+        self.finished = False
+        self.value = None
+        self.error = None
+
+    def done (self):
+        return self.finished
+
+    def result (self):
+        """
+        Wait for the reply and return it.
+        Raises WorkerTimeout if the worker did not reply before the deadline.
+        """
+        self.dispatcher.wait ([self])
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def set_value (self, value):
+        self.finished = True
+        self.value = value
+        if self.callback is not None:
+            self.callback (self)
+
+    def set_error (self, error):
+        self.finished = True
+        self.error = error
+        if self.callback is not None:
+            self.callback (self)
+
+class Dispatcher:
+    """
+    Sends requests to workers and polls their sockets for the replies.
+    A dispatcher must only be used by one thread, and a worker must not have pending requests in two dispatchers.
+    """
+    def __init__ (self):
+        self.poller = zmq.Poller ()
+        self.pending = {}
+
+    def request (self, worker_settings, message, timeout = None, callback = None):
+        """
+        Send a message to a worker and return the future of its reply.
+
+        If the timeout is None, the default timeout of the command is used.
+        The callback, if given, is called with the Reply as soon as the reply
+        arrives or the deadline passes.  If the worker has a pending request,
+        its reply is waited for first.
+        """
+        if timeout is None:
+            timeout = COMMAND_TIMEOUTS.get (message [0])
+        previous = self.pending.get (worker_settings.socket)
+        if previous is not None:
+            self.wait ([previous])
+        zmq_sock_utils.send (worker_settings.socket, message)
+        result = Reply (self, worker_settings, message, timeout, callback)
+        self.pending [worker_settings.socket] = result
+        self.poller.register (worker_settings.socket, zmq.POLLIN)
+        return result
+
+    def request_all (self, workers_settings, message, timeout = None, callback = None):
+        """
+        Send a message to several workers and return the list of futures of their replies.
+        """
+        return [self.request (worker_settings, message, timeout, callback) for worker_settings in workers_settings]
+
+    def wait (self, replies = None):
+        """
+        Handle the replies of the workers as they arrive until the given replies are done, or all pending replies if none are given.
+        """
+        if replies is None:
+            replies = self.pending.values ()
+        while not all (reply.done () for reply in replies):
+            deadlines = [reply.deadline for reply in self.pending.values () if reply.deadline is not None]
+            if len (deadlines) > 0:
+                poll_timeout = max (0, min (deadlines) - time.time ()) * 1000
+            else:
+                poll_timeout = None
+            for socket, _ in self.poller.poll (poll_timeout):
+                reply = self.finish (socket)
+                reply.set_value (zmq_sock_utils.recv (socket))
+            now = time.time ()
+            for socket, reply in self.pending.items ():
+                if reply.deadline is not None and reply.deadline <= now:
+                    self.finish (socket)
+                    self.expire (reply)
+
+    def expire (self, reply):
+        """
+        Handle a request whose deadline passed.
+        The command the worker is running is only aborted if it is the command of the request.
+        """
+        ws = reply.worker_settings
+        print ("Worker responsible for casu #%d did not reply to %s within %ds, reconnecting..." % (
+            ws.casu_number, str (reply.message), reply.timeout))
+        if reply.message [0] in LONG_COMMANDS:
+            status = ws.heartbeat ()
+            if status is not None and status [0] == reply.message [0]:
+                print ("Aborting command %d of worker responsible for casu #%d..." % (reply.message [0], ws.casu_number))
+                ws.abort ()
+        ws.reconnect ()
+        reply.set_error (WorkerTimeout (ws, reply.message, reply.timeout))
+
+    def finish (self, socket):
+        self.poller.unregister (socket)
+        return self.pending.pop (socket)
+
+def print_reply (reply):
+    """
+    Callback that prints the reply of a worker.
+    """
+    if reply.error is None:
+        print ("Worker responsible for casu #%d responded with: %s" % (reply.worker_settings.casu_number, str (reply.value)))
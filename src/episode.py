@@ -2,8 +2,9 @@
 # -*- coding: utf-8 -*-
 
 import arena
+import dispatcher
+import image_comparison
 import worker
-import zmq_sock_utils
 
 import subprocess
 import os
@@ -30,6 +31,7 @@ class Episode:
         self.experiment_folder = experiment_folder
         self.current_evaluation_in_episode = 0
         self.episode_index = episode_index
+        self.background_image = None
 
     def initialise (self):
         """
@@ -68,19 +70,13 @@ class Episode:
                 seconds = int (ans)
                 print "Spreading bees for %d seconds..." % (seconds)
                 #self.episode.spread_bees (seconds)
+                a_dispatcher = dispatcher.Dispatcher ()
                 for arena in self.arenas:
-                    for (_, socket, _) in arena.workers:
-                        zmq_sock_utils.send (socket, [worker.SPREAD_BEES, seconds])
-                for arena in self.arenas:
-                    for (number, socket, _) in arena.workers:
-                        answer = zmq_sock_utils.recv (socket)
-                        print ("Worker responsible for casu #%d responded with: %s" % (number, str (answer)))
+                    a_dispatcher.request_all ([ws for (_, _, ws) in arena.workers], [worker.SPREAD_BEES, seconds], seconds + dispatcher.DEADLINE_MARGIN, dispatcher.print_reply)
+                a_dispatcher.wait ()
             except ValueError:
                 if ans == 'replace bees':
-                    self.finish ()
-                    self.episode_index += 1
-                    self.initialise ()
-                    self.current_evaluation_in_episode = 0
+                    self.new_episode ()
                     interact = False
                 else:
                     interact = ans != ''
@@ -91,14 +87,25 @@ class Episode:
         """
         Increment the evaluation counter.  If we have reached the end of an episode, we finish it and start a new episode.
         """
-        if (self.current_evaluation_in_episode == self.config.number_evaluations_per_episode):
-            print "\n\n* ** New Episode ** *"
-            self.finish ()
-            self.episode_index += 1
-            self.initialise ()
-            self.current_evaluation_in_episode = 1
-        else:
-            self.current_evaluation_in_episode += 1
+        if self.evaluations_left () == 0:
+            self.new_episode ()
+        self.current_evaluation_in_episode += 1
+
+    def evaluations_left (self):
+        """
+        Return how many evaluations can still be done in the current episode.
+        """
+        return self.config.number_evaluations_per_episode - self.current_evaluation_in_episode
+
+    def new_episode (self):
+        """
+        Finish the current episode and start a new one with new bees.
+        """
+        print "\n\n* ** New Episode ** *"
+        self.finish ()
+        self.episode_index += 1
+        self.initialise ()
+        self.current_evaluation_in_episode = 0
 
     def make_background_image (self):
         """
@@ -109,8 +116,25 @@ class Episode:
         background video and images are created at start of an experiment
         and everytime we change bees.  Whenever we change bees, we may
         disturb the arena.  The bee aggregation is sensitive to changes between the background image and evaluation images.
+
+        If the background model is not a single frame, the background is
+        the per pixel median or mean of several frames captured through a
+        pipe.  It is kept in memory for the comparisons done in this
+        episode, and it is saved in a lossless image for the record and for
+        the programs that draw the arena images.
         """
         print "\n\n* ** Creating background image..."
+        if self.config.background_model != 'single':
+            frames = image_comparison.camera_frames (
+                self.config.image_width,
+                self.config.image_height,
+                self.config.frame_per_second,
+                self.config.background_number_frames)
+            self.background_image = image_comparison.background_model (frames, self.config.background_model)
+            image_comparison.save_image (self.current_path + 'Background.png', self.background_image)
+            print ("background image is ready")
+            return
+        self.background_image = None
         filename = self.current_path + 'Background.avi'
         bashCommand = 'gst-launch-0.10 --gst-plugin-path=/usr/local/lib/gstreamer-0.10/ --gst-plugin-load=libgstaravis-0.4.so -v aravissrc num-buffers=1 ' + \
                       '! video/x-raw-yuv,width=' + str (self.config.image_width) + ',height=' + str (self.config.image_height) + ',framerate=' + str (int (self.config.frame_per_second)) + '/1' + \
@@ -138,7 +162,7 @@ class Episode:
         p = subprocess.Popen ([
             '/usr/bin/gimp',
             '--no-data',
-            self.current_path + "Background.jpg"])
+            image_comparison.background_filename (self.current_path)])
         go = True
         self.arenas = []
         index = 1
@@ -165,6 +189,7 @@ class Episode:
                 if roi_ko:
                     new_arena.unselect_workers ()
                 display_process.kill ()
+            new_arena.background_image = self.background_image
             self.arenas.append (new_arena)
             new_arena.create_mask_images_casu_images (self.config)
             new_arena.write_properties ()
@@ -200,6 +225,24 @@ class Episode:
             picked += 1
         print ("Picked arena #%d." % (picked + 1))
         return self.arenas [picked]
+
+    def select_arenas (self):
+        """
+        Check the status of the arenas and select all the arenas whose CASU temperatures are suitable to run a vibration pattern.
+        Returns the selected arenas in arena order.
+        """
+        while True:
+            result = []
+            for an_arena in self.arenas:
+                (value, temps) = an_arena.status ()
+                print ("Temperature status: %s." % (str (temps)))
+                if value > 0:
+                    result.append (an_arena)
+            if len (result) > 0:
+                print ("Picked arenas %s." % (", ".join ("#%d" % (an_arena.index) for an_arena in result)))
+                return result
+            print ("All arenas have a temperature above the minimum threshold!")
+            raw_input ("Press ENTER to try again. ")
         
     def finish (self, end_evolutionary_algorithm = False):
         """
@@ -221,8 +264,7 @@ if __name__ == '__main__':
     cfg = config.Config ()
     for ws in lws:
         print ws
-        ws.connect_to_worker (cfg)
-    dws = dict ([(ws.casu_number, ws) for ws in lws])
+    dws = worker_settings.ConnectionManager ().connect_to_workers (lws, cfg)
     epsd = Episode (cfg, dws, '/tmp/assisi/')
     epsd.initialise ()
     epsd.ask_user (None)
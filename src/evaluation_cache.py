@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cache of the evaluation values of the chromosomes of an experimental run.
+
+The genes are discrete, so the evolutionary algorithm often produces
+chromosomes that were evaluated in earlier generations.  Each evaluation
+takes minutes of bee time.  The cache is keyed on the genes of a
+chromosome and holds the generation and value of each of its
+evaluations.  It is loaded from file evaluation.csv, so that a continued
+run also reuses the evaluations done before it was stopped, and it is
+updated with every new evaluation.
+
+The cache policy decides how many evaluations of a chromosome are done:
+
+always
+    every chromosome is evaluated number_evaluations_per_chromosome times,
+    which is the behaviour without cache;
+
+reuse
+    cached evaluations count towards the number_evaluations_per_chromosome
+    evaluations of a chromosome;
+
+top_up
+    cached evaluations are reused and new evaluations are done until
+    there are evaluation_cache_replicates evaluations, so that chromosomes
+    that survive several generations get a better estimate of their
+    fitness.
+
+Evaluations older than the maximum age in generations are not reused.
+"""
+
+import csv
+import math
+import os.path
+
+# Column indexes in file evaluation.csv
+EVA_GENERATION       = 0
+EVA_EPISODE          = 1
+EVA_ITERATION        = 2
+EVA_SELECTED_ARENA   = 3
+EVA_ACTIVE_CASU      = 4
+EVA_TIMESTAMP        = 5
+EVA_VALUE            = 6
+EVA_CHROMOSOME_GENES = 7
+
+ALWAYS = 'always'
+REUSE = 'reuse'
+TOP_UP = 'top_up'
+
+class EvaluationCache:
+    """
+    Evaluation values of the chromosomes of an experimental run keyed on their genes.
+    """
+    def __init__ (self, config, experiment_folder, load = True):
+        """
+        Create the cache of the given run.  If load is true, the cache starts with the evaluations in file evaluation.csv of the run.
+        """
+        self.policy = config.evaluation_cache
+        self.max_age = config.evaluation_cache_max_age
+        if self.policy == TOP_UP:
+            self.number_replicates = max (config.evaluation_cache_replicates, config.number_evaluations_per_chromosome)
+        else:
+            self.number_replicates = config.number_evaluations_per_chromosome
+        self.experiment_folder = experiment_folder
+        self.evaluations = {}
+        self.statistics = {}
+        filename = experiment_folder + "evaluation.csv"
+        if load and os.path.exists (filename):
+            with open (filename, 'r') as fp:
+                freader = csv.reader (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
+                freader.next () # skip header row
+                for row in freader:
+                    self.add (row [EVA_GENERATION], row [EVA_CHROMOSOME_GENES:], row [EVA_VALUE])
+                fp.close ()
+
+    def add (self, generation, chromosome, value):
+        """
+        Record an evaluation of the chromosome done in the given generation.
+        """
+        self.evaluations.setdefault (chromosome_key (chromosome), []).append ((int (generation), value))
+
+    def cached_values (self, generation, chromosome):
+        """
+        Return the values of the evaluations of the chromosome that can be reused in the given generation, most recent last.
+        """
+        if self.policy == ALWAYS:
+            return []
+        return [
+            value
+            for evaluation_generation, value in self.evaluations.get (chromosome_key (chromosome), [])
+            if self.max_age < 0 or generation - evaluation_generation <= self.max_age
+            ] [-self.number_replicates:]
+
+    def pooled_standard_deviation (self, chromosome, values):
+        """
+        Return the standard deviation of the evaluation noise pooled over the evaluations of every chromosome, where the given values replace the cached evaluations of the given chromosome.
+        Returns None if no chromosome has two evaluations.
+        """
+        sum_squares = 0.0
+        degrees_freedom = 0
+        key = chromosome_key (chromosome)
+        samples = [[value for _, value in evaluations] for other, evaluations in self.evaluations.items () if other != key]
+        for sample in samples + [values]:
+            if len (sample) > 1:
+                mean = float (sum (sample)) / len (sample)
+                sum_squares += sum ((value - mean) ** 2 for value in sample)
+                degrees_freedom += len (sample) - 1
+        if degrees_freedom == 0:
+            return None
+        return math.sqrt (sum_squares / degrees_freedom)
+
+    def plan (self, generation, chromosome):
+        """
+        Return a tuple with the reused evaluation values of the chromosome and the number of evaluations that must be done in the given generation.
+        Updates the hit statistics of the generation.
+        """
+        reused = self.cached_values (generation, chromosome)
+        if self.policy == ALWAYS:
+            number_evaluations = self.number_replicates
+        else:
+            number_evaluations = self.number_replicates - len (reused)
+        hits, partial_hits, misses, reused_evaluations, new_evaluations = self.statistics.get (generation, (0, 0, 0, 0, 0))
+        if number_evaluations == 0:
+            hits += 1
+        elif len (reused) > 0:
+            partial_hits += 1
+        else:
+            misses += 1
+        self.statistics [generation] = (hits, partial_hits, misses, reused_evaluations + len (reused), new_evaluations + number_evaluations)
+        return (reused, number_evaluations)
+
+    def report (self, generation):
+        """
+        Print the hit rates of the given generation and append them to file evaluation-cache.csv.
+        """
+        hits, partial_hits, misses, reused_evaluations, new_evaluations = self.statistics.get (generation, (0, 0, 0, 0, 0))
+        number_chromosomes = hits + partial_hits + misses
+        if number_chromosomes == 0:
+            return
+        print ("Generation %d  Evaluation cache: %d hits, %d partial hits, %d misses (hit rate %.2f), %d evaluations reused, %d done" % (
+            generation, hits, partial_hits, misses, float (hits) / number_chromosomes, reused_evaluations, new_evaluations))
+        filename = self.experiment_folder + "evaluation-cache.csv"
+        write_header = not os.path.exists (filename)
+        with open (filename, 'a') as fp:
+            f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
+            if write_header:
+                f.writerow (["generation", "hits", "partial_hits", "misses", "reused_evaluations", "new_evaluations"])
+            f.writerow ([generation, hits, partial_hits, misses, reused_evaluations, new_evaluations])
+            fp.close ()
+
+def chromosome_key (chromosome):
+    """
+    Return the cache key of a chromosome.  Genes read from a CSV file are floats, so they are converted to integers if possible.
+    """
+    return tuple (int (gene) if gene == int (gene) else gene for gene in chromosome)
@@ -4,26 +4,26 @@
 import time
 import subprocess #spawn new processes
 import csv
+import math
 import numpy
+import os.path
 import sys
+import threading
+
+import evaluation_cache
+import image_comparison
+import timeline
 
 import assisipy
 
+# Column indexes in file evaluation.csv, defined in module evaluation_cache, which reads the file
+from evaluation_cache import EVA_GENERATION, EVA_EPISODE, EVA_ITERATION, EVA_SELECTED_ARENA, EVA_ACTIVE_CASU, EVA_TIMESTAMP, EVA_VALUE, EVA_CHROMOSOME_GENES
+
 # Column indexes in file population.csv
 POP_GENERATION       = 0
 #POP_EPISODE          = 1
 POP_CHROMOSOME_GENES = 2
 
-# Column indexes in file evaluation.csv
-EVA_GENERATION       = 0
-EVA_EPISODE          = 1
-EVA_ITERATION        = 2
-EVA_SELECTED_ARENA   = 3
-EVA_ACTIVE_CASU      = 4
-EVA_TIMESTAMP        = 5
-EVA_VALUE            = 6
-EVA_CHROMOSOME_GENES = 7
-
 # Column indexes in file partial.csv
 PRT_GENERATION       = 0
 PRT_EPISODE          = 1
@@ -49,8 +49,14 @@ class Evaluator:
         self.episode = episode
         self.experiment_folder = experiment_folder
         self.generation_number = generation_number
-        self.number_analysed_frames = (int) (self.config._evaluation_run_time * self.config.frame_per_second)
-        self.number_analysed_frames = int ((30 + 10 + 30) * self.config.frame_per_second) + 2 * 4
+        self.timeline = timeline.Timeline (self.config)
+        self.number_analysed_frames = self.timeline.number_frames
+        self.delta_image = int (self.config.frame_per_second / self.config.interval_current_previous_frame)
+        self.image_processing_writer = None
+        self.evaluation_cache = evaluation_cache.EvaluationCache (config, experiment_folder)
+        self.parents_fitness = []
+        self.offspring_fitness = []
+        self.racing_statistics = {}
         # initialise the evaluation values reduce function
         self.EVALUATION_VALUES_REDUCE_FUNCTION = {
             'average'                             : self.evr_average ,
@@ -68,29 +74,7 @@ class Evaluator:
         # else:
         #     raise Exception ("Invalid evaluation values reduce function: " + str (self.config.evaluation_values_reduce))
         # initialise the evaluation image processing function
-        number_analysed_frames_vibration = self.config.vibration_run_time * (self.config.number_repetitions + 1)
-        IMAGE_PROCESSING_FUNCTIONS = {
-            'stopped_frames'  : ImageProcessingFunction (
-                range_length = number_analysed_frames_vibration * self.config.number_bees * self.config.bee_area_pixels ,
-                vibration = ipf_stopped_frames) ,
-            'penalize_passive_casu'  : ImageProcessingFunction (
-                range_length = 2 * number_analysed_frames_vibration * self.config.number_bees * self.config.bee_area_pixels ,
-                vibration = ipf_penalize_passive_casu) ,
-            # 'background_bees_active_minus_passive'  : ImageProcessingFunction (
-            #     range_length = 2 * number_analysed_frames_vibration * self.config.number_bees * self.config.bee_area_pixels ,
-            #     vibration = ipf_background_bees_active_minus_passive) ,
-            'frames_with_no_movement_active_casu_roi'  : ImageProcessingFunction (
-                range_length = number_analysed_frames_vibration ,
-                vibration = ipf_frames_with_no_movement_active_casu_roi) ,
-            'frames_with_no_movement_active_passive_casu_rois'  : ImageProcessingFunction (
-                range_length = 2 * number_analysed_frames_vibration ,
-                vibration = ipf_frames_with_no_movement_active_passive_casu_rois) ,
-            'ratio_frames_with_no_movement_vibration_over_no_stimuli'  : ImageProcessingFunction (
-                range_length = number_analysed_frames_vibration ,
-                vibration = ipf_frames_with_no_movement_active_casu_roi ,
-                no_stimuli = ipf_frames_with_no_movement_active_casu_roi ,
-                combine = ipf_ratio_frames_with_no_movement_vibration_over_no_stimuli_active_casu_roi)
-            }
+        IMAGE_PROCESSING_FUNCTIONS = image_processing_functions (self.config)
         try:
             self.image_processing_function = IMAGE_PROCESSING_FUNCTIONS [self.config.fitness_function]
         except:
@@ -101,7 +85,13 @@ class Evaluator:
     def population_evaluator (self, candidates, args = None):
         """
         Evaluate a population.  This is the main method of this class and the one that is used by the evaluator function of the ES class of inspyred package.
+        The fitness of the current parents, which racing compares the candidates with, is taken from the evolutionary computation object in the arguments.
         """
+        if args is not None and '_ec' in args:
+            self.parents_fitness = [individual.fitness for individual in args ['_ec'].population if individual.fitness is not None]
+        else:
+            self.parents_fitness = []
+        self.offspring_fitness = []
         if len (candidates) == self.config.population_size:
             with open (self.experiment_folder + "population.csv", 'a') as fp:
                 f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONE, quotechar = '"')
@@ -112,8 +102,16 @@ class Evaluator:
                         ] + chromosome
                     f.writerow (row)
                 fp.close ()
-        result = [self.chromosome_fitness (chromosome) for chromosome in candidates]
+        if self.config.concurrent_arenas:
+            result = self.concurrent_population_fitness (candidates)
+        else:
+            result = []
+            for chromosome in candidates:
+                result.append (self.chromosome_fitness (chromosome))
+                self.offspring_fitness.append (result [-1])
         print ("Generation ", self.generation_number, "  Population fitness: " , result)
+        self.evaluation_cache.report (self.generation_number)
+        self.report_racing (self.generation_number)
         self.generation_number += 1
         return result
         
@@ -143,40 +141,163 @@ class Evaluator:
         """
         Compute the fitness of chromosome.  This is the value that is going to be
         used by the evolutionary algorithm in the inspyred package.
+
+        Evaluations of the chromosome in the evaluation cache are reused
+        depending on the cache policy, and only the missing ones are done.
+        With racing, evaluations stop as soon as the chromosome cannot
+        survive to the next generation.
         """
-        self.episode.ask_user (chromosome)
-        values = [self.iteration_step (chromosome, index_evaluation) for index_evaluation in xrange (self.config.number_evaluations_per_chromosome)]
+        values, number_evaluations = self.evaluation_cache.plan (self.generation_number, chromosome)
+        if number_evaluations > 0:
+            self.episode.ask_user (chromosome)
+        else:
+            print ("Reusing %d evaluations of chromosome %s" % (len (values), str (chromosome)))
+        if self.config.background_scoring:
+            new_values = self.pipelined_iteration_steps (chromosome, number_evaluations, values)
+        else:
+            new_values = []
+            while len (new_values) < number_evaluations and self.keep_evaluating (chromosome, values + new_values):
+                new_values.append (self.iteration_step (chromosome, len (new_values)))
+        if len (new_values) < number_evaluations:
+            print ("Racing stopped the evaluations of chromosome %s after %d of %d" % (str (chromosome), len (new_values), number_evaluations))
+            raced_chromosomes, skipped_evaluations = self.racing_statistics.get (self.generation_number, (0, 0))
+            self.racing_statistics [self.generation_number] = (raced_chromosomes + 1, skipped_evaluations + number_evaluations - len (new_values))
+        for value in new_values:
+            self.evaluation_cache.add (self.generation_number, chromosome, value)
+        values.extend (new_values)
         result = self._evaluation_values_reduce (values)
+        self.write_partial (chromosome, result)
+        if number_evaluations > 0:
+            raw_input ("If you want to stop the program, this is the best time to do so, just press CONTROL-C.  Otherwise press ENTER")
+        return result
+
+    def concurrent_population_fitness (self, candidates):
+        """
+        Compute the fitness of the chromosomes of a population evaluating them in all the arenas at the same time.
+
+        The evaluations to do are taken in chromosome order and dispatched
+        in batches, one evaluation per arena whose CASU temperatures are
+        suitable.  The arenas of a batch run their vibration models while a
+        single iteration video is recorded, and each arena is then scored in
+        its own regions of interest.  Each evaluation has its own counter in
+        the episode, so it gets its own row in file evaluation.csv and its
+        own image processing file, and rows are written in batch order.  A
+        batch never spans two episodes.
+        """
+        plans = [self.evaluation_cache.plan (self.generation_number, chromosome) for chromosome in candidates]
+        values = [reused for reused, _ in plans]
+        pending = [
+            (index, chromosome)
+            for index, (chromosome, (_, number_evaluations)) in enumerate (zip (candidates, plans))
+            for _ in xrange (number_evaluations)]
+        while len (pending) > 0:
+            if self.episode.evaluations_left () == 0:
+                self.episode.new_episode ()
+            self.episode.ask_user ([chromosome for _, chromosome in pending [:len (self.episode.arenas)]])
+            arenas = self.episode.select_arenas () [:self.episode.evaluations_left ()]
+            batch = pending [:len (arenas)]
+            del pending [:len (batch)]
+            contexts = self.run_concurrent_experiment (arenas [:len (batch)], [chromosome for _, chromosome in batch])
+            if self.config.frame_source == 'split':
+                self.split_iteration_video (
+                    contexts [0].filename_real,
+                    min (context.selection.first_frame for context in contexts),
+                    max (context.selection.last_frame for context in contexts))
+            for (index, chromosome), context in zip (batch, contexts):
+                self.score_evaluation (context, split_video = False)
+                value = self.finish_evaluation (context)
+                self.evaluation_cache.add (self.generation_number, chromosome, value)
+                values [index].append (value)
+            raw_input ("If you want to stop the program, this is the best time to do so, just press CONTROL-C.  Otherwise press ENTER")
+        result = []
+        for chromosome, chromosome_values in zip (candidates, values):
+            fitness = self._evaluation_values_reduce (chromosome_values)
+            self.write_partial (chromosome, fitness)
+            result.append (fitness)
+        return result
+
+    def keep_evaluating (self, chromosome, values):
+        """
+        Return whether a chromosome with the given evaluation values should be evaluated again.
+
+        With racing, a chromosome is not evaluated again when the upper
+        confidence bound of its mean evaluation value is below the fitness
+        of the worst chromosome that would survive to the next generation.
+        The standard error uses the evaluation noise pooled over the
+        evaluations of all chromosomes.  The fitness is the mean evaluation
+        value, as the configuration only allows racing with the average
+        evaluation values reduce function.
+        """
+        if not self.config.racing or len (values) < max (1, self.config.racing_minimum_evaluations):
+            return True
+        threshold = self.survivor_threshold ()
+        noise = self.evaluation_cache.pooled_standard_deviation (chromosome, values)
+        if threshold is None or noise is None:
+            return True
+        upper_bound = float (sum (values)) / len (values) + self.config.racing_z * noise / math.sqrt (len (values))
+        return upper_bound >= threshold
+
+    def survivor_threshold (self):
+        """
+        Return the fitness of the worst chromosome that would survive to the next generation among the parents and the offspring evaluated so far, or None if there are no parents.
+        The evolution strategy keeps the best population size chromosomes among parents and offspring.
+        """
+        if len (self.parents_fitness) == 0:
+            return None
+        pool = sorted (self.parents_fitness + self.offspring_fitness, reverse = True)
+        return pool [min (self.config.population_size, len (pool)) - 1]
+
+    def report_racing (self, generation):
+        """
+        Print the evaluations skipped by racing in the given generation and the bee time saved, and append them to file racing.csv.
+        """
+        if not self.config.racing:
+            return
+        raced_chromosomes, skipped_evaluations = self.racing_statistics.get (generation, (0, 0))
+        bee_time_saved = skipped_evaluations * self.timeline.duration ()
+        print ("Generation %d  Racing: %d chromosomes stopped early, %d evaluations skipped, %d:%02d of bee time saved" % (
+            generation, raced_chromosomes, skipped_evaluations, int (bee_time_saved) / 60, int (bee_time_saved) % 60))
+        filename = self.experiment_folder + "racing.csv"
+        write_header = not os.path.exists (filename)
+        with open (filename, 'a') as fp:
+            f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
+            if write_header:
+                f.writerow (["generation", "raced_chromosomes", "skipped_evaluations", "bee_time_saved"])
+            f.writerow ([generation, raced_chromosomes, skipped_evaluations, bee_time_saved])
+            fp.close ()
+
+    def write_partial (self, chromosome, fitness):
+        """
+        Save the fitness of a chromosome.
+        """
         with open (self.experiment_folder + "partial.csv", 'a') as fp:
             f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
             row = [
                 self.generation_number,
                 self.episode.episode_index,
-                result
+                fitness
             ] + chromosome
             f.writerow (row)
             fp.close ()
-        raw_input ("If you want to stop the program, this is the best time to do so, just press CONTROL-C.  Otherwise press ENTER")
-        return result
 
     def evr_average (self, values):
         """Reduce evaluation values by computing the average"""
-        return sum (values) / self.config.number_evaluations_per_chromosome
+        return sum (values) / len (values)
 
     def evr_average_without_best_worst (self, values):
         """
         Reduce evaluation values by taking the best and worst and then computing the average"""
-        return (sum (values) - max (values) - min (values)) / (self.config.number_evaluations_per_chromosome - 2)
+        return (sum (values) - max (values) - min (values)) / (len (values) - 2)
 
     def evr_range_value_weighted_average (self, values):
         best = max (values)
         worst = min (values)
-        mean = sum (values) / self.config.number_evaluations_per_chromosome
+        mean = sum (values) / len (values)
         weight = 1.0 * (self.image_processing_function.range_length - (best - worst)) / self.image_processing_function.range_length
         return mean * weight
 
     def evr_standard_deviation_weighted_average (self, values):
-        mean = sum (values) / self.config.number_evaluations_per_chromosome
+        mean = sum (values) / len (values)
         weight = 1.0 * (self.image_processing_function.range_length - 2 * numpy.std (values)) / self.image_processing_function.range_length
         return mean * weight
         
@@ -184,32 +305,126 @@ class Evaluator:
         """
         Experimental step where a candidate chromosome evaluation is done.
         """
+        context = self.run_experiment (candidate)
+        self.score_evaluation (context)
+        return self.finish_evaluation (context)
+
+    def pipelined_iteration_steps (self, candidate, number_evaluations, previous_values = []):
+        """
+        Do the given number of evaluations of a candidate chromosome, scoring each evaluation in a background thread while the experiment of the next one runs.
+
+        There is at most one evaluation being scored, so the images in
+        folder tmp are only used by one evaluation at a time.  If scoring
+        fails in the background thread, it is retried once in this thread.
+        With racing, the decision to start the next evaluation is taken
+        with the previous values and the values of the evaluations already
+        scored.  Returns the evaluation values in the order of the
+        evaluations.
+        """
+        result = []
+        scoring_thread = None
+        for _ in xrange (number_evaluations):
+            if not self.keep_evaluating (candidate, previous_values + result):
+                break
+            context = self.run_experiment (candidate)
+            if scoring_thread is not None:
+                result.append (self.join_scoring_thread (scoring_thread))
+            scoring_thread = ScoringThread (self, context)
+            scoring_thread.start ()
+        if scoring_thread is not None:
+            result.append (self.join_scoring_thread (scoring_thread))
+        return result
+
+    def join_scoring_thread (self, scoring_thread):
+        scoring_thread.join ()
+        if scoring_thread.error is not None:
+            print ("    Scoring of evaluation %d of episode %d failed: %s" % (scoring_thread.context.evaluation_in_episode, scoring_thread.context.episode_index, scoring_thread.error))
+            print ("    Trying again...")
+            self.score_evaluation (scoring_thread.context)
+        return self.finish_evaluation (scoring_thread.context)
+
+    def run_experiment (self, candidate):
+        """
+        Run the vibration model of a candidate chromosome in an arena while the iteration video is recorded.
+        Returns the context needed to score the evaluation.
+        """
         self.episode.increment_evaluation_counter ()
         print "\n\nEpisode %d - Evaluation %d" % (self.episode.episode_index, self.episode.current_evaluation_in_episode)
         picked_arena = self.episode.select_arena ()
-        (recording_process, filename_real) = self.start_iteration_video ()
+        selection = self.frame_selection (picked_arena)
+        (recording_process, filename_real) = self.start_iteration_video (self.config.live_analysis)
+        if self.config.live_analysis:
+            live_analysis = LiveAnalysis (self.config, picked_arena, recording_process.stdout, selection, self.timeline)
+            live_analysis.start ()
+        else:
+            live_analysis = None
         print "     Starting vibration model: " + str (candidate) + "..."
         time_start_vibration_pattern = picked_arena.run_vibration_model (self.config, candidate)
         print "     Vibration model finished!"
         recording_process.wait ()
         print "     Iteration video finished!"
-        self.split_iteration_video (filename_real)
-        self.compare_images (picked_arena)
-        evaluation_score = self.compute_evaluation (picked_arena)
-        self.write_evaluation (picked_arena, candidate, evaluation_score, time_start_vibration_pattern)
-        print ("    Evaluation of " + str (candidate) + " is " + str (evaluation_score))
+        return EvaluationContext (self, candidate, picked_arena, selection, filename_real, live_analysis, time_start_vibration_pattern)
+
+    def run_concurrent_experiment (self, arenas, candidates):
+        """
+        Run the vibration model of each candidate chromosome in the corresponding arena, all at the same time, while a single iteration video is recorded.
+        Returns the contexts needed to score the evaluations, in arena order.
+        """
+        evaluations_in_episode = []
+        for _ in arenas:
+            self.episode.increment_evaluation_counter ()
+            evaluations_in_episode.append (self.episode.current_evaluation_in_episode)
+        print "\n\nEpisode %d - Evaluations %s" % (self.episode.episode_index, str (evaluations_in_episode))
+        selections = [self.frame_selection (an_arena) for an_arena in arenas]
+        (recording_process, filename_real) = self.start_iteration_video ()
+        threads = [VibrationModelThread (self.config, an_arena, candidate) for an_arena, candidate in zip (arenas, candidates)]
+        print "     Starting vibration models: " + str (candidates) + "..."
+        for thread in threads:
+            thread.start ()
+        for thread in threads:
+            thread.join ()
+        print "     Vibration models finished!"
+        recording_process.wait ()
+        print "     Iteration video finished!"
+        return [
+            EvaluationContext (self, candidate, an_arena, selection, filename_real, None, thread.time_start_vibration_pattern, evaluation_in_episode)
+            for candidate, an_arena, selection, thread, evaluation_in_episode in zip (candidates, arenas, selections, threads, evaluations_in_episode)]
+
+    def score_evaluation (self, context, split_video = True):
+        """
+        Compute the evaluation value of an evaluation whose experiment has finished and store it in the context.
+        The iteration video is split first, if that is the frame source, unless it has already been split.
+        """
+        if context.live_analysis is not None:
+            context.evaluation_score = context.live_analysis.result ()
+            self.write_image_processing (context, context.live_analysis.frame_results ())
+        else:
+            if self.config.frame_source == 'split' and split_video:
+                self.split_iteration_video (context.filename_real, context.selection.first_frame, context.selection.last_frame)
+            results = self.compare_images (context)
+            context.evaluation_score = self.compute_evaluation (context.picked_arena, results)
+
+    def finish_evaluation (self, context):
+        """
+        Save the value of a scored evaluation and return it.
+        """
+        self.write_evaluation (context)
+        print ("    Evaluation of " + str (context.candidate) + " is " + str (context.evaluation_score))
         #raw_input ("\nPress ENTER to continue DEBUG.\n")
-        return evaluation_score
-                    
-    def start_iteration_video (self):
+        return context.evaluation_score
+
+    def start_iteration_video (self, live = False):
         """
         Starts the iteration video.  This video will record a chromosome evaluation and the bee spreading period.
 
+        In live mode the camera stream is also sent, as raw frames, to the
+        standard output of the recording process.  The analysis branch has an
+        unbounded queue so that a slow analysis does not stall the recording.
+
         :return: a tuple with the process that records the iteration the video filename
         """
         print "\n\n* ** Starting Iteration Video..."
-        num_buffers = (self.config._evaluation_run_time + self.config.spreading_waiting_time) * self.config.frame_per_second
-        num_buffers = (30 + 10 + 30) * self.config.frame_per_second + 2 * 4
+        num_buffers = self.timeline.number_frames
         filename_real = self.episode.current_path + 'iterationVideo_' + str (self.episode.current_evaluation_in_episode) + '.avi'
         bashCommand_video = 'gst-launch-0.10' + \
                             ' --gst-plugin-path=/usr/local/lib/gstreamer-0.10/' + \
@@ -217,15 +432,42 @@ class Evaluator:
                             ' -v aravissrc num-buffers=' + str (int (num_buffers)) + \
                             ' ! video/x-raw-yuv,width=' + str (self.config.image_width) + ',height=' + str (self.config.image_height) + ',framerate=' + str (int (self.config.frame_per_second)) + '/1' + \
                             ' ! jpegenc ! avimux name=mux ! filesink location=' + filename_real    # with time - everytime generate a new file
-        return (subprocess.Popen (bashCommand_video, shell=True, executable='/bin/bash'), filename_real)
+        if not live:
+            return (subprocess.Popen (bashCommand_video, shell=True, executable='/bin/bash'), filename_real)
+        bashCommand_video = 'gst-launch-0.10' + \
+                            ' --gst-plugin-path=/usr/local/lib/gstreamer-0.10/' + \
+                            ' --gst-plugin-load=libgstaravis-0.4.so' + \
+                            ' -q aravissrc num-buffers=' + str (int (num_buffers)) + \
+                            ' ! video/x-raw-yuv,width=' + str (self.config.image_width) + ',height=' + str (self.config.image_height) + ',framerate=' + str (int (self.config.frame_per_second)) + '/1' + \
+                            ' ! tee name=t' + \
+                            ' ! queue ! jpegenc ! avimux name=mux ! filesink location=' + filename_real + \
+                            ' t. ! queue max-size-buffers=0 max-size-bytes=0 max-size-time=0 ! ffmpegcolorspace' + \
+                            ' ! videoscale ! ' + image_comparison.GST_RAW_CAPS [self.config.pixel_format] + \
+                            ',width=' + str (self.config.image_width // self.config.analysis_scale) + ',height=' + str (self.config.image_height // self.config.analysis_scale) + \
+                            ' ! fdsink fd=1'
+        return (subprocess.Popen (bashCommand_video, shell=True, executable='/bin/bash', stdout=subprocess.PIPE), filename_real)
+
 
+    def frame_selection (self, picked_arena):
+        """
+        Return the frames of the iteration video that are compared and the comparisons that are done.
+        If lazy frame selection is enabled, these are the ones used by the evaluation, otherwise all frames and comparisons.
+        """
+        if self.config.lazy_frame_selection:
+            evaluation = OnlineEvaluation (self.config, picked_arena, self.timeline)
+            return image_comparison.FrameSelection (self.number_analysed_frames, evaluation.required_frames (), evaluation.required_columns (), self.delta_image)
+        else:
+            return image_comparison.all_frames (self.number_analysed_frames, self.delta_image)
 
-    def split_iteration_video (self, filename_real):
+    def split_iteration_video (self, filename_real, first_frame = 1, last_frame = None):
         """
         Split the iteration video into images.  We only need the images from the evaluation run time period.
 
-        The images are written in folder tmp relative to 
+        The images are written in folder tmp relative to the current directory.
+        Image files are numbered by their frame index in the video, starting at 1.
         """
+        if last_frame is None:
+            last_frame = self.number_analysed_frames
         print "\n\n* ** Starting Video Split..."
         # bashCommandSplit = "avconv" + \
         #                    " -i " + filename_real + \
@@ -234,101 +476,98 @@ class Evaluator:
         #                    " -frames:v " + str (self.number_analysed_frames) + \
         #                    " -f image2 tmp/iteration-image-%4d.jpg"
         bashCommandSplit = "ffmpeg" + \
+                           " -ss " + str (float (first_frame - 1) / self.config.frame_per_second) + \
                            " -i " + filename_real + \
                            " -r " + str (self.config.frame_per_second) + \
                            " -loglevel error" + \
-                           " -frames " + str (self.number_analysed_frames) + \
+                           " -frames " + str (max (last_frame - first_frame + 1, 0)) + \
+                           " -start_number " + str (first_frame) + \
                            " -f image2 tmp/iteration-image-%4d.jpg"
         p = subprocess.Popen (bashCommandSplit, shell=True, executable='/bin/bash') #to create and save the real images from the video depending on the iteration number
         p.wait ()
-        print ("Finished spliting iteration " + str (self.episode.current_evaluation_in_episode) + " video.")
+        print ("Finished spliting iteration video " + filename_real + ".")
 
-    def compare_images (self, picked_arena):
+    def compare_images (self, context):
         """
-        Compare images created in a chromosome evaluation and generate a CSV file.
+        Compare images created in the chromosome evaluation of the given context.
+        Returns an array with one row per frame and two columns per CASU, which is also saved in the background.
+        The images are either the ones in folder tmp or the frames of the iteration video decoded through a pipe, depending on the frame source in the configuration.
+        Only the frames and comparisons in the given selection are done, the others have value -1.
         The first column has the pixel difference between the current iteration image and the background image in the first CASU.
         The second column has the pixel difference between the current iteration image and the previous iteration image in the first CASU.
         The third column has the pixel difference between the current iteration image and the background image in the second CASU.
         The fourth column has the pixel difference between the current iteration image and the previous iteration image in the second CASU.
         """
         print ("\n\n* ** Comparing Images...")
-        fp = open (self.episode.current_path + "image-processing_" + str (self.episode.current_evaluation_in_episode) + ".csv", 'w')
-        f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
-        f.writerow (picked_arena.image_processing_header ())
-        for i in xrange (1, self.number_analysed_frames + 1):
-            f.writerow (picked_arena.compare_images (i))
-        fp.close ()
-        print ("Finished comparing images from iteration " + str (self.episode.current_evaluation_in_episode) + " video.")
+        picked_arena = context.picked_arena
+        filename_real = context.filename_real
+        selection = context.selection
+        picked_arena.reset_frame_cache ()
+        if self.config.image_processing_workers > 1:
+            indexed_rows = picked_arena.compare_frames_parallel (self.frame_source (filename_real), selection, self.config.image_processing_workers)
+        elif self.config.frame_source == 'stream':
+            indexed_rows = picked_arena.compare_video_frames (
+                image_comparison.frame_range (self.frame_source (filename_real), selection.first_frame, selection.last_frame),
+                selection)
+        else:
+            indexed_rows = ((i, picked_arena.compare_images (i, selection.columns)) for i in selection.rows)
+        results = frame_results (indexed_rows, selection.number_frames, 2 * len (picked_arena.workers))
+        self.write_image_processing (context, results)
+        print ("Finished comparing images from iteration " + str (context.evaluation_in_episode) + " video.")
+        return results
 
-    def compute_evaluation (self, picked_arena):
-        return self.compute_evaluation_HACK (picked_arena)
+    def write_image_processing (self, context, results):
+        """
+        Save the pixel counts of the frames of the evaluation of the given context in a background thread.
+        The counts are saved in a NumPy file and, if enabled in the configuration, in a CSV file.
+        The previous save is waited for, so that there is at most one pending save.
+        """
+        if self.image_processing_writer is not None:
+            self.image_processing_writer.join ()
+        self.image_processing_writer = ImageProcessingWriter (
+            "%simage-processing_%d" % (context.episode_path, context.evaluation_in_episode),
+            context.picked_arena.image_processing_header (),
+            results,
+            self.config.image_processing_csv)
+        self.image_processing_writer.start ()
 
-    def compute_evaluation_NORMAL (self, picked_arena):
+    def frame_source (self, filename_real):
+        """
+        Return the description of where the frames of the iteration video are decoded from, as used by function image_comparison.frame_range.
+        """
+        if self.config.frame_source == 'stream':
+            return ('stream', filename_real, self.config.image_width, self.config.image_height, self.config.frame_per_second, self.config.pixel_format, self.config.analysis_scale)
+        else:
+            return ('split', self.config.pixel_format, self.config.analysis_scale)
+
+    def compute_evaluation (self, picked_arena, results):
+        return self.compute_evaluation_HACK (picked_arena, results)
+
+    def compute_evaluation_NORMAL (self, picked_arena, results):
         """
         Compute the evaluation of the current chromosome.  This depends on the fitness function property of the configuration file.
+        The results are the pixel counts returned by method compare_images.
+        The frames of each segment are given by the timeline.
         """
-        time = 0
-        step = 1.0 / self.config.frame_per_second
-        vibration_segment = True
-        frames_with_vibration = 0
-        frames_without_stimuli = 0
-        message = []
-        with open (self.episode.current_path + "image-processing_" + str (self.episode.current_evaluation_in_episode) + ".csv", 'r') as fp:
-            freader = csv.reader (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
-            freader.next () # skip header row
-            freader.next () # skip frame with initial blip
-            for row in freader:
-                time += step
-                if vibration_segment:
-                    frames_with_vibration += self.image_processing_function.vibration (self.config, picked_arena, row)
-                    if time >= self.config.vibration_run_time:
-                        message.append ('vibration segment with %d frames' % (int (time / step)))
-                        vibration_segment = False
-                        time = 0
-                else:
-                    if self.image_processing_function.no_stimuli is not None:
-                        frames_without_stimuli += self.image_processing_function.no_stimuli (self.config, picked_arena, row)
-                    if time >= self.config.no_stimuli_run_time:
-                        message.append ('no stimuli segment with %d frames' % (int (time / step)))
-                        vibration_segment = True
-                        time = 0
-            fp.close ()
+        vibration = VECTORIZED_IPF [self.image_processing_function.vibration]
+        frames_with_vibration = vibration (self.config, picked_arena, results, self.timeline.mask (timeline.VIBRATION, len (results)))
         if self.image_processing_function.no_stimuli is not None:
+            no_stimuli = VECTORIZED_IPF [self.image_processing_function.no_stimuli]
+            frames_without_stimuli = no_stimuli (self.config, picked_arena, results, self.timeline.mask (timeline.NO_STIMULI, len (results)))
             result = self.image_processing_function.combine (self.config, frames_with_vibration, frames_without_stimuli)
         else:
             result = frames_with_vibration
-        if time != 0:
-            if vibration_segment:
-                message.append ('vibration segment with %d frames' % int (time / step))
-            else:
-                message.append ('no stimuli segment with %d frames' % (int (time / step)))
+        message = [
+            '%s segment with %d frames' % (name, max (0, min (number_frames, len (results) - first_frame + 1)))
+            for name, first_frame, number_frames in self.timeline.segments
+            if name in [timeline.VIBRATION, timeline.NO_STIMULI]]
         print '    Processed:', message
         return result
 
-    def compute_evaluation_HACK (self, picked_arena):
-        result = 0
-        filename = "%simage-processing_%d.csv" % (self.episode.current_path, self.episode.current_evaluation_in_episode)
-        with open (filename, 'r') as fp:
-            freader = csv.reader (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
-            freader.next () # skip header row
-            if self.config.has_blip:
-                freader.next ()
-            for _ in xrange (int (self.config.frame_per_second * 30)):
-                freader.next ()
-            if self.config.has_blip:
-                freader.next ()
-            for _ in xrange (int (self.config.frame_per_second * 10)):
-                row = freader.next ()
-                result += ipf_penalize_resting_bees (self.config, picked_arena, row)
-            if self.config.has_blip:
-                freader.next ()
-            for _ in xrange (int (self.config.frame_per_second * 30)):
-                row = freader.next ()
-                result += ipf_penalize_passive_casu (self.config, picked_arena, row)
-            fp.close ()
-        return result
+    def compute_evaluation_HACK (self, picked_arena, results):
+        return OnlineEvaluation (self.config, picked_arena, self.timeline).evaluate (results)
 
-    def background_bees_active_minus_passive (self, picked_arena):
+    def background_bees_active_minus_passive (self, picked_arena, results):
         """
         ARe there more bees in the ROI
         for image in video
@@ -336,16 +575,11 @@ class Evaluator:
             result -= bee_pixel passive casu
         """
         result = 0
-        with open (self.episode.current_path + "image-processing_" + str (self.episode.current_evaluation_in_episode) + ".csv", 'r') as fp:
-            freader = csv.reader (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
-            freader.next ()
-            freader.next ()
-            for row in freader:
-                if row [picked_arena.selected_worker_index * 2] > self.config.pixel_count_background_threshold:
-                    result += row [picked_arena.selected_worker_index * 2]
-                if row [(1 - picked_arena.selected_worker_index) * 2] > self.config.pixel_count_background_threshold:
-                    result += -row [(1 - picked_arena.selected_worker_index) * 2]
-            fp.close ()
+        for row in results [1:]:
+            if row [picked_arena.selected_worker_index * 2] > self.config.pixel_count_background_threshold:
+                result += row [picked_arena.selected_worker_index * 2]
+            if row [(1 - picked_arena.selected_worker_index) * 2] > self.config.pixel_count_background_threshold:
+                result += -row [(1 - picked_arena.selected_worker_index) * 2]
         return result
 
     # def stopped_frames (self, picked_arena):
@@ -416,22 +650,269 @@ class Evaluator:
     #         fp.close ()
     #     return result
 
-    def write_evaluation (self, picked_arena, candidate, evaluation_score, time_start_vibration_pattern):
+    def write_evaluation (self, context):
         """
         Save the result of a chromosome evaluation.
         """
         with open (self.experiment_folder + "evaluation.csv", 'a') as fp:
             f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
             f.writerow ([
-                self.generation_number,
-                self.episode.episode_index,
-                self.episode.current_evaluation_in_episode,
-                picked_arena.index,
-                picked_arena.workers [picked_arena.selected_worker_index][0],  # active casu number
-                time_start_vibration_pattern,
-                evaluation_score] + candidate)
+                context.generation_number,
+                context.episode_index,
+                context.evaluation_in_episode,
+                context.picked_arena.index,
+                context.picked_arena.workers [context.picked_arena.selected_worker_index][0],  # active casu number
+                context.time_start_vibration_pattern,
+                context.evaluation_score] + context.candidate)
             fp.close ()
 
+class EvaluationContext:
+    """
+    The data of a chromosome evaluation that is needed after its experiment.
+
+    The episode data is copied, as the episode may move on to the next
+    evaluation while this one is scored.  The evaluation value is set when
+    the evaluation is scored.
+    """
+    def __init__ (self, an_evaluator, candidate, picked_arena, selection, filename_real, live_analysis, time_start_vibration_pattern, evaluation_in_episode = None):
+        self.candidate = candidate
+        self.picked_arena = picked_arena
+        self.selection = selection
+        self.filename_real = filename_real
+        self.live_analysis = live_analysis
+        self.time_start_vibration_pattern = time_start_vibration_pattern
+        self.generation_number = an_evaluator.generation_number
+        self.episode_index = an_evaluator.episode.episode_index
+        self.episode_path = an_evaluator.episode.current_path
+        if evaluation_in_episode is None:
+            evaluation_in_episode = an_evaluator.episode.current_evaluation_in_episode
+        self.evaluation_in_episode = evaluation_in_episode
+        self.evaluation_score = None
+
+class VibrationModelThread (threading.Thread):
+    """
+    Thread that runs the vibration model of a chromosome in an arena and waits for its workers, so that several arenas can run at the same time.
+    Each arena has its own worker sockets.
+    """
+    def __init__ (self, config, an_arena, chromosome):
+        threading.Thread.__init__ (self)
+        self.config = config
+        self.arena = an_arena
+        self.chromosome = chromosome
+        self.time_start_vibration_pattern = None
+
+    def run (self):
+        self.time_start_vibration_pattern = self.arena.run_vibration_model (self.config, self.chromosome)
+
+class ScoringThread (threading.Thread):
+    """
+    Thread that scores an evaluation while the experiment of the next evaluation runs.
+    An exception raised while scoring is kept in attribute error.
+    """
+    def __init__ (self, an_evaluator, context):
+        threading.Thread.__init__ (self)
+        self.evaluator = an_evaluator
+        self.context = context
+        self.error = None
+
+    def run (self):
+        try:
+            self.evaluator.score_evaluation (self.context)
+        except Exception as e:
+            self.error = e
+
+class OnlineEvaluation:
+    """
+    Computes the evaluation of a chromosome one image processing row at a time.
+
+    The rows are consumed in frame order.  The evaluation is the one of
+    method compute_evaluation_HACK: the spreading segment is skipped, resting
+    bees are penalised in the no stimuli segment, and the passive CASU is
+    penalised in the vibration segment.  The segments are the ones of the
+    given timeline, so blip frames are skipped.
+    """
+    def __init__ (self, config, picked_arena, a_timeline):
+        self.config = config
+        self.picked_arena = picked_arena
+        self.segments = [
+            (SEGMENT_FUNCTIONS.get (name), number_frames)
+            for name, _, number_frames in a_timeline.segments]
+        self.segment_index = 0
+        self.remaining_rows = self.segments [0][1]
+        self.result = 0
+        self.__skip_empty_segments ()
+
+    def evaluate (self, results):
+        """
+        Compute the evaluation of a whole results array with the vectorized image processing functions.
+        This does not change the state of this object.  The result is the same as adding the rows one at a time.
+        """
+        if len (results) < sum (length for _, length in self.segments):
+            raise Exception ("The iteration video has %d frames, which is not enough to compute the evaluation" % (len (results)))
+        result = 0
+        first_frame = 0
+        for function, length in self.segments:
+            if function is not None and length > 0:
+                segment = numpy.zeros (len (results), dtype = numpy.bool_)
+                segment [first_frame:first_frame + length] = True
+                result += VECTORIZED_IPF [function] (self.config, self.picked_arena, results, segment)
+            first_frame += length
+        return result
+
+    def required_frames (self):
+        """
+        Return the indexes of the frames whose rows are used by the evaluation.  Frames are numbered from 1.
+        """
+        result = []
+        first_frame = 1
+        for function, length in self.segments:
+            if function is not None:
+                result.extend (xrange (first_frame, first_frame + length))
+            first_frame += length
+        return result
+
+    def required_columns (self):
+        """
+        Return the comparisons that are used by the evaluation.
+        """
+        result = set ()
+        for function, _ in self.segments:
+            if function is not None:
+                result.update (IPF_COLUMNS [function])
+        return [column for column in image_comparison.ALL_COLUMNS if column in result]
+
+    def __skip_empty_segments (self):
+        while self.remaining_rows == 0 and self.segment_index < len (self.segments):
+            self.segment_index += 1
+            if self.segment_index < len (self.segments):
+                self.remaining_rows = self.segments [self.segment_index][1]
+
+    def finished (self):
+        """
+        Return True if the rows of all segments have been consumed.
+        """
+        return self.segment_index >= len (self.segments)
+
+    def add_row (self, row):
+        """
+        Update the evaluation with the row of the next frame.  Rows after the last segment are ignored.
+        """
+        if self.finished ():
+            return
+        function = self.segments [self.segment_index][0]
+        if function is not None:
+            self.result += function (self.config, self.picked_arena, row)
+        self.remaining_rows -= 1
+        self.__skip_empty_segments ()
+
+STREAM_CHUNK_SIZE = 65536
+"""
+Number of bytes read at a time when the frames sent by the recording process are discarded.
+"""
+
+class LiveAnalysis (threading.Thread):
+    """
+    Thread that compares the frames sent by the recording process and computes the evaluation while the iteration video is being recorded.
+    """
+    def __init__ (self, config, picked_arena, stream, selection, a_timeline):
+        threading.Thread.__init__ (self)
+        self.daemon = True
+        self.picked_arena = picked_arena
+        self.stream = stream
+        self.frames = image_comparison.read_frames (stream, config.image_width // config.analysis_scale, config.image_height // config.analysis_scale, config.pixel_format)
+        self.selection = selection
+        self.evaluation = OnlineEvaluation (config, picked_arena, a_timeline)
+        self.rows = []
+        self.error = None
+
+    def run (self):
+        try:
+            self.picked_arena.reset_frame_cache ()
+            indexed_rows = self.picked_arena.compare_video_frames (enumerate (self.frames, 1), self.selection)
+            for row in complete_rows (indexed_rows, self.selection.number_frames, 2 * len (self.picked_arena.workers)):
+                self.rows.append (row)
+                self.evaluation.add_row (row)
+        except:
+            self.error = sys.exc_info ()
+            self.drain ()
+
+    def drain (self):
+        """
+        Read the stream until the recording process closes it.
+        If the stream is not read, the recording process blocks when the pipe is full and never finishes.
+        """
+        while len (self.stream.read (STREAM_CHUNK_SIZE)) > 0:
+            pass
+
+    def frame_results (self):
+        """
+        Return the pixel counts of the analysed frames as an array with one row per frame.
+        """
+        return numpy.array (self.rows, dtype = numpy.float64).reshape ((len (self.rows), 2 * len (self.picked_arena.workers)))
+
+    def result (self):
+        """
+        Wait for the analysis to finish and return the evaluation.
+        Exceptions raised by the analysis are raised again in the calling thread.
+        """
+        self.join ()
+        if self.error is not None:
+            raise self.error [0], self.error [1], self.error [2]
+        if not self.evaluation.finished ():
+            raise Exception ("The iteration video has %d frames, which is not enough to compute the evaluation" % (len (self.rows)))
+        return self.evaluation.result
+
+def frame_results (indexed_rows, number_frames, number_columns):
+    """
+    Collect the rows of the frames of an iteration video given by an iterator of tuples with the frame index and the row.
+    Returns an array with one row per frame.  Frames without a row have every value equal to -1.
+    """
+    result = numpy.empty ((number_frames, number_columns), dtype = numpy.float64)
+    result.fill (-1)
+    for ith_image, row in indexed_rows:
+        result [ith_image - 1] = row
+    return result
+
+class ImageProcessingWriter (threading.Thread):
+    """
+    Thread that saves the pixel counts of the frames of an evaluation.
+
+    The counts are saved in NumPy format in file PREFIX.npy.  If CSV
+    output is enabled, they are also written with a header row in file
+    PREFIX.csv, which was the only output of older versions.
+    """
+    def __init__ (self, filename_prefix, header, results, write_csv):
+        threading.Thread.__init__ (self)
+        self.filename_prefix = filename_prefix
+        self.header = header
+        self.results = results
+        self.write_csv = write_csv
+
+    def run (self):
+        numpy.save (self.filename_prefix + ".npy", self.results)
+        if self.write_csv:
+            with open (self.filename_prefix + ".csv", 'w') as fp:
+                f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
+                f.writerow (self.header)
+                for row in self.results:
+                    f.writerow ([int (value) if value == int (value) else value for value in row])
+                fp.close ()
+
+def complete_rows (indexed_rows, number_frames, number_columns):
+    """
+    Generator that yields one row per frame of an iteration video given an iterator of tuples with the frame index and the row, in frame order.
+    Frames without a row get a row where every value is -1.
+    """
+    next_frame = 1
+    for ith_image, row in indexed_rows:
+        while next_frame < ith_image:
+            yield [-1] * number_columns
+            next_frame += 1
+        yield row
+        next_frame = ith_image + 1
+    while next_frame <= number_frames:
+        yield [-1] * number_columns
+        next_frame += 1
 
 class ImageProcessingFunction:
     def __init__ (self, range_length, vibration, no_stimuli = None, combine = None):
@@ -440,6 +921,34 @@ class ImageProcessingFunction:
         self.no_stimuli = no_stimuli
         self.combine = combine
 
+def image_processing_functions (config):
+    """
+    Return a dictionary with the image processing function of each fitness function.
+    """
+    number_analysed_frames_vibration = config.vibration_run_time * (config.number_repetitions + 1)
+    return {
+        'stopped_frames'  : ImageProcessingFunction (
+            range_length = number_analysed_frames_vibration * config.number_bees * config.bee_area_pixels ,
+            vibration = ipf_stopped_frames) ,
+        'penalize_passive_casu'  : ImageProcessingFunction (
+            range_length = 2 * number_analysed_frames_vibration * config.number_bees * config.bee_area_pixels ,
+            vibration = ipf_penalize_passive_casu) ,
+        # 'background_bees_active_minus_passive'  : ImageProcessingFunction (
+        #     range_length = 2 * number_analysed_frames_vibration * config.number_bees * config.bee_area_pixels ,
+        #     vibration = ipf_background_bees_active_minus_passive) ,
+        'frames_with_no_movement_active_casu_roi'  : ImageProcessingFunction (
+            range_length = number_analysed_frames_vibration ,
+            vibration = ipf_frames_with_no_movement_active_casu_roi) ,
+        'frames_with_no_movement_active_passive_casu_rois'  : ImageProcessingFunction (
+            range_length = 2 * number_analysed_frames_vibration ,
+            vibration = ipf_frames_with_no_movement_active_passive_casu_rois) ,
+        'ratio_frames_with_no_movement_vibration_over_no_stimuli'  : ImageProcessingFunction (
+            range_length = number_analysed_frames_vibration ,
+            vibration = ipf_frames_with_no_movement_active_casu_roi ,
+            no_stimuli = ipf_frames_with_no_movement_active_casu_roi ,
+            combine = ipf_ratio_frames_with_no_movement_vibration_over_no_stimuli_active_casu_roi)
+        }
+
 def ipf_stopped_frames (config, picked_arena, row):
     """
     In this function we see if the number of pixels that are different
@@ -501,3 +1010,95 @@ def ipf_penalize_resting_bees (config, picked_arena, row):
 def ipf_ratio_frames_with_no_movement_vibration_over_no_stimuli_active_casu_roi (config, frames_with_vibration, frames_without_stimuli):
     number_analysed_frames_no_stimuli = config.no_stimuli_run_time * config.number_repetitions
     return frames_with_vibration / (number_analysed_frames_no_stimuli + 1 - frames_without_stimuli)
+
+# Image processing function applied to the frames of each segment by
+# class OnlineEvaluation.  Frames of other segments are skipped.
+SEGMENT_FUNCTIONS = {
+    timeline.NO_STIMULI : ipf_penalize_resting_bees,
+    timeline.VIBRATION  : ipf_penalize_passive_casu,
+    }
+
+# Comparisons used by each image processing function
+IPF_COLUMNS = {
+    ipf_stopped_frames                                    : [image_comparison.BACKGROUND, image_comparison.PREVIOUS],
+    ipf_frames_with_no_movement_active_casu_roi           : [image_comparison.PREVIOUS],
+    ipf_frames_with_no_movement_active_passive_casu_rois  : [image_comparison.PREVIOUS],
+    ipf_penalize_passive_casu                             : [image_comparison.BACKGROUND, image_comparison.PREVIOUS],
+    ipf_penalize_resting_bees                             : [image_comparison.BACKGROUND, image_comparison.PREVIOUS],
+    }
+
+# Vectorized image processing functions.  Each function computes the sum
+# of the corresponding ipf function over the rows of a results array
+# selected by a boolean segment mask.  The thresholds are read once per
+# call instead of once per row.
+
+def active_passive_columns (picked_arena, results, segment):
+    """
+    Return the background and previous frame columns of the active and passive CASUs restricted to the frames in the segment.
+    """
+    active = picked_arena.selected_worker_index
+    passive = 1 - picked_arena.selected_worker_index
+    rows = results [segment]
+    return rows [:, active * 2], rows [:, active * 2 + 1], rows [:, passive * 2], rows [:, passive * 2 + 1]
+
+def vipf_stopped_frames (config, picked_arena, results, segment):
+    background_threshold = config.pixel_count_background_threshold
+    previous_threshold = config.pixel_count_previous_frame_threshold
+    active_background, active_previous, _, _ = active_passive_columns (picked_arena, results, segment)
+    return active_background [(active_background > background_threshold) & (active_previous < previous_threshold)].sum ()
+
+def vipf_frames_with_no_movement_active_casu_roi (config, picked_arena, results, segment):
+    previous_threshold = config.pixel_count_previous_frame_threshold
+    _, active_previous, _, _ = active_passive_columns (picked_arena, results, segment)
+    return int (numpy.count_nonzero (active_previous < previous_threshold))
+
+def vipf_frames_with_no_movement_active_passive_casu_rois (config, picked_arena, results, segment):
+    previous_threshold = config.pixel_count_previous_frame_threshold
+    _, active_previous, _, passive_previous = active_passive_columns (picked_arena, results, segment)
+    return int (numpy.count_nonzero (active_previous < previous_threshold)) - int (numpy.count_nonzero (passive_previous < previous_threshold))
+
+def vipf_penalize_passive_casu (config, picked_arena, results, segment):
+    background_threshold = config.pixel_count_background_threshold
+    previous_threshold = config.pixel_count_previous_frame_threshold
+    active_background, active_previous, passive_background, passive_previous = active_passive_columns (picked_arena, results, segment)
+    return \
+        + active_background  [(active_background  > background_threshold) & (active_previous  < previous_threshold)].sum () \
+        - passive_background [(passive_background > background_threshold) & (passive_previous < previous_threshold)].sum ()
+
+def vipf_penalize_resting_bees (config, picked_arena, results, segment):
+    """
+    Because of operator precedence, function ipf_penalize_resting_bees
+    only penalises the passive CASU in frames where the active CASU is not
+    penalised.  This function does the same.
+    """
+    background_threshold = config.pixel_count_background_threshold
+    previous_threshold = config.pixel_count_previous_frame_threshold
+    active_background, active_previous, passive_background, passive_previous = active_passive_columns (picked_arena, results, segment)
+    active_resting = (active_background > background_threshold) & (active_previous < previous_threshold)
+    passive_resting = (passive_background > background_threshold) & (passive_previous < previous_threshold) & ~active_resting
+    return - active_background [active_resting].sum () - passive_background [passive_resting].sum ()
+
+VECTORIZED_IPF = {
+    ipf_stopped_frames                                    : vipf_stopped_frames,
+    ipf_frames_with_no_movement_active_casu_roi           : vipf_frames_with_no_movement_active_casu_roi,
+    ipf_frames_with_no_movement_active_passive_casu_rois  : vipf_frames_with_no_movement_active_passive_casu_rois,
+    ipf_penalize_passive_casu                             : vipf_penalize_passive_casu,
+    ipf_penalize_resting_bees                             : vipf_penalize_resting_bees,
+    }
+"""
+Vectorized version of each image processing function.
+"""
+
+def read_image_processing (filename):
+    """
+    Read the pixel counts of an evaluation saved in a NumPy file or in a CSV file with a header row.
+    Returns an array with one row per frame.
+    """
+    if filename.endswith ('.npy'):
+        return numpy.load (filename)
+    with open (filename, 'r') as fp:
+        freader = csv.reader (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
+        freader.next () # skip header row
+        rows = [row for row in freader]
+        fp.close ()
+    return numpy.array (rows, dtype = numpy.float64)
@@ -0,0 +1,579 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+In-process image comparison functions.
+
+These functions compute the same pixel counts as the convert program from
+the ImageMagick suite, but they work on images decoded in memory with PIL
+and NumPy.  This avoids spawning a convert process for every comparison,
+which is the bottleneck of the image processing phase of an evaluation.
+"""
+
+import Image
+import multiprocessing
+import numpy
+import os.path
+import subprocess
+
+PIXEL_FORMATS = {
+    'rgb24' : ('RGB', 3),
+    'gray'  : ('L',   1)
+    }
+"""
+Pixel formats of the decoded images.  Each format is mapped to the PIL
+image mode and to the number of channels.  Both the rgb24 and gray
+formats are supported by the rawvideo output of ffmpeg.
+"""
+
+GST_RAW_CAPS = {
+    'rgb24' : 'video/x-raw-rgb,bpp=24,depth=24,endianness=4321,red_mask=16711680,green_mask=65280,blue_mask=255',
+    'gray'  : 'video/x-raw-gray,bpp=8,depth=8'
+    }
+"""
+Caps of the gstreamer raw video buffers with the same layout as the ffmpeg pixel formats.
+"""
+
+ITERATION_IMAGE_FILENAME = "tmp/iteration-image-%04d.jpg"
+"""
+Filename pattern of the images of a split iteration video.
+"""
+
+BACKGROUND_FILENAMES = ['Background.png', 'Background.jpg']
+"""
+Filenames of the background image of an episode.  The first one is the
+lossless image of a multi-frame background model, the second one is the
+image extracted from a single frame background video.
+"""
+
+MEDIAN_BAND_HEIGHT = 64
+"""
+Number of image rows whose median is computed at once when building a
+median background.  The median of a band needs a floating point copy of the
+frames, so this limits the memory used.
+"""
+
+BACKGROUND = 'background'
+PREVIOUS = 'previous'
+ALL_COLUMNS = (BACKGROUND, PREVIOUS)
+"""
+Comparisons done in each region of interest: with the background image and with the previous frame.
+"""
+
+def read_image (filename, pixel_format = 'rgb24', scale = 1):
+    """
+    Decode the image with the given filename.
+
+    If the scale is greater than one, the image is downscaled by this
+    integer factor.  JPEG images are decoded at the reduced size with the
+    DCT scaling of the JPEG library, which is much faster than decoding
+    the full image.  Returns an array with shape (height, width, channels)
+    and unsigned byte samples.
+    """
+    mode, channels = PIXEL_FORMATS [pixel_format]
+    image = Image.open (filename)
+    if scale > 1:
+        size = (image.size [0] // scale, image.size [1] // scale)
+        image.draft (mode, size)
+        image = image.convert (mode)
+        if image.size != size:
+            image = image.resize (size, Image.ANTIALIAS)
+    else:
+        image = image.convert (mode)
+    return numpy.asarray (image).reshape ((image.size [1], image.size [0], channels))
+
+def downscale_image (image, scale):
+    """
+    Downscale an image with shape (height, width, channels) by an integer factor.
+    Each pixel of the result is the rounded mean of a block of scale by scale pixels.  Incomplete blocks at the right and bottom borders are dropped.
+    """
+    if scale == 1:
+        return image
+    height, width = image.shape [0] // scale, image.shape [1] // scale
+    blocks = image [:height * scale, :width * scale].reshape ((height, scale, width, scale, image.shape [2]))
+    total = blocks.sum (axis = (1, 3), dtype = numpy.uint32)
+    return ((total + scale * scale // 2) // (scale * scale)).astype (numpy.uint8)
+
+def convert_image (image, pixel_format):
+    """
+    Convert an image with shape (height, width, channels) to the given pixel format.
+    The conversion is done by PIL so that the result is the same as decoding the image with function read_image.
+    """
+    mode, channels = PIXEL_FORMATS [pixel_format]
+    if image.shape [2] == channels:
+        return image
+    source_mode = 'RGB' if image.shape [2] == 3 else 'L'
+    converted = Image.fromarray (image.reshape (image.shape [:2]) if source_mode == 'L' else image, source_mode).convert (mode)
+    return numpy.asarray (converted).reshape ((image.shape [0], image.shape [1], channels))
+
+def background_filename (episode_path):
+    """
+    Return the filename of the background image of an episode.
+    """
+    for filename in BACKGROUND_FILENAMES:
+        if os.path.exists (episode_path + filename):
+            return episode_path + filename
+    return episode_path + BACKGROUND_FILENAMES [-1]
+
+def camera_frames (width, height, frame_per_second, number_frames, pixel_format = 'rgb24'):
+    """
+    Capture frames from the camera without writing them to disk.
+
+    The frames are read from the raw video output of a gstreamer process
+    through a pipe.  This is a generator that yields arrays with shape
+    (height, width, channels).
+    """
+    _, channels = PIXEL_FORMATS [pixel_format]
+    process = subprocess.Popen (
+        'gst-launch-0.10' + \
+        ' --gst-plugin-path=/usr/local/lib/gstreamer-0.10/' + \
+        ' --gst-plugin-load=libgstaravis-0.4.so' + \
+        ' -q aravissrc num-buffers=' + str (int (number_frames)) + \
+        ' ! video/x-raw-yuv,width=' + str (width) + ',height=' + str (height) + ',framerate=' + str (int (frame_per_second)) + '/1' + \
+        ' ! ffmpegcolorspace ! ' + GST_RAW_CAPS [pixel_format] + ' ! fdsink fd=1',
+        shell = True,
+        executable = '/bin/bash',
+        stdout = subprocess.PIPE,
+        bufsize = width * height * channels)
+    try:
+        for image in read_frames (process.stdout, width, height, pixel_format):
+            yield image
+    finally:
+        process.stdout.close ()
+        process.wait ()
+
+def background_model (frames, model = 'median'):
+    """
+    Compute a background image from a sequence of frames of a static scene.
+
+    The background is the per pixel median or mean of the frames.  The
+    median removes transient objects and both reduce the sensor noise that
+    a single frame background has.  Returns an array with the shape of the
+    frames and unsigned byte samples.
+    """
+    stack = numpy.array ([frame for frame in frames], dtype = numpy.uint8)
+    if len (stack) == 0:
+        raise ValueError ("There are no frames to compute the background")
+    number_frames = len (stack)
+    if model == 'mean':
+        total = stack.sum (axis = 0, dtype = numpy.uint32)
+        return ((total + number_frames // 2) // number_frames).astype (numpy.uint8)
+    elif model == 'median':
+        result = numpy.empty (stack.shape [1:], dtype = numpy.uint8)
+        for top in xrange (0, stack.shape [1], MEDIAN_BAND_HEIGHT):
+            band = numpy.median (stack [:, top:top + MEDIAN_BAND_HEIGHT], axis = 0)
+            result [top:top + MEDIAN_BAND_HEIGHT] = numpy.floor (band + 0.5)
+        return result
+    else:
+        raise ValueError ("Unknown background model: %s" % (str (model)))
+
+def save_image (filename, image):
+    """
+    Save an image with shape (height, width, channels).  The file format is given by the filename extension.
+    """
+    if image.shape [2] == 1:
+        Image.fromarray (image.reshape (image.shape [:2]), 'L').save (filename)
+    else:
+        Image.fromarray (image, 'RGB').save (filename)
+
+def video_frames (filename, width, height, frame_per_second, number_frames, pixel_format = 'rgb24', first_frame = 1, scale = 1):
+    """
+    Decode the frames of a video without writing them to disk.
+
+    The frames are read from the rawvideo output of a ffmpeg process through
+    a pipe.  The frame rate and number of frames are the same as the ones
+    used when the video is split into images.  Decoding starts at the given
+    frame, counting from one.  If the scale is greater than one, ffmpeg
+    downscales the frames by this integer factor with area averaging.  This
+    is a generator that yields arrays with shape (height, width, channels).
+    """
+    _, channels = PIXEL_FORMATS [pixel_format]
+    width, height = width // scale, height // scale
+    scale_filter = ['-vf', 'scale=%d:%d:flags=area' % (width, height)] if scale > 1 else []
+    process = subprocess.Popen ([
+        'ffmpeg',
+        '-ss', '%.6f' % ((first_frame - 1.0) / frame_per_second),
+        '-i', filename,
+        '-r', str (frame_per_second),
+        '-loglevel', 'error',
+        '-frames', str (number_frames)] + scale_filter + [
+        '-f', 'rawvideo',
+        '-pix_fmt', pixel_format,
+        '-'],
+        stdout = subprocess.PIPE,
+        bufsize = width * height * channels)
+    try:
+        for image in read_frames (process.stdout, width, height, pixel_format):
+            yield image
+    finally:
+        process.stdout.close ()
+        process.wait ()
+
+def read_frames (stream, width, height, pixel_format = 'rgb24'):
+    """
+    Read raw frames from a file object until it is exhausted.
+    This is a generator that yields arrays with shape (height, width, channels).
+    """
+    _, channels = PIXEL_FORMATS [pixel_format]
+    frame_size = width * height * channels
+    while True:
+        data = stream.read (frame_size)
+        if len (data) < frame_size:
+            break
+        yield numpy.frombuffer (data, dtype = numpy.uint8).reshape ((height, width, channels))
+
+QUANTUM_RANGE = 65535
+"""
+Maximum sample value of the ImageMagick Q16 builds.  Bytes are scaled to
+this range by multiplying them by 257.
+"""
+
+THOMAS_THRESHOLD = 40000
+"""
+Threshold, in quantum units, used by the subtract and threshold comparison.
+"""
+
+def fuzz_distance (same_colour_threshold):
+    """
+    Return the smallest value of 100 times the absolute difference between two Q16 samples for them to be considered different.
+
+    The fuzz option of ImageMagick is a percentage of the quantum range
+    plus one, and it is never smaller than the square root of one half.
+    Two samples differ if their squared difference is greater than or equal
+    to the squared fuzz.  Since samples are integers, this is the same as
+    comparing 100 times the absolute difference with the value returned
+    here, and the comparison is done with integers.
+    """
+    return max (same_colour_threshold * (QUANTUM_RANGE + 1), 71)
+
+def multiply_composite (mask, image):
+    """
+    Compose an image with a mask with the multiply operator, as the convert program does.
+    Returns an array with Q16 samples, rounded as ImageMagick rounds them.
+    """
+    product = mask.astype (numpy.int32) * image.astype (numpy.int32)
+    # round (mask * 257 * image * 257 / 65535) = round (product * 257 / 255)
+    return (product * (2 * 257) + 255) // 510
+
+def count_different_pixels (mask, image1, image2, same_colour_threshold):
+    """
+    Count the pixels that are different between two images in a region of interest.
+
+    This is equivalent to the command
+
+    convert ( mask image1 -compose multiply -composite ) ( mask image2 -compose multiply -composite ) -metric AE -fuzz N% -compare
+
+    where N is the same colour threshold.  The composite images are
+    computed with the Q16 samples of ImageMagick.  A pixel is different if
+    any of its channels is different.
+    """
+    difference = numpy.abs (multiply_composite (mask, image1) - multiply_composite (mask, image2))
+    difference *= 100
+    return int (numpy.count_nonzero ((difference >= fuzz_distance (same_colour_threshold)).any (axis = 2)))
+
+def subtract_threshold_count (mask, image1, image2, threshold = THOMAS_THRESHOLD):
+    """
+    Compute the pixel count difference between two images in a region of interest using a threshold on their difference.
+
+    This is equivalent to the command
+
+    convert image1 image2 -compose Subtract -composite -threshold T mask -compose ModulusSubtract -composite -print %[fx:w*h*mean] null:
+
+    where T is the threshold.  Subtract is the deprecated name of
+    ModulusSubtract, so the second image is subtracted from the first one
+    with wrap around.  The threshold is applied to the Rec601 luma of the
+    difference.  The mask is then subtracted, again with wrap around, and
+    the result is the sum of the first channel in quantum units.
+    """
+    difference = (image1.astype (numpy.int32) - image2.astype (numpy.int32)) * 257 % (QUANTUM_RANGE + 1)
+    if difference.shape [2] == 3:
+        intensity = 0.298839 * difference [:, :, 0] + 0.586811 * difference [:, :, 1] + 0.114350 * difference [:, :, 2]
+    else:
+        intensity = difference [:, :, 0]
+    thresholded = numpy.where (intensity <= threshold, 0, QUANTUM_RANGE)
+    result = (thresholded - mask [:, :, 0].astype (numpy.int32) * 257) % (QUANTUM_RANGE + 1)
+    return result.sum (dtype = numpy.int64) / float (QUANTUM_RANGE)
+
+class CompiledMask:
+    """
+    A region of interest compiled into a boolean array cropped to its bounding box.
+
+    Comparisons done with a compiled mask only touch the pixels inside the
+    bounding box.  The mask is computed from the arena geometry, so it does
+    not have the artifacts of the lossy mask images.
+    """
+    def __init__ (self, top, left, pixels):
+        self.top = top
+        self.left = left
+        self.bottom = top + pixels.shape [0]
+        self.right = left + pixels.shape [1]
+        self.pixels = pixels
+
+    def crop (self, image):
+        """
+        Return the part of the given image that is inside the bounding box of this mask.
+        """
+        return image [self.top:self.bottom, self.left:self.right]
+
+    def count_different_pixels (self, region1, region2, same_colour_threshold):
+        """
+        Count the pixels inside this mask that are different between two cropped images.
+        This is equivalent to function count_different_pixels with a mask whose samples are either 0 or 255.
+        With such a mask the composite samples are the image samples multiplied by 257.
+        """
+        difference = numpy.abs (region1.astype (numpy.int32) - region2.astype (numpy.int32))
+        different = (difference * (257 * 100) >= fuzz_distance (same_colour_threshold)).any (axis = 2)
+        return int (numpy.count_nonzero (different & self.pixels))
+
+def scale_region_of_interest (region_of_interest, scale):
+    """
+    Return the region of interest in an image downscaled by an integer factor.
+    """
+    shape = region_of_interest [0]
+    if shape == 'rectangle':
+        _, left, top, right, bottom = region_of_interest
+        return ('rectangle', left // scale, top // scale, right // scale, bottom // scale)
+    elif shape == 'circle':
+        _, center_x, center_y, radius = region_of_interest
+        return ('circle', center_x // scale, center_y // scale, radius // scale)
+    else:
+        raise ValueError ("Unknown region of interest shape: %s" % (str (shape)))
+
+def compile_mask (width, height, region_of_interest):
+    """
+    Compile a region of interest of an image with the given size.
+
+    The region of interest is a tuple whose first element is the shape name.
+    A rectangle is described by ('rectangle', left, top, right, bottom) with
+    inclusive coordinates, as in the draw option of the convert program.  A
+    circle is described by ('circle', center_x, center_y, radius).
+    """
+    shape = region_of_interest [0]
+    if shape == 'rectangle':
+        _, left, top, right, bottom = region_of_interest
+        left, top = max (left, 0), max (top, 0)
+        right, bottom = min (right, width - 1), min (bottom, height - 1)
+        pixels = numpy.ones ((bottom - top + 1, right - left + 1), dtype = numpy.bool_)
+    elif shape == 'circle':
+        _, center_x, center_y, radius = region_of_interest
+        left, top = max (center_x - radius, 0), max (center_y - radius, 0)
+        right, bottom = min (center_x + radius, width - 1), min (center_y + radius, height - 1)
+        ys, xs = numpy.ogrid [top:bottom + 1, left:right + 1]
+        pixels = (xs - center_x) ** 2 + (ys - center_y) ** 2 <= radius ** 2
+    else:
+        raise ValueError ("Unknown region of interest shape: %s" % (str (shape)))
+    return CompiledMask (top, left, pixels)
+
+def save_compiled_masks (filename, geometry, masks):
+    """
+    Save the compiled masks in a file.  The mask pixels are bit-packed.
+    The geometry the masks were compiled from is saved with them, so that they can be invalidated if it changes.
+    """
+    arrays = {'geometry' : numpy.array (repr (geometry))}
+    for index, mask in enumerate (masks):
+        arrays ['box_%d' % (index)] = numpy.array ([mask.top, mask.left, mask.bottom, mask.right])
+        arrays ['pixels_%d' % (index)] = numpy.packbits (mask.pixels, axis = None)
+    with open (filename, 'wb') as fp:
+        numpy.savez (fp, **arrays)
+        fp.close ()
+
+def load_compiled_masks (filename, geometry = None):
+    """
+    Load the compiled masks saved in a file.
+    Returns None if the file does not exist or if the masks were compiled from a geometry different from the given one.
+    """
+    try:
+        data = numpy.load (filename)
+    except IOError:
+        return None
+    if geometry is not None and str (data ['geometry']) != repr (geometry):
+        return None
+    result = []
+    index = 0
+    while 'box_%d' % (index) in data.files:
+        top, left, bottom, right = [int (v) for v in data ['box_%d' % (index)]]
+        size = (bottom - top) * (right - left)
+        pixels = numpy.unpackbits (data ['pixels_%d' % (index)]) [:size].astype (numpy.bool_).reshape ((bottom - top, right - left))
+        result.append (CompiledMask (top, left, pixels))
+        index += 1
+    data.close ()
+    return result
+
+class FrameCache:
+    """
+    Ring buffer with the decoded frames of an iteration video cropped to the regions of interest.
+
+    A frame is compared with the background and with the frame that is
+    delta_image frames before it.  The buffer keeps the last delta_image + 1
+    frames, so every frame is decoded once and memory use does not depend
+    on the length of the iteration video.
+    """
+    def __init__ (self, masks, delta_image):
+        self.masks = masks
+        self.size = delta_image + 1
+        self.indexes = [None] * self.size
+        self.regions = [None] * self.size
+
+    def crop (self, image):
+        """
+        Return a list with copies of the regions of the given image that are inside the bounding box of each mask.
+        The copies do not keep a reference to the whole image.
+        """
+        return [mask.crop (image).copy () for mask in self.masks]
+
+    def add (self, ith_image, image):
+        """
+        Store the regions of the ith frame, replacing the oldest frame in the buffer.
+        Returns the stored regions.
+        """
+        slot = ith_image % self.size
+        self.indexes [slot] = ith_image
+        self.regions [slot] = self.crop (image)
+        return self.regions [slot]
+
+    def get (self, ith_image):
+        """
+        Return the regions of the ith frame or None if the frame is not in the buffer.
+        """
+        slot = ith_image % self.size
+        if self.indexes [slot] == ith_image:
+            return self.regions [slot]
+        else:
+            return None
+
+class FrameSelection:
+    """
+    The frames of an iteration video whose pixel counts are needed, and the comparisons that are done with them.
+
+    Besides the frames with rows, the frames delta_image frames before
+    them have to be decoded if the comparison with the previous frame is
+    needed.  Attributes first_frame and last_frame delimit the frames
+    that have to be decoded.
+    """
+    def __init__ (self, number_frames, rows, columns, delta_image):
+        self.number_frames = number_frames
+        self.rows = sorted (set (rows))
+        self.columns = tuple (columns)
+        self.delta_image = delta_image
+        self.__rows = set (self.rows)
+        self.__frames = set (self.rows)
+        if PREVIOUS in self.columns:
+            self.__frames.update ([i - delta_image for i in self.rows if i > delta_image])
+        self.first_frame = min (self.__frames) if len (self.__frames) > 0 else 1
+        self.last_frame = max (self.__frames) if len (self.__frames) > 0 else 0
+
+    def needs_row (self, ith_image):
+        """
+        Return True if the pixel counts of the ith frame are needed.
+        """
+        return ith_image in self.__rows
+
+    def needs_frame (self, ith_image):
+        """
+        Return True if the ith frame has to be decoded.
+        """
+        return ith_image in self.__frames
+
+def all_frames (number_frames, delta_image):
+    """
+    Return the selection with every frame of an iteration video and every comparison.
+    """
+    return FrameSelection (number_frames, xrange (1, number_frames + 1), ALL_COLUMNS, delta_image)
+
+def compare_regions (masks, background_regions, current, previous, same_colour_threshold, columns = ALL_COLUMNS):
+    """
+    Compare the regions of interest of a frame with the background and with a previous frame.
+
+    Returns a list with two pixel counts per region of interest.  If there
+    is no previous frame, or if a comparison is not in the given columns,
+    the count is -1.
+    """
+    result = []
+    for index, mask in enumerate (masks):
+        if BACKGROUND in columns:
+            result.append (mask.count_different_pixels (background_regions [index], current [index], same_colour_threshold))
+        else:
+            result.append (-1)
+        if previous is not None and PREVIOUS in columns:
+            result.append (mask.count_different_pixels (current [index], previous [index], same_colour_threshold))
+        else:
+            result.append (-1)
+    return result
+
+def frame_range (frame_source, first_frame, last_frame, needs_frame = None):
+    """
+    Decode frames first_frame to last_frame, inclusive, of an iteration video.
+
+    The frame source is either the tuple ('split', pixel_format, scale),
+    for the images in folder tmp, or the tuple ('stream', filename, width,
+    height, frame_per_second, pixel_format, scale), for the iteration video.
+    The frames are downscaled by the scale factor.  If the predicate
+    needs_frame is given, only the frames for which it is true are yielded.
+    Images in folder tmp that are not needed are not read, while the frames
+    of a stream are all decoded, as they come in order through a pipe.  This
+    is a generator that yields tuples with the frame index and the frame.
+    """
+    if frame_source [0] == 'split':
+        _, pixel_format, scale = frame_source
+        for ith_image in xrange (first_frame, last_frame + 1):
+            if needs_frame is None or needs_frame (ith_image):
+                yield (ith_image, read_image (ITERATION_IMAGE_FILENAME % (ith_image), pixel_format, scale))
+    else:
+        _, filename, width, height, frame_per_second, pixel_format, scale = frame_source
+        frames = video_frames (filename, width, height, frame_per_second, last_frame - first_frame + 1, pixel_format, first_frame, scale)
+        for ith_image, image in enumerate (frames, first_frame):
+            if needs_frame is None or needs_frame (ith_image):
+                yield (ith_image, image)
+
+# Pool of processes that run function compare_frame_range, shared by all evaluations
+_comparison_pool = None
+
+def start_comparison_pool (number_processes):
+    """
+    Start the pool of processes that compare the frames of iteration videos, if there is more than one process.
+
+    The pool is started once and reused by every evaluation.  It must be
+    started from the main thread before other threads are started, such as
+    the telemetry and scoring threads, as forking while another thread holds
+    a lock can deadlock the child processes.
+    """
+    global _comparison_pool
+    if _comparison_pool is None and number_processes > 1:
+        _comparison_pool = multiprocessing.Pool (number_processes)
+    return _comparison_pool
+
+def comparison_pool ():
+    """
+    Return the pool started by function start_comparison_pool, or None.
+    """
+    return _comparison_pool
+
+def stop_comparison_pool ():
+    global _comparison_pool
+    if _comparison_pool is not None:
+        _comparison_pool.close ()
+        _comparison_pool.join ()
+        _comparison_pool = None
+
+def compare_frame_range (task):
+    """
+    Compare the selected frames between first_frame and last_frame of an iteration video.
+
+    This function is run by the processes of a multiprocessing pool.  The
+    task is a tuple with the compiled masks, the background regions, the
+    same colour threshold, the frame source, the frame selection, the first
+    frame and the last frame.  The delta_image frames before the first frame
+    are decoded so that the first frames of the range can be compared with
+    their previous frames.  Returns a list of tuples with the frame index
+    and the row.
+    """
+    masks, background_regions, same_colour_threshold, frame_source, selection, first_frame, last_frame = task
+    delta_image = selection.delta_image
+    frame_cache = FrameCache (masks, delta_image)
+    result = []
+    for ith_image, image in frame_range (frame_source, max (selection.first_frame, first_frame - delta_image), last_frame, selection.needs_frame):
+        current = frame_cache.add (ith_image, image)
+        if ith_image >= first_frame and selection.needs_row (ith_image):
+            previous = frame_cache.get (ith_image - delta_image) if ith_image > delta_image else None
+            result.append ((ith_image, compare_regions (masks, background_regions, current, previous, same_colour_threshold, selection.columns)))
+    return result
@@ -8,6 +8,8 @@ import evaluator
 import chromosome
 import worker
 import continue_inspyred
+import image_comparison
+import rescore
 
 import inspyred
 
@@ -15,6 +17,7 @@ import argparse
 import os
 import csv
 import random
+import sys
 
 import worker_settings
 
@@ -34,7 +37,7 @@ def parse_arguments ():
         '--command', '-c',
         default = None,
         type = str,
-        help = 'what should we do?\n\tnew-run: perform a new experimental run\n\tcontinue-run: continue a previous run')
+        help = 'what should we do?\n\tnew-run: perform a new experimental run\n\tcontinue-run: continue a previous run\n\trescore: recompute the evaluation and fitness values of a previous run with the current configuration')
     parser.add_argument (
         '--run', '-r',
         default = None,
@@ -53,6 +56,20 @@ def parse_arguments ():
         default = 'workers',
         type = str,
         help = 'worker settings file to load')
+    parser.add_argument (
+        '--config',
+        default = 'config',
+        type = str,
+        help = 'configuration file used by the rescore command')
+    parser.add_argument (
+        '--processes',
+        default = None,
+        type = int,
+        help = 'number of processes used by the rescore command, by default the number of CPUs')
+    parser.add_argument (
+        '--use-fitness-function',
+        action = 'store_true',
+        help = 'compute evaluations in the rescore command with the fitness function of the configuration instead of the evaluation used in runs')
     return parser.parse_args ()
 
 
@@ -294,8 +311,7 @@ def report_previous_run_data (population_parents, population_offsprings, last_ge
     raw_input ("Press ENTER to continue")
 
 def terminate_workers_get_data (worker_stubs, experiment_folder):
-    for ws in worker_stubs.values ():
-        ws.terminate_session ()
+    worker_settings.terminate_sessions (worker_stubs.values ())
     worker_settings.collect_data_from_workers (worker_stubs.values (), experiment_folder + "logs")
     
 # def run_inspyred (config, worker_stubs, experiment_folder, current_generation = 1, episode_index = 1, seeds = None, eva_values = None):
@@ -378,20 +394,31 @@ def main ():
     if args.command in ['new-run', 'new_run']:
         cfg = config.Config ()
         cfg.status ()
-        worker_stubs = dict ([ws.connect_to_worker (cfg) for ws in worker_settings.load_worker_settings (args.workers)])
+        # fork the image comparison processes before the telemetry thread starts
+        image_comparison.start_comparison_pool (cfg.image_processing_workers)
+        worker_stubs = worker_settings.ConnectionManager ().connect_to_workers (worker_settings.load_worker_settings (args.workers), cfg)
         # print worker_stubs
         experiment_folder = calculate_experiment_folder_for_new_run (args)
         create_directories_for_experimental_run (experiment_folder, args)
         create_experimental_run_files (experiment_folder)
         new_run (cfg, worker_stubs, experiment_folder)
+        image_comparison.stop_comparison_pool ()
     elif args.command in ['continue-run', 'continue_run']:
         cfg = config.Config ()
         cfg.status ()
         experiment_folder = check_run (args)
         # current_generation, current_episode, seeds, eva_values = load_population_and_evaluation (cfg, experiment_folder)
-        worker_stubs = dict ([ws.connect_to_worker (cfg) for ws in worker_settings.load_worker_settings (args.workers)])
+        # fork the image comparison processes before the telemetry thread starts
+        image_comparison.start_comparison_pool (cfg.image_processing_workers)
+        worker_stubs = worker_settings.ConnectionManager ().connect_to_workers (worker_settings.load_worker_settings (args.workers), cfg)
         # print worker_stubs
         continue_run (cfg, worker_stubs, experiment_folder)
+        image_comparison.stop_comparison_pool ()
+    elif args.command in ['rescore']:
+        cfg = config.Config (args.config)
+        experiment_folder = check_run (args)
+        evaluation_rows, fitness_rows = rescore.rescore_run (cfg, experiment_folder, args.processes, args.use_fitness_function)
+        print ("Rescored %d evaluations and %d chromosomes of %s" % (len (evaluation_rows), len (fitness_rows), experiment_folder))
     elif args.command in ['deploy']:
         worker_settings.deploy_workers (args.workers, None)
     elif args.command == None:
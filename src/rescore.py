@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Offline re-scoring of the evaluations of an experimental run.
+
+The pixel counts of every evaluation are saved in the episode folders, so
+the evaluation and fitness values that the chromosomes of a run would have
+under a different configuration, such as another fitness function or
+other pixel count thresholds, can be computed without bees.  Episodes are
+processed in parallel.  The results are written side by side with the
+values obtained in the run in files rescore-evaluation.csv and
+rescore-fitness.csv of the run folder.
+
+By default an evaluation is computed as in a run, which does not depend
+on the fitness function of the configuration.  The fitness function of
+the configuration is used if it is asked for.
+
+The fitness of a chromosome is computed from the evaluations that the
+evaluator used in the run.  These are the evaluations done in the
+generation of the fitness, plus the evaluations reused from earlier
+generations under the evaluation cache policy of the configuration.
+Racing may have stopped the evaluations of a chromosome early.
+"""
+
+import evaluation_cache
+import evaluator
+
+import csv
+import multiprocessing
+import os.path
+
+# Column indexes in file rescore-evaluation.csv
+RSE_GENERATION       = 0
+RSE_EPISODE          = 1
+RSE_ITERATION        = 2
+RSE_RUN_VALUE        = 3
+RSE_RESCORED_VALUE   = 4
+RSE_CHROMOSOME_GENES = 5
+
+# Column indexes in file rescore-fitness.csv
+RSF_GENERATION       = 0
+RSF_RUN_FITNESS      = 1
+RSF_RESCORED_FITNESS = 2
+RSF_CHROMOSOME_GENES = 3
+
+class RecordedArena:
+    """
+    The arena properties used to compute an evaluation.
+    The evaluator always picks the first worker of an arena as the active CASU.
+    """
+    def __init__ (self, number_workers, selected_worker_index = 0):
+        self.workers = [None] * number_workers
+        self.selected_worker_index = selected_worker_index
+
+# Evaluator used by the processes of the pool and the method that computes
+# an evaluation.  They are set before the pool is created so that the
+# processes inherit them, as the configuration cannot be pickled.
+_rescore_evaluator = None
+_compute_evaluation = None
+
+def image_processing_filename (experiment_folder, episode_index, iteration):
+    """
+    Return the file with the pixel counts of an evaluation.  The NumPy file is preferred to the CSV file.
+    Returns None if there is no such file.
+    """
+    prefix = "%sepisodes/%03d/image-processing_%d" % (experiment_folder, episode_index, iteration)
+    for extension in ['.npy', '.csv']:
+        if os.path.exists (prefix + extension):
+            return prefix + extension
+    return None
+
+def read_csv_rows (filename):
+    with open (filename, 'r') as fp:
+        freader = csv.reader (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
+        freader.next () # skip header row
+        rows = [row for row in freader]
+        fp.close ()
+    return rows
+
+def rescore_episode (task):
+    """
+    Compute the evaluation values of the evaluations of an episode.
+
+    This function is run by the processes of a multiprocessing pool.  The
+    task is a list of tuples with the index of the evaluation and the
+    file with its pixel counts.  Returns a list of tuples with the index of
+    the evaluation and the value, which is None if the file is missing or
+    has too few frames.
+    """
+    result = []
+    for index, filename in task:
+        value = None
+        if filename is not None:
+            results = evaluator.read_image_processing (filename)
+            try:
+                value = _compute_evaluation (RecordedArena (results.shape [1] // 2), results)
+            except Exception as e:
+                print ("Failed to rescore %s: %s" % (filename, str (e)))
+        result.append ((index, value))
+    return result
+
+def chromosome_evaluations (config, experiment_folder, evaluation_rows, partial_rows, values):
+    """
+    Return a list with the evaluation values used to compute the fitness in each partial row, or None if one of them is missing.
+
+    The evaluations done in a generation are matched with the fitness rows
+    of the generation by chromosome genes, in file order.  The evaluations
+    reused from the evaluation cache are replayed with the rules of the
+    evaluator: with concurrent arenas the reused evaluations of a
+    generation are planned before any of its evaluations is done, otherwise
+    chromosome by chromosome.
+    """
+    cache = evaluation_cache.EvaluationCache (config, experiment_folder, load = False)
+    new_rows = {}
+    for index, row in enumerate (evaluation_rows):
+        key = (int (row [evaluator.EVA_GENERATION]), evaluation_cache.chromosome_key (row [evaluator.EVA_CHROMOSOME_GENES:]))
+        new_rows.setdefault (key, []).append (index)
+    result = []
+    done = []
+    for position, row in enumerate (partial_rows):
+        generation = int (row [evaluator.PRT_GENERATION])
+        chromosome = row [evaluator.PRT_CHROMOSOME_GENES:]
+        reused, number_evaluations = cache.plan (generation, chromosome)
+        indexes = new_rows.get ((generation, evaluation_cache.chromosome_key (chromosome)), [])
+        new_indexes = indexes [:number_evaluations]
+        del indexes [:number_evaluations]
+        chromosome_values = reused + [values [index] for index in new_indexes]
+        if None in chromosome_values or len (chromosome_values) == 0:
+            result.append (None)
+        else:
+            result.append (chromosome_values)
+        done.append ((generation, chromosome, new_indexes))
+        last_of_generation = position + 1 == len (partial_rows) or int (partial_rows [position + 1][evaluator.PRT_GENERATION]) != generation
+        if not config.concurrent_arenas or last_of_generation:
+            for done_generation, done_chromosome, done_indexes in done:
+                for index in done_indexes:
+                    if values [index] is not None:
+                        cache.add (done_generation, done_chromosome, values [index])
+            done = []
+    return result
+
+def rescore_run (config, experiment_folder, number_processes = None, use_fitness_function = False):
+    """
+    Recompute the evaluation and fitness values of the chromosomes of an experimental run with the given configuration.
+    If use_fitness_function is true, evaluations are computed with the fitness function of the configuration, otherwise as in a run.
+    Returns a tuple with the rows written in files rescore-evaluation.csv and rescore-fitness.csv.
+    """
+    global _rescore_evaluator
+    global _compute_evaluation
+    _rescore_evaluator = evaluator.Evaluator (config, None, experiment_folder)
+    if use_fitness_function:
+        _compute_evaluation = _rescore_evaluator.compute_evaluation_NORMAL
+    else:
+        _compute_evaluation = _rescore_evaluator.compute_evaluation
+    evaluation_rows = read_csv_rows (experiment_folder + "evaluation.csv")
+    partial_rows = read_csv_rows (experiment_folder + "partial.csv")
+    tasks = {}
+    for index, row in enumerate (evaluation_rows):
+        episode_index = int (row [evaluator.EVA_EPISODE])
+        filename = image_processing_filename (experiment_folder, episode_index, int (row [evaluator.EVA_ITERATION]))
+        tasks.setdefault (episode_index, []).append ((index, filename))
+    pool = multiprocessing.Pool (number_processes)
+    try:
+        values = [None] * len (evaluation_rows)
+        for episode_values in pool.map (rescore_episode, [tasks [key] for key in sorted (tasks.keys ())]):
+            for index, value in episode_values:
+                values [index] = value
+    finally:
+        pool.close ()
+        pool.join ()
+    rescore_evaluation_rows = [
+        [row [evaluator.EVA_GENERATION],
+         row [evaluator.EVA_EPISODE],
+         row [evaluator.EVA_ITERATION],
+         row [evaluator.EVA_VALUE],
+         values [index]] + row [evaluator.EVA_CHROMOSOME_GENES:]
+        for index, row in enumerate (evaluation_rows)]
+    rescore_fitness_rows = []
+    for row, chromosome_values in zip (partial_rows, chromosome_evaluations (config, experiment_folder, evaluation_rows, partial_rows, values)):
+        if chromosome_values is None:
+            rescored_fitness = None
+        else:
+            rescored_fitness = _rescore_evaluator._evaluation_values_reduce (chromosome_values)
+        rescore_fitness_rows.append ([row [evaluator.PRT_GENERATION], row [evaluator.PRT_FITNESS], rescored_fitness] + row [evaluator.PRT_CHROMOSOME_GENES:])
+    write_rows (experiment_folder + "rescore-evaluation.csv",
+                ["generation", "episode", "iteration", "run_value", "rescored_value", "chromosome_genes"],
+                rescore_evaluation_rows)
+    write_rows (experiment_folder + "rescore-fitness.csv",
+                ["generation", "run_fitness", "rescored_fitness", "chromosome_genes"],
+                rescore_fitness_rows)
+    return (rescore_evaluation_rows, rescore_fitness_rows)
+
+def write_rows (filename, header, rows):
+    with open (filename, 'w') as fp:
+        f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
+        f.writerow (header)
+        for row in rows:
+            f.writerow (['' if value is None else value for value in row])
+        fp.close ()
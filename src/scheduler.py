@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Scheduler of the timed actions of a worker.
+
+The commands that run a vibration pattern or spread the bees are
+sequences of CASU actions separated by waits.  Instead of sleeping between
+actions, the worker schedules them on a monotonic clock and runs them from
+its poll loop, so it can answer other requests while a command is running.
+Actions have a tag, so that the actions of a command can be cancelled
+without cancelling the others.
+"""
+
+import ctypes
+import ctypes.util
+import heapq
+import os
+import sys
+import time
+import traceback
+
+CLOCK_MONOTONIC = 1
+"""
+Identifier of the monotonic clock of function clock_gettime in Linux.
+"""
+
+class Timespec (ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+def clock_gettime_monotonic ():
+    """
+    Return the monotonic clock function of the C library.
+    Python 2 has no monotonic clock in the standard library.
+    The wall clock is not used instead, as setting the time of the CASU computer would move the actions of a running command.
+    Raises OSError if the C library has no monotonic clock.
+    """
+    if not sys.platform.startswith ('linux'):
+        raise OSError ("No monotonic clock on platform %s" % (sys.platform))
+    for library in ['c', 'rt']:
+        path = ctypes.util.find_library (library)
+        if path is None:
+            continue
+        clock_gettime = getattr (ctypes.CDLL (path, use_errno = True), 'clock_gettime', None)
+        if clock_gettime is not None:
+            break
+    else:
+        raise OSError ("Function clock_gettime not found in the C library")
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER (Timespec)]
+    timespec = Timespec ()
+    def monotonic ():
+        if clock_gettime (CLOCK_MONOTONIC, ctypes.byref (timespec)) != 0:
+            errno = ctypes.get_errno ()
+            raise OSError (errno, "clock_gettime failed: %s" % (os.strerror (errno)))
+        return timespec.tv_sec + timespec.tv_nsec * 1e-9
+    monotonic ()
+    return monotonic
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    monotonic = clock_gettime_monotonic ()
+
+class Scheduler:
+    """
+    Queue of actions ordered by the time they must run.
+    Actions with the same time run in the order they were scheduled.
+    The error handler, if given, is called with the tag and the exception of an action that fails.
+    """
+    def __init__ (self, error_handler = None):
+        self.queue = []
+        self.counter = 0
+        self.error_handler = error_handler
+
+    def at (self, when, action, tag = None):
+        """
+        Schedule the action to run at the given time of the monotonic clock.
+        """
+        heapq.heappush (self.queue, (when, self.counter, tag, action))
+        self.counter += 1
+
+    def after (self, delay, action, tag = None):
+        """
+        Schedule the action to run the given number of seconds from now.
+        """
+        self.at (monotonic () + delay, action, tag)
+
+    def sequence (self, steps, tag = None, start = None):
+        """
+        Schedule a sequence of actions given by a list of tuples with the seconds after the previous action and the action.
+        The first delay counts from the given start time, or from now if it is None.
+        Returns the time of the last action.
+        """
+        when = monotonic () if start is None else start
+        for delay, action in steps:
+            when += delay
+            self.at (when, action, tag)
+        return when
+
+    def cancel (self, tag):
+        """
+        Remove the actions with the given tag.
+        """
+        self.queue = [item for item in self.queue if item [2] != tag]
+        heapq.heapify (self.queue)
+
+    def timeout (self):
+        """
+        Return the milliseconds until the next action, or None if there is no action.
+        """
+        if len (self.queue) == 0:
+            return None
+        return max (0, (self.queue [0][0] - monotonic ()) * 1000)
+
+    def run_due (self):
+        """
+        Run the actions whose time has come.
+        An action that raises an exception does not stop the others: the error is printed, the remaining actions with its tag are cancelled and the error handler is called.
+        """
+        while len (self.queue) > 0 and self.queue [0][0] <= monotonic ():
+            (_, _, tag, action) = heapq.heappop (self.queue)
+            try:
+                action ()
+            except Exception as error:
+                traceback.print_exc ()
+                if tag is not None:
+                    self.cancel (tag)
+                if self.error_handler is not None:
+                    self.error_handler (tag, error)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cache of the CASU temperatures published by the workers.
+
+Each worker publishes the temperature of its CASU every
+worker.TELEMETRY_PERIOD seconds on a ZMQ PUB socket bound to the telemetry
+address of its worker settings.  The master subscribes to all workers and
+a background thread keeps the latest temperature of each CASU together
+with the time it was received.  Checking the status of an arena is then a
+lookup in this cache.  Temperatures older than the staleness limit are not
+used, and the master requests them from the workers with command
+CASU_STATUS.  This also covers workers that do not publish telemetry.
+"""
+
+import zmq_sock_utils
+
+import threading
+import time
+import zmq
+
+POLL_TIMEOUT = 500
+"""
+Milliseconds the telemetry thread waits for readings before checking if it must stop.
+"""
+
+class TelemetryCache:
+    """
+    Latest CASU temperatures published by the workers.
+    """
+    def __init__ (self, context, worker_settings, staleness):
+        self.staleness = staleness
+        self.readings = {}
+        self.lock = threading.Lock ()
+        self.keep_going = True
+        self.socket = context.socket (zmq.SUB)
+        self.socket.setsockopt (zmq.SUBSCRIBE, '')
+        for ws in worker_settings:
+            print ("Subscribing to telemetry of worker at %s responsible for casu #%d..." % (ws.tel_addr, ws.casu_number))
+            self.socket.connect (ws.tel_addr)
+        self.thread = threading.Thread (target = self.run)
+        self.thread.daemon = True
+        self.thread.start ()
+
+    def run (self):
+        """
+        Receive the readings published by the workers until method stop is called.
+        Malformed messages are reported and ignored.
+        """
+        poller = zmq.Poller ()
+        poller.register (self.socket, zmq.POLLIN)
+        while self.keep_going:
+            if len (poller.poll (POLL_TIMEOUT)) == 0:
+                continue
+            data_bytes = self.socket.recv ()
+            try:
+                data, _ = zmq_sock_utils.loads (data_bytes, accept_pickle = False)
+                (casu_number, _, temperature) = data
+            except Exception as error:
+                # a malformed reading must not stop the thread, or the cache would keep old temperatures
+                print ("Ignoring malformed telemetry message %r: %s" % (data_bytes [:64], str (error)))
+                continue
+            if temperature is not None:
+                with self.lock:
+                    self.readings [casu_number] = (time.time (), temperature)
+        self.socket.setsockopt (zmq.LINGER, 0)
+        self.socket.close ()
+
+    def temperature (self, casu_number):
+        """
+        Return the latest temperature of the given CASU, or None if it was received more than staleness seconds ago.
+        """
+        with self.lock:
+            reading = self.readings.get (casu_number)
+        if reading is None or time.time () - reading [0] > self.staleness:
+            return None
+        return reading [1]
+
+    def stop (self):
+        self.keep_going = False
+        self.thread.join ()
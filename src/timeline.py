@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Timeline of the frames of an iteration video.
+
+An evaluation is a sequence of segments: the bees are spread, then there
+is a period without stimuli, then the active CASU vibrates.  The workers
+turn the CASU LED on for two frames at the start of each segment, which
+is a blip.  The timeline maps each frame of the iteration video to its
+segment.  It is computed once from the configuration and it is used to
+decide how many frames are recorded, which frames are skipped, and which
+frames are used by each part of the evaluation.  It is also converted
+to the program of timed CASU actions that a worker runs during an
+iteration video.
+"""
+
+import numpy
+
+BLIP = 'blip'
+SPREADING = 'spreading'
+NO_STIMULI = 'no_stimuli'
+VIBRATION = 'vibration'
+
+BLIP_FRAMES = 2
+"""
+Number of frames with the CASU LED on.  The workers keep the LED on for 2.0 / frame_per_second seconds.
+"""
+
+BLIP_COLOUR = [0.125, 0, 0]
+"""
+Red, green and blue intensities of the CASU LED in a blip.
+"""
+
+class Timeline:
+    """
+    The segments of an iteration video and the segment of each frame.
+
+    Frames are numbered from 1.  If the configuration has no blips, there
+    are no blip frames and the video is shorter, so that the segments have
+    the same length with and without blips.  Only workers that run the
+    program of the timeline can leave the blips out, as the active and
+    passive CASU commands always blip, so without worker programs the
+    timeline has blips whatever the configuration says.  The video ends
+    with the vibration segment, as no segment uses the frames after it.
+    """
+    def __init__ (self, config):
+        self.frame_per_second = config.frame_per_second
+        self.has_blip = config.has_blip or not config.worker_program
+        durations = [
+            (SPREADING,  config.spreading_waiting_time),
+            (NO_STIMULI, config.no_stimuli_run_time),
+            (VIBRATION,  config.vibration_run_time)]
+        self.segments = []
+        first_frame = 1
+        for name, duration in durations:
+            number_frames = int (round (duration * config.frame_per_second))
+            if self.has_blip:
+                self.segments.append ((BLIP, first_frame, BLIP_FRAMES))
+                first_frame += BLIP_FRAMES
+            self.segments.append ((name, first_frame, number_frames))
+            first_frame += number_frames
+        self.number_frames = first_frame - 1
+        self.frame_segment = [None] * self.number_frames
+        for name, first_frame, number_frames in self.segments:
+            self.frame_segment [first_frame - 1:first_frame - 1 + number_frames] = [name] * number_frames
+
+    def duration (self):
+        """
+        Return the duration of the iteration video in seconds.
+        """
+        return float (self.number_frames) / self.frame_per_second
+
+    def program (self, vibration_pattern = None):
+        """
+        Return the program that a worker runs during an iteration video, which is a list of timed CASU actions.
+
+        Each action is a list with its offset in seconds from the first
+        frame, its name and its arguments.  The CASU vibrates with the given
+        vibration pattern, a tuple with the periods, frequencies and
+        amplitudes, or it does not vibrate if the pattern is None.  The
+        program ends with a blip after the vibration segment.
+        """
+        def offset (ith_frame):
+            return float (ith_frame - 1) / self.frame_per_second
+        result = []
+        for name, first_frame, number_frames in self.segments:
+            start = offset (first_frame)
+            end = offset (first_frame + number_frames)
+            if name == BLIP:
+                result.append ([start, 'led'] + BLIP_COLOUR)
+                result.append ([end, 'led_standby'])
+            elif name == SPREADING:
+                result.append ([start, 'airflow', 1])
+                result.append ([end, 'airflow_standby'])
+            elif name == VIBRATION and vibration_pattern is not None:
+                result.append ([start, 'vibration'] + list (vibration_pattern))
+                result.append ([end, 'speaker_standby'])
+        if self.has_blip:
+            result.append ([self.duration (), 'led'] + BLIP_COLOUR)
+            result.append ([self.duration () + float (BLIP_FRAMES) / self.frame_per_second, 'led_standby'])
+        return result
+
+    def segment_of (self, ith_frame):
+        """
+        Return the name of the segment of the ith frame, or None if the frame is after the last segment.
+        """
+        if 1 <= ith_frame <= self.number_frames:
+            return self.frame_segment [ith_frame - 1]
+        return None
+
+    def frames (self, name):
+        """
+        Return the indexes of the frames of the segments with the given name.
+        """
+        result = []
+        for segment_name, first_frame, number_frames in self.segments:
+            if segment_name == name:
+                result.extend (xrange (first_frame, first_frame + number_frames))
+        return result
+
+    def mask (self, name, number_frames = None):
+        """
+        Return a boolean array that selects the rows of the frames of the segments with the given name in a results array with the given number of rows.
+        """
+        if number_frames is None:
+            number_frames = self.number_frames
+        result = numpy.zeros (number_frames, dtype = numpy.bool_)
+        for segment_name, first_frame, length in self.segments:
+            if segment_name == name:
+                result [first_frame - 1:first_frame - 1 + length] = True
+        return result
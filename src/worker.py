@@ -1,13 +1,35 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+"""
+Worker program that controls a CASU on behalf of the master program.
+
+The worker listens for commands on a ZMQ ROUTER socket.  Commands that
+run a vibration pattern or spread the bees are sequences of timed CASU
+actions.  They are scheduled on a monotonic clock and run from the poll
+loop of the worker, which answers the requests that arrive in the
+meantime.  The reply to such a command is sent when its last action runs.
+While a command is running the worker answers CASU_STATUS, HEARTBEAT and
+ABORT requests sent through another socket, and replies WORKER_BUSY to
+other commands that take time.
+
+Command PROGRAM carries a list of timed CASU actions computed by the
+master from the timeline of the iteration video.  Each action is run at
+its offset from the start of the program, and the reply has the planned
+and actual offset of every action.
+"""
+
 import chromosome
+import scheduler
 import zmq_sock_utils
 
 from assisipy import casu
 
+import Queue
+import math
 import time
 import sys
+import threading
 import zmq
 import signal
 
@@ -18,11 +40,31 @@ CASU_STATUS                  = 4
 VIBRATION_PATTERN_440_09_01  = 7
 STANDBY_CASU                 = 8
 SPREAD_BEES                  = 10
+HEARTBEAT                    = 11
+ABORT                        = 12
+PROGRAM                      = 13
 TERMINATE                    = 31
 WORKER_OK              = 1000
+WORKER_BUSY            = 1001
+WORKER_ABORTED         = 1002
+WORKER_INVALID_PROGRAM = 1003
+WORKER_INVALID_MESSAGE = 1004
+WORKER_ERROR           = 1005
 
 CASU_TEMPERATURE = 28
 
+TELEMETRY_PERIOD = 1
+
+VIBRATION_POLL_PERIOD = 0.01
+"""
+Seconds between the runs of the CASU calls made by the vibration thread.
+"""
+
+COMMAND_TAG = 'command'
+"""
+Tag of the scheduled actions of the running command.
+"""
+
 evaluation_run_time = None
 vibration_run_time = None
 no_stimuli_run_time = None
@@ -33,11 +75,205 @@ run_vibration_model = None
 
 keep_going = True
 
+# the command that is running: a tuple with the command, the return address of its request and the time of its last action
+running_command = None
+# the thread that runs the vibration model, the event that stops it, and the queue of its CASU calls
+vibration_thread = None
+vibration_stop = None
+casu_calls = Queue.Queue ()
+time_start_vibration_pattern = None
+
+# pickle messages are rejected once the master initialised the worker with the binary codec
+accept_pickle = True
+
+def reply (data, address = None):
+    """
+    Reply to the request being handled, or to the request with the given return address.
+    """
+    if address is None:
+        address = request_address
+    zmq_sock_utils.send_routed (socket, address, data)
+
 def blip_casu ():
-    a_casu.set_diagnostic_led_rgb (0.125, 0, 0)
-    time.sleep (2.0 / frame_per_second)
-    a_casu.diagnostic_led_standby ()
-    
+    """
+    Return the steps that turn the CASU LED on for two frames.
+    """
+    return [
+        (0, lambda : a_casu.set_diagnostic_led_rgb (0.125, 0, 0)),
+        (2.0 / frame_per_second, a_casu.diagnostic_led_standby)]
+
+def spread_bees (seconds):
+    """
+    Return the steps that turn the CASU airflow on for the given number of seconds.
+    """
+    return [
+        (0, lambda : print_step ("Spreading...")),
+        (0, lambda : a_casu.set_airflow_intensity (1)),
+        (seconds, a_casu.airflow_standby)]
+
+def wait (seconds):
+    return [(seconds, lambda : None)]
+
+def print_step (text):
+    print ("W%dC   %s" % (casu_number, text))
+
+class CasuProxy:
+    """
+    CASU given to the vibration thread.
+    The CASU is not thread safe, so the calls are queued and the main loop runs them.
+    Calls made after the stop event is set are dropped.
+    """
+    def __init__ (self, stop_event):
+        self.stop_event = stop_event
+
+    def __getattr__ (self, name):
+        def method (*arguments):
+            if not self.stop_event.is_set ():
+                casu_calls.put ((self.stop_event, name, arguments))
+        return method
+
+def run_casu_calls ():
+    """
+    Run the CASU calls queued by the vibration thread, except those of a stopped thread.
+    """
+    while not casu_calls.empty ():
+        (stop_event, name, arguments) = casu_calls.get ()
+        if not stop_event.is_set ():
+            getattr (a_casu, name) (*arguments)
+
+def watch_vibration ():
+    """
+    Run the CASU calls of the vibration thread and check again later if the thread is alive.
+    """
+    global vibration_thread
+    run_casu_calls ()
+    if vibration_thread is not None:
+        if vibration_thread.is_alive ():
+            a_scheduler.after (VIBRATION_POLL_PERIOD, watch_vibration, COMMAND_TAG)
+        else:
+            vibration_thread = None
+
+def stop_vibration_thread ():
+    """
+    Stop the vibration thread.  The thread is not joined, it finishes on its own and its later CASU calls are dropped.
+    """
+    global vibration_thread
+    if vibration_stop is not None:
+        vibration_stop.set ()
+    vibration_thread = None
+
+def start_vibration (genes, *args):
+    """
+    Return the step that runs the vibration model of the chromosome.
+    The vibration models sleep while the CASU vibrates, so they run in a thread.
+    """
+    def action ():
+        global vibration_thread
+        global vibration_stop
+        global time_start_vibration_pattern
+        print_step ("Vibration...")
+        stop_vibration_thread ()
+        time_start_vibration_pattern = time.time ()
+        if run_vibration_model is not None:
+            vibration_stop = threading.Event ()
+            vibration_thread = threading.Thread (target = run_vibration_model, args = (genes, CasuProxy (vibration_stop)) + args)
+            vibration_thread.daemon = True
+            vibration_thread.start ()
+            watch_vibration ()
+    return [(0, action)]
+
+def stop_vibration (seconds):
+    """
+    Return the step that stops the vibration model after the given number of seconds and puts the speaker in standby.
+    """
+    def action ():
+        run_casu_calls ()
+        stop_vibration_thread ()
+        a_casu.speaker_standby ()
+    return [(seconds, action)]
+
+def start_command (name, steps, answer, start = None):
+    """
+    Schedule the steps of a command that takes time, starting at the given time of the monotonic clock or now.
+    When the steps are done, the function answer is called to get the reply.
+    Returns False if the worker is busy running another command.
+    """
+    global running_command
+    if running_command is not None:
+        print ("W%dC Busy running command %d!" % (casu_number, running_command [0]))
+        reply ([WORKER_BUSY])
+        return False
+    print ("W%dC %s..." % (casu_number, name))
+    address = request_address
+    def finish ():
+        global running_command
+        running_command = None
+        print ("W%dC Done!" % (casu_number))
+        reply (answer (), address)
+    end = a_scheduler.sequence (steps + [(0, finish)], COMMAND_TAG, start)
+    running_command = (message [0], address, end)
+    return True
+
+def vibrate (vibe_periods, vibe_freqs, vibe_amps):
+    global time_start_vibration_pattern
+    time_start_vibration_pattern = time.time ()
+    a_casu.set_vibration_pattern (vibe_periods, vibe_freqs, vibe_amps)
+
+PROGRAM_ACTIONS = {
+    'led'             : lambda red, green, blue : a_casu.set_diagnostic_led_rgb (red, green, blue),
+    'led_standby'     : lambda : a_casu.diagnostic_led_standby (),
+    'airflow'         : lambda intensity : a_casu.set_airflow_intensity (intensity),
+    'airflow_standby' : lambda : a_casu.airflow_standby (),
+    'vibration'       : vibrate,
+    'speaker_standby' : lambda : a_casu.speaker_standby (),
+    }
+"""
+CASU actions that can be used in a program, and the functions that run them.
+"""
+
+def is_number (value):
+    return isinstance (value, (int, long, float)) and not isinstance (value, bool) and not math.isnan (value) and not math.isinf (value)
+
+def is_vibration_pattern (arguments):
+    """
+    Check that the arguments are the periods, frequencies and amplitudes of a vibration pattern, three lists of numbers with the same length.
+    """
+    return len (arguments) == 3 \
+        and all (isinstance (argument, list) and len (argument) == len (arguments [0]) and all (is_number (value) for value in argument) for argument in arguments)
+
+PROGRAM_ARGUMENTS = {
+    'led'             : lambda arguments : len (arguments) == 3 and all (is_number (value) for value in arguments),
+    'led_standby'     : lambda arguments : len (arguments) == 0,
+    'airflow'         : lambda arguments : len (arguments) == 1 and is_number (arguments [0]),
+    'airflow_standby' : lambda arguments : len (arguments) == 0,
+    'vibration'       : is_vibration_pattern,
+    'speaker_standby' : lambda arguments : len (arguments) == 0,
+    }
+"""
+Functions that check the arguments of each program action.
+"""
+
+def is_program_action (action):
+    """
+    Check that the action is a list with a non-negative offset, the name of a program action and its arguments.
+    """
+    return isinstance (action, list) \
+        and len (action) >= 2 \
+        and is_number (action [0]) \
+        and action [0] >= 0 \
+        and isinstance (action [1], basestring) \
+        and action [1] in PROGRAM_ARGUMENTS \
+        and PROGRAM_ARGUMENTS [action [1]] (action [2:])
+
+def publish_telemetry ():
+    """
+    Publish the CASU temperature and schedule the next publication in TELEMETRY_PERIOD seconds.
+    The next publication is scheduled first, so that a failed reading does not stop the telemetry.
+    """
+    a_scheduler.after (TELEMETRY_PERIOD, publish_telemetry)
+    temperature = a_casu.get_temp (casu.TEMP_WAX)
+    pub_socket.send (zmq_sock_utils.dumps ([casu_number, time.time (), temperature], zmq_sock_utils.PROTOCOL_VERSION))
+
 def cmd_initialise ():
     if len (message) != 8:
         print ("Invalid initialisation message!\n" + str (message))
@@ -50,7 +286,10 @@ def cmd_initialise ():
     global spreading_waiting_time
     global frame_per_second
     global run_vibration_model
+    global accept_pickle
     print ("W%dC Initialisation message..." % casu_number)
+    if request_address [1] != zmq_sock_utils.PICKLE:
+        accept_pickle = False
     vibration_run_time     = message [1]
     no_stimuli_run_time   = message [2]
     number_repetitions     = message [3]
@@ -69,89 +308,99 @@ def cmd_initialise ():
     a_casu.ir_standby ()
     a_casu.speaker_standby ()
     print ("W%dC Done!" % (casu_number))
-    zmq_sock_utils.send (socket, [WORKER_OK])
+    # the version of the binary codec tells the master that it can stop using pickle
+    reply ([WORKER_OK, zmq_sock_utils.PROTOCOL_VERSION])
 
 def cmd_active_casu ():
-    print ("W%dC Active CASU..." % casu_number)
-    blip_casu ()
-    time_start_vibration_pattern = time.time ()
-    if run_vibration_model is None:
-        time.sleep (evaluation_run_time) # sound hardware by Graz
-    else:
-        run_vibration_model (message [1], a_casu, vibration_run_time, no_stimuli_run_time, number_repetitions)
-    a_casu.speaker_standby ()
-    blip_casu ()
-    print ("W%dC Spreading..." % (casu_number))
-    a_casu.set_airflow_intensity (1)
-    time.sleep (spreading_waiting_time)
-    a_casu.airflow_standby ()
-    print ("W%dC Done!" % (casu_number))
-    zmq_sock_utils.send (socket, [WORKER_OK, time_start_vibration_pattern])
+    start_command (
+        "Active CASU",
+        blip_casu ()
+        + start_vibration (message [1], vibration_run_time, no_stimuli_run_time, number_repetitions)
+        + stop_vibration (evaluation_run_time)
+        + blip_casu ()
+        + spread_bees (spreading_waiting_time),
+        lambda : [WORKER_OK, time_start_vibration_pattern])
 
 def cmd_passive_casu ():
-    print ("W%dC Passive CASU..." % casu_number)
-    time.sleep (2.0 / frame_per_second)
-    time.sleep (evaluation_run_time)
-    blip_casu ()
-    print ("W%dC Spreading..." % (casu_number))
-    a_casu.set_airflow_intensity (1)
-    time.sleep (spreading_waiting_time)
-    a_casu.airflow_standby ()
-    print ("W%dC Done!" % (casu_number))
-    zmq_sock_utils.send (socket, [WORKER_OK])
+    start_command (
+        "Passive CASU",
+        wait (2.0 / frame_per_second)
+        + wait (evaluation_run_time)
+        + blip_casu ()
+        + spread_bees (spreading_waiting_time),
+        lambda : [WORKER_OK])
 
 def cmd_active_casu_HACK ():
-    print ("W%dC Active CASU hack..." % casu_number)
-    blip_casu ()
-    print ("W%dC   Spreading..." % (casu_number))
-    a_casu.set_airflow_intensity (1)
-    time.sleep (30)
-    a_casu.airflow_standby ()
-    blip_casu ()
-    print ("W%dC   No stimuli..." % (casu_number))
-    time.sleep (10)
-    blip_casu ()
-    print ("W%dC   Vibration..." % (casu_number))
-    time_start_vibration_pattern = time.time ()
-    run_vibration_model (message [1], a_casu, 30, 0, 0)
-    a_casu.speaker_standby ()
-    blip_casu ()
-    print ("W%dC Done!" % (casu_number))
-    zmq_sock_utils.send (socket, [WORKER_OK, time_start_vibration_pattern])
+    start_command (
+        "Active CASU hack",
+        blip_casu ()
+        + spread_bees (spreading_waiting_time)
+        + blip_casu ()
+        + [(0, lambda : print_step ("No stimuli..."))]
+        + wait (no_stimuli_run_time)
+        + blip_casu ()
+        + start_vibration (message [1], vibration_run_time, 0, 0)
+        + stop_vibration (vibration_run_time)
+        + blip_casu (),
+        lambda : [WORKER_OK, time_start_vibration_pattern])
 
 def cmd_passive_casu_HACK ():
-    print ("W%dC Passive CASU hack..." % casu_number)
-    blip_casu ()
-    print ("W%dC   Spreading..." % (casu_number))
-    a_casu.set_airflow_intensity (1)
-    time.sleep (30)
-    a_casu.airflow_standby ()
-    blip_casu ()
-    print ("W%dC   No stimuli..." % (casu_number))
-    time.sleep (10)
-    blip_casu ()
-    print ("W%dC   No Stimuli..." % (casu_number))
-    time.sleep (30)
-    blip_casu ()
-    print ("W%dC Done!" % (casu_number))
-    zmq_sock_utils.send (socket, [WORKER_OK])
+    start_command (
+        "Passive CASU hack",
+        blip_casu ()
+        + spread_bees (spreading_waiting_time)
+        + blip_casu ()
+        + [(0, lambda : print_step ("No stimuli..."))]
+        + wait (no_stimuli_run_time)
+        + blip_casu ()
+        + [(0, lambda : print_step ("No Stimuli..."))]
+        + wait (vibration_run_time)
+        + blip_casu (),
+        lambda : [WORKER_OK])
 
 def cmd_vibration_pattern_440_09_01 ():
-    print ("W%dC Running vibration pattern: frequency 440Hz, duration 0.9s, pause 0.1s" % (casu_number))
-    number_repeats = message [1]
-    for n in xrange (number_repeats):
-        print ("W%dC Repeat #%d" % (casu_number, n + 1))
-        blip_casu ()
-        vibe_periods = [900,  100]
-        vibe_freqs   = [440,    1]
-        vibe_amps    = [ 50,    0]
-        el_casu.set_vibration_pattern (vibe_periods, vibe_freqs, vibe_amps)
-        time.sleep (evaluation_run_time)
-        blip_casu ()
-        a_casu.speaker_standby ()
-        time.sleep (spreading_waiting_time)
-    print ("W%dC Done!" % (casu_number))
-    zmq_sock_utils.send (socket, [WORKER_OK])
+    vibe_periods = [900,  100]
+    vibe_freqs   = [440,    1]
+    vibe_amps    = [ 50,    0]
+    steps = []
+    for n in xrange (message [1]):
+        steps += \
+            [(0, lambda n = n : print_step ("Repeat #%d" % (n + 1)))] \
+            + blip_casu () \
+            + [(0, lambda : a_casu.set_vibration_pattern (vibe_periods, vibe_freqs, vibe_amps))] \
+            + wait (evaluation_run_time) \
+            + blip_casu () \
+            + [(0, a_casu.speaker_standby)] \
+            + wait (spreading_waiting_time)
+    start_command ("Running vibration pattern: frequency 440Hz, duration 0.9s, pause 0.1s", steps, lambda : [WORKER_OK])
+
+def cmd_program ():
+    """
+    Run a program, a list of CASU actions, each one a list with its offset in seconds from the start of the program, its name and its arguments.
+    The actions are scheduled at once, so the time an action runs does not depend on how long the previous actions took.
+    The program is checked before any action is scheduled.
+    """
+    global time_start_vibration_pattern
+    if len (message) != 2 or not isinstance (message [1], list) or not all (is_program_action (action) for action in message [1]):
+        print ("W%dC Invalid program!\n%s" % (casu_number, str (message [1:])))
+        reply ([WORKER_INVALID_PROGRAM])
+        return
+    program = sorted (message [1], key = lambda action : action [0])
+    timings = []
+    start = scheduler.monotonic ()
+    def step (planned, name, arguments):
+        def action ():
+            timings.append ([planned, scheduler.monotonic () - start])
+            PROGRAM_ACTIONS [name] (*arguments)
+        return action
+    steps = []
+    previous = 0
+    for action in program:
+        steps.append ((action [0] - previous, step (action [0], action [1], action [2:])))
+        previous = action [0]
+    if start_command ("Running program with %d actions" % (len (program)), steps, lambda : [WORKER_OK, time_start_vibration_pattern, timings], start):
+        # only reset after the busy check, as the running command may use it
+        time_start_vibration_pattern = None
 
 def cmd_standby_casu ():
     print ("W%dC Putting CASU in standby" % (casu_number))
@@ -161,25 +410,77 @@ def cmd_standby_casu ():
     a_casu.ir_standby ()
     a_casu.speaker_standby ()
     print ("W%dC Done!" % (casu_number))
-    zmq_sock_utils.send (socket, [WORKER_OK])
+    reply ([WORKER_OK])
 
 def cmd_spread_bees ():
-    print ("W%dC Spreading bees..." % (casu_number))
-    a_casu.set_temp (CASU_TEMPERATURE)
-    a_casu.set_airflow_intensity (1)
-    time.sleep (message [1])
+    start_command (
+        "Spreading bees",
+        [(0, lambda : a_casu.set_temp (CASU_TEMPERATURE))]
+        + spread_bees (message [1]),
+        lambda : [WORKER_OK])
+
+def cmd_heartbeat ():
+    """
+    Reply with the running command and the seconds until it finishes.
+    """
+    if running_command is None:
+        reply ([WORKER_OK, None, 0])
+    else:
+        reply ([WORKER_OK, running_command [0], max (0, running_command [2] - scheduler.monotonic ())])
+
+def end_command (answer, outcome):
+    """
+    Cancel the actions of the running command, put the CASU in standby and send the given answer to the command request.
+    Returns the ended command or None.
+    """
+    global running_command
+    if running_command is None:
+        return None
+    (command, address, _) = running_command
+    running_command = None
+    a_scheduler.cancel (COMMAND_TAG)
+    casu_standby ()
+    print ("W%dC %s command %d" % (casu_number, outcome, command))
+    reply (answer, address)
+    return command
+
+def casu_standby ():
+    """
+    Stop the vibration thread and put the LED, airflow and speaker of the CASU in standby.
+    """
+    stop_vibration_thread ()
+    a_casu.diagnostic_led_standby ()
     a_casu.airflow_standby ()
-    print ("W%dC Done!" % (casu_number))
-    zmq_sock_utils.send (socket, [WORKER_OK])
+    a_casu.speaker_standby ()
+
+def abort_command ():
+    """
+    Cancel the actions of the running command, put the CASU in standby and reply WORKER_ABORTED to the command request.
+    Returns the aborted command or None.
+    """
+    return end_command ([WORKER_ABORTED], "Aborted")
+
+def action_failed (tag, error):
+    """
+    Error handler of the scheduler.
+    A failed action of the running command ends it, puts the CASU in standby and replies WORKER_ERROR with the error to the command request.
+    """
+    if tag == COMMAND_TAG:
+        if end_command ([WORKER_ERROR, "%s: %s" % (type (error).__name__, str (error))], "Failed") is None:
+            casu_standby ()
+
+def cmd_abort ():
+    reply ([WORKER_OK, abort_command ()])
 
 def cmd_terminate ():
     global keep_going
     print ("W%dC Terminating..." % (casu_number))
+    abort_command ()
     a_casu.airflow_standby () # this is not done by casu.stop()
     a_casu.stop ()
     keep_going = False
     print ("W%dC Done!" % (casu_number))
-    zmq_sock_utils.send (socket, [WORKER_OK])
+    reply ([WORKER_OK])
 
 def signal_handler (signum, frame):
     if signum == signal.SIGINT:
@@ -193,8 +494,8 @@ def signal_handler (signum, frame):
 if __name__ == '__main__':
 
     # parse arguments
-    usage = 'Usage:\npython worker.py RTC_FILENAME CASU_NUMBER ZMQ_ADDRESS\n'
-    if len (sys.argv) != 4:
+    usage = 'Usage:\npython worker.py RTC_FILENAME CASU_NUMBER ZMQ_ADDRESS [TELEMETRY_ADDRESS]\n'
+    if len (sys.argv) not in [4, 5]:
         print ('Invalid number of options!\n' + usage)
         sys.exit (1)
     zmq_address = sys.argv [3]
@@ -217,8 +518,15 @@ if __name__ == '__main__':
 
     # open ZMQ server socket
     context = zmq.Context ()
-    socket = context.socket (zmq.REP)
+    socket = context.socket (zmq.ROUTER)
     socket.bind (zmq_address)
+    a_scheduler = scheduler.Scheduler (action_failed)
+
+    # publish the CASU temperature
+    if len (sys.argv) == 5:
+        pub_socket = context.socket (zmq.PUB)
+        pub_socket.bind (sys.argv [4])
+        a_scheduler.after (0, publish_telemetry)
 
     # prepare the CASU (turn the IR sensor off to make the background image)
     a_casu.set_temp (CASU_TEMPERATURE)
@@ -226,7 +534,7 @@ if __name__ == '__main__':
     a_casu.airflow_standby ()
     a_casu.ir_standby ()
     a_casu.speaker_standby ()
-    
+
     # install signal handler to exit worker gracefully
     signal.signal (signal.SIGINT, signal_handler)
     signal.signal (signal.SIGTERM, signal_handler)
@@ -235,26 +543,44 @@ if __name__ == '__main__':
 
     # main loop
     print ("W%dC Entering main loop." % (casu_number))
+    poller = zmq.Poller ()
+    poller.register (socket, zmq.POLLIN)
     while keep_going:
-        message = zmq_sock_utils.recv (socket)
-        print ("W%dC Received request: %s" % (casu_number, str (message)))
-        command = message [0]
-        if command == INITIALISE:
-            cmd_initialise ()
-        elif command == ACTIVE_CASU:
-            cmd_active_casu_HACK ()
-        elif command == PASSIVE_CASU:
-            cmd_passive_casu_HACK ()
-        elif command == CASU_STATUS:
-            print ("W%dC temperature readins: %s" % (casu_number, str (a_casu.get_temp (casu.ARRAY))))
-            zmq_sock_utils.send (socket, a_casu.get_temp (casu.TEMP_WAX))
-        elif command == VIBRATION_PATTERN_440_09_01:
-            cmd_vibration_pattern_440_09_01 ()
-        elif command == STANDBY_CASU:
-            cmd_standby_casu ()
-        elif command == SPREAD_BEES:
-            cmd_spread_bees ()
-        elif command == TERMINATE:
-            cmd_terminate ()
-        else:
-            print ("W%dC Unknown command:\n%s" % (casu_number, str (message)))
+        if len (poller.poll (a_scheduler.timeout ())) > 0:
+            try:
+                message, request_address = zmq_sock_utils.recv_routed (socket, accept_pickle)
+                if not isinstance (message, list) or len (message) == 0:
+                    raise zmq_sock_utils.InvalidMessage ("Request is not a non-empty list: %r" % (message, ), request_address)
+            except zmq_sock_utils.InvalidMessage as error:
+                print ("W%dC Invalid request: %s" % (casu_number, str (error)))
+                reply ([WORKER_INVALID_MESSAGE], error.address)
+                message = None
+            if message is not None:
+                print ("W%dC Received request: %s" % (casu_number, str (message)))
+                command = message [0]
+                if command == INITIALISE:
+                    cmd_initialise ()
+                elif command == ACTIVE_CASU:
+                    cmd_active_casu_HACK ()
+                elif command == PASSIVE_CASU:
+                    cmd_passive_casu_HACK ()
+                elif command == CASU_STATUS:
+                    print ("W%dC temperature readins: %s" % (casu_number, str (a_casu.get_temp (casu.ARRAY))))
+                    reply (a_casu.get_temp (casu.TEMP_WAX))
+                elif command == VIBRATION_PATTERN_440_09_01:
+                    cmd_vibration_pattern_440_09_01 ()
+                elif command == STANDBY_CASU:
+                    cmd_standby_casu ()
+                elif command == SPREAD_BEES:
+                    cmd_spread_bees ()
+                elif command == PROGRAM:
+                    cmd_program ()
+                elif command == HEARTBEAT:
+                    cmd_heartbeat ()
+                elif command == ABORT:
+                    cmd_abort ()
+                elif command == TERMINATE:
+                    cmd_terminate ()
+                else:
+                    print ("W%dC Unknown command:\n%s" % (casu_number, str (message)))
+        a_scheduler.run_due ()
@@ -1,3 +1,5 @@
+import dispatcher
+import telemetry
 import zmq_sock_utils
 import worker
 
@@ -8,13 +10,23 @@ import assisipy.collect_data
 import yaml
 import zmq
 import os
+import time
+
+CONTROL_TIMEOUT = 2
+"""
+Seconds to wait for the reply to a request sent through the control socket.
+"""
 
 class WorkerSettings:
     """
     Worker settings used by the master program to deploy the workers.
     These settings specify the CASU that the worker will control,
     the ZMQ address where the worker will listen for commands from the master,
+    the ZMQ address where the worker publishes the CASU temperature,
     and the parameters of the RTC file.
+    If the telemetry address is not given, the worker publishes on the port after the worker address.
+    Function load_worker_settings checks that the telemetry addresses do not collide with other addresses.
+    The codec is the encoding of the INITIALISE command: binary, the default, or pickle for workers deployed before the binary codec.
     """
     def __init__ (self, dictionary):
         self.casu_number = dictionary ['casu_number']
@@ -22,7 +34,22 @@ class WorkerSettings:
         self.pub_addr    = dictionary ['pub_addr']
         self.sub_addr    = dictionary ['sub_addr']
         self.msg_addr    = dictionary ['msg_addr']
+        if 'tel_addr' in dictionary:
+            self.tel_addr = dictionary ['tel_addr']
+        else:
+            (protocol, host, port) = self.wrk_addr.split (':')
+            self.tel_addr = '%s:%s:%d' % (protocol, host, int (port) + 1)
+        codec = dictionary.get ('codec', 'binary')
+        if codec == 'binary':
+            self.protocol = zmq_sock_utils.PROTOCOL_VERSION
+        elif codec == 'pickle':
+            self.protocol = zmq_sock_utils.PICKLE
+        else:
+            raise ValueError ("Invalid codec %s of worker responsible for casu #%d, expecting binary or pickle" % (codec, self.casu_number))
+        self.context = None
+        self.telemetry = None
         self.socket = None
+        self.control_socket = None
         self.in_use = False
 
     def key (self):
@@ -35,9 +62,10 @@ class WorkerSettings:
                 'controller' : os.path.dirname (os.path.abspath (__file__)) + '/worker.py'
               , 'extra'      : [
                     os.path.dirname (os.path.abspath (__file__)) + '/chromosome.py'
+                  , os.path.dirname (os.path.abspath (__file__)) + '/scheduler.py'
                   , os.path.dirname (os.path.abspath (__file__)) + '/zmq_sock_utils.py'
                   ]
-              , 'args'       : [str (self.casu_number), 'tcp://*:%s' % (self.wrk_addr.split (':') [2])]
+              , 'args'       : [str (self.casu_number), 'tcp://*:%s' % (self.wrk_addr.split (':') [2]), 'tcp://*:%s' % (self.tel_addr.split (':') [2])]
               , 'hostname'   : self.wrk_addr.split (':') [1][2:]
               , 'user'       : 'assisi'
               , 'prefix'     : 'pedro/evovibe'
@@ -53,16 +81,32 @@ class WorkerSettings:
               , 'msg_addr' : self.msg_addr
             })
 
-    def connect_to_worker (self, config):
+    def connect_to_worker (self, config, context = None):
         """
         Connect to the worker and return a tuple with the CASU number and this instance.
         """
-        context = zmq.Context ()
+        if context is None:
+            context = zmq.Context ()
+        self.open_socket (context)
+        print ("Initializing worker responsible for casu #%d..." % (self.casu_number))
+        answer = zmq_sock_utils.send_recv (self.socket, self.initialise_command (config))
+        print ("Worker responded with: %s" % (str (answer)))
+        self.negotiate_protocol (answer)
+        return (self.casu_number, self)
+
+    def open_socket (self, context):
+        """
+        Create a socket in the given context and connect it to the worker.
+        The socket sends with the codec of the worker settings until the INITIALISE command negotiates the encoding.
+        """
+        self.context = context
         print ("Connecting to worker at %s responsible for casu #%d..." % (self.wrk_addr, self.casu_number))
         self.socket = context.socket (zmq.REQ)
         self.socket.connect (self.wrk_addr)
-        print ("Initializing worker responsible for casu #%d..." % (self.casu_number))
-        answer = zmq_sock_utils.send_recv (self.socket, [
+        zmq_sock_utils.set_protocol (self.socket, self.protocol)
+
+    def initialise_command (self, config):
+        return [
             worker.INITIALISE,
             config.vibration_run_time,
             config.no_stimuli_run_time,
@@ -70,9 +114,78 @@ class WorkerSettings:
             config.spreading_waiting_time,
             config.frame_per_second,
             config.sound_hardware,
-            config.chromosome_type])
-        print ("Worker responded with: %s" % (str (answer)))
-        return (self.casu_number, self)
+            config.chromosome_type]
+
+    def negotiate_protocol (self, answer):
+        """
+        Choose the encoding of the messages sent to the worker given its answer to the INITIALISE command.
+        Workers that implement the binary codec send its version, older workers only understand pickle.
+        """
+        if len (answer) > 1:
+            version = min (answer [1], zmq_sock_utils.PROTOCOL_VERSION)
+            zmq_sock_utils.set_protocol (self.socket, version)
+            print ("Using binary codec version %d with worker responsible for casu #%d" % (version, self.casu_number))
+        else:
+            zmq_sock_utils.set_protocol (self.socket, zmq_sock_utils.PICKLE)
+            print ("Using pickle with worker responsible for casu #%d" % (self.casu_number))
+
+    def reconnect (self):
+        """
+        Replace the socket connected to the worker with a new one that uses the same message encoding.
+        A REQ socket whose request was not answered cannot send another request.
+        """
+        version = zmq_sock_utils.get_protocol (self.socket)
+        self.socket.setsockopt (zmq.LINGER, 0)
+        self.socket.close ()
+        self.socket = self.context.socket (zmq.REQ)
+        self.socket.connect (self.wrk_addr)
+        zmq_sock_utils.set_protocol (self.socket, version)
+
+    def control (self, message, timeout = CONTROL_TIMEOUT):
+        """
+        Send a message to the worker through the control socket and return the reply, or None if the worker does not reply within the timeout.
+        The control socket is used for heartbeat and abort requests while a command sent through the socket of the worker is running.
+        """
+        if self.control_socket is None:
+            self.control_socket = self.context.socket (zmq.REQ)
+            self.control_socket.connect (self.wrk_addr)
+            zmq_sock_utils.set_protocol (self.control_socket, zmq_sock_utils.get_protocol (self.socket))
+        zmq_sock_utils.send (self.control_socket, message)
+        if self.control_socket.poll (timeout * 1000) == 0:
+            self.control_socket.setsockopt (zmq.LINGER, 0)
+            self.control_socket.close ()
+            self.control_socket = None
+            return None
+        return zmq_sock_utils.recv (self.control_socket)
+
+    def heartbeat (self):
+        """
+        Return a tuple with the command the worker is running and the seconds until it finishes, or None if the worker does not reply.
+        The command is None if the worker is idle.
+        """
+        answer = self.control ([worker.HEARTBEAT])
+        if answer is None:
+            return None
+        return (answer [1], answer [2])
+
+    def abort (self):
+        """
+        Abort the command the worker is running and put its CASU in standby.
+        Returns the aborted command, or None if the worker was idle or did not reply.
+        """
+        answer = self.control ([worker.ABORT])
+        if answer is None:
+            return None
+        return answer [1]
+
+    def temperature (self):
+        """
+        Return the latest CASU temperature published by the worker, or None if there is no recent one.
+        """
+        if self.telemetry is None:
+            return None
+        return self.telemetry.temperature (self.casu_number)
+
     def terminate_session (self):
         """
         Terminate the session with the worker, which causes the worker process to finish.
@@ -82,8 +195,68 @@ class WorkerSettings:
         print ("Worker responded with: %s" % (str (answer)))
 
     def __str__ (self):
-        return 'casu_number : %d , wrk_addr : %s , pub_addr : %s , sub_addr : %s , msg_addr : %s , socket : %s , in_use : %s' % (
-            self.casu_number, self.wrk_addr, self.pub_addr, self.sub_addr, self.msg_addr, str (self.socket), str (self.in_use))
+        return 'casu_number : %d , wrk_addr : %s , pub_addr : %s , sub_addr : %s , msg_addr : %s , tel_addr : %s , socket : %s , in_use : %s' % (
+            self.casu_number, self.wrk_addr, self.pub_addr, self.sub_addr, self.msg_addr, self.tel_addr, str (self.socket), str (self.in_use))
+
+class ConnectionManager:
+    """
+    Connects the master to the workers.  The sockets of all workers share
+    the ZMQ context of the manager.  The workers are connected and
+    initialised in parallel, so startup takes as long as the slowest worker
+    handshake instead of the sum of all of them.  The manager also
+    subscribes to the CASU temperatures published by the workers.
+    """
+    def __init__ (self):
+        self.context = zmq.Context ()
+        self.handshake_latency = {}
+        self.telemetry = None
+
+    def connect_to_workers (self, worker_settings, config):
+        """
+        Connect to the given workers, initialise them and return a dictionary that maps CASU numbers to worker settings.
+        Raises dispatcher.WorkerTimeout if a worker does not reply to the initialise command.
+        """
+        start = time.time ()
+        for ws in worker_settings:
+            ws.open_socket (self.context)
+        if config.telemetry_staleness > 0:
+            self.telemetry = telemetry.TelemetryCache (self.context, worker_settings, config.telemetry_staleness)
+            for ws in worker_settings:
+                ws.telemetry = self.telemetry
+        print ("Initializing %d workers..." % (len (worker_settings)))
+        a_dispatcher = dispatcher.Dispatcher ()
+        replies = [
+            a_dispatcher.request (ws, ws.initialise_command (config), callback = self.handshake_done)
+            for ws in worker_settings]
+        a_dispatcher.wait ()
+        self.report (worker_settings, time.time () - start)
+        for reply in replies:
+            reply.result ()
+        return dict ([(ws.casu_number, ws) for ws in worker_settings])
+
+    def handshake_done (self, reply):
+        """
+        Callback that records the handshake latency of a worker and negotiates the encoding of its messages.
+        """
+        ws = reply.worker_settings
+        if reply.error is None:
+            self.handshake_latency [ws.casu_number] = time.time () - reply.time_sent
+            print ("Worker responsible for casu #%d responded with: %s" % (ws.casu_number, str (reply.value)))
+            ws.negotiate_protocol (reply.value)
+
+    def report (self, worker_settings, elapsed_time):
+        """
+        Print the handshake latency of each worker and the time taken to initialise all of them.
+        """
+        print ("Worker handshake latency:")
+        for ws in sorted (worker_settings, key = lambda ws: ws.casu_number):
+            if ws.casu_number in self.handshake_latency:
+                print ("  casu #%03d  %8.1f ms" % (ws.casu_number, self.handshake_latency [ws.casu_number] * 1000))
+            else:
+                print ("  casu #%03d  no reply" % (ws.casu_number))
+        if len (self.handshake_latency) > 0:
+            print ("Initialised %d workers in %.1f ms, slowest handshake %.1f ms, sum of handshakes %.1f ms" % (
+                len (self.handshake_latency), elapsed_time * 1000, max (self.handshake_latency.values ()) * 1000, sum (self.handshake_latency.values ()) * 1000))
 
 def load_worker_settings (filename):
     """
@@ -95,9 +268,34 @@ def load_worker_settings (filename):
     worker_settings = [
         WorkerSettings (dictionary ['worker-%02d' % (index)])
         for index in xrange (1, dictionary ['number_workers'] + 1)]
+    check_telemetry_addresses (worker_settings)
     print ("Loaded worker settings")
     return worker_settings
 
+def address_endpoint (address):
+    """
+    Return a tuple with the host and port of a ZMQ TCP address.
+    """
+    (_, host, port) = address.split (':')
+    return (host.lstrip ('/'), int (port))
+
+def check_telemetry_addresses (worker_settings):
+    """
+    Check that the telemetry address of each worker is different from the other addresses of all workers.
+    Raises ValueError otherwise, as the worker could not bind its telemetry socket, or would publish to a CASU or another worker.
+    """
+    owners = {}
+    for ws in worker_settings:
+        for name in ['wrk_addr', 'pub_addr', 'sub_addr', 'msg_addr', 'tel_addr']:
+            endpoint = address_endpoint (getattr (ws, name))
+            owners.setdefault (endpoint, []).append ((ws.casu_number, name))
+    for ws in worker_settings:
+        users = owners [address_endpoint (ws.tel_addr)]
+        if len (users) > 1:
+            raise ValueError ("Telemetry address %s of worker responsible for casu #%d is also used by %s, set tel_addr in the worker settings file" % (
+                ws.tel_addr, ws.casu_number,
+                ', '.join (['%s of casu #%d' % (name, casu_number) for (casu_number, name) in users if (casu_number, name) != (ws.casu_number, 'tel_addr')])))
+
 def deploy_workers (filename, run_number):
     print ('\n\n* ** Worker Apps Launch')
     # load worker settings
@@ -126,6 +324,17 @@ def deploy_workers (filename, run_number):
     ar.run ()
     print ("Workers have finished")
 
+def terminate_sessions (worker_settings):
+    """
+    Terminate the sessions with the given workers, which causes the worker processes to finish.
+    The terminate command is sent to all workers and their replies are handled as they arrive.
+    """
+    a_dispatcher = dispatcher.Dispatcher ()
+    for ws in worker_settings:
+        print ("Sending terminate command to worker at %s responsible for casu #%d..." % (ws.wrk_addr, ws.casu_number))
+        a_dispatcher.request (ws, [worker.TERMINATE], callback = dispatcher.print_reply)
+    a_dispatcher.wait ()
+
 def collect_data_from_workers (worker_settings, destination):
     dc = assisipy.collect_data.DataCollector ('tmp/workers.assisi', logpath = destination)
     dc.collect ()
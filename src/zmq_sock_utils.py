@@ -4,19 +4,258 @@ Utility functions to send and receive data through ZMQ sockets.
 From the ZMQ Guide:
 
 ZeroMQ doesn't know anything about the data you send except its size in bytes. That means you are responsible for formatting it safely so that applications can read it back. Doing this for objects and complex data types is a job for specialized libraries like Protocol Buffers. But even for strings, you need to take care.
+
+Messages are encoded either with pickle or with a compact binary codec.
+The messages exchanged by the master and the workers are lists of
+numbers, strings and lists of numbers, or a single number.  The binary
+codec encodes these values with a one byte tag followed by the value in
+network byte order.  A binary message starts with a magic byte and the
+version of the codec, so that function recv tells the two encodings
+apart.  The magic byte is not a pickle opcode.
+
+The encoding used to send through a socket is negotiated in the
+INITIALISE command.  The master sends it with the binary codec, and
+workers reply with their codec version.  Workers deployed before the
+binary codec only understand pickle, and the worker settings file must
+say so, in which case the master sends INITIALISE with pickle and these
+workers reply without a version.  A worker that received a binary
+INITIALISE rejects pickle messages, as unpickling a message can run
+arbitrary code.  A socket replies with the encoding of the last message
+it received.  Workers receive requests through a ROUTER socket, which may
+have several peers, so their replies use the encoding of the request they
+answer.
+
+Malformed binary messages and messages in a rejected encoding raise
+ValueError.  Function recv_routed raises InvalidMessage for any request it
+cannot decode.
 """
 
 import pickle
+import struct
+
+PICKLE = 0
+"""
+Codec version that stands for the pickle encoding.
+"""
+
+PROTOCOL_VERSION = 1
+"""
+Version of the binary codec implemented by this module.
+"""
+
+MAGIC = '\xeb'
+
+TAG_NONE   = 'N'
+TAG_TRUE   = 'T'
+TAG_FALSE  = 'F'
+TAG_INT8   = 'b'
+TAG_INT16  = 'h'
+TAG_INT32  = 'i'
+TAG_INT    = 'q'
+TAG_FLOAT  = 'd'
+TAG_STRING = 's'
+TAG_LIST   = 'l'
+
+INT8_STRUCT   = struct.Struct ('!b')
+INT16_STRUCT  = struct.Struct ('!h')
+INT32_STRUCT  = struct.Struct ('!i')
+INT_STRUCT    = struct.Struct ('!q')
+FLOAT_STRUCT  = struct.Struct ('!d')
+LENGTH_STRUCT = struct.Struct ('!I')
+
+INT_MIN = -2 ** 63
+INT_MAX = 2 ** 63 - 1
+"""
+Range of the integers that the binary codec encodes.
+"""
+
+class InvalidMessage (ValueError):
+    """
+    Raised by function recv_routed when a request cannot be decoded.
+    The return address of the request is kept so that the error can be reported to the sender.
+    """
+    def __init__ (self, reason, address):
+        ValueError.__init__ (self, reason)
+        self.address = address
+
+# Encoding used to send through each socket
+_socket_protocols = {}
+
+def set_protocol (socket, version):
+    """
+    Set the encoding used to send data through the socket: PICKLE or a binary codec version.
+    """
+    _socket_protocols [socket] = version
+
+def get_protocol (socket):
+    return _socket_protocols.get (socket, PICKLE)
+
+def encode (data, version = PROTOCOL_VERSION):
+    """
+    Return the binary encoding of data, which is None, a boolean, a number, a string, or a list or tuple of these.
+    """
+    if version < 1 or version > PROTOCOL_VERSION:
+        raise ValueError ("Unsupported codec version %d" % (version))
+    parts = [MAGIC, chr (version)]
+    _encode_value (data, parts)
+    return ''.join (parts)
+
+def _encode_value (value, parts):
+    if value is None:
+        parts.append (TAG_NONE)
+    elif value is True:
+        parts.append (TAG_TRUE)
+    elif value is False:
+        parts.append (TAG_FALSE)
+    elif isinstance (value, (int, long)):
+        # integers take the smallest size that holds them
+        if -128 <= value <= 127:
+            parts.append (TAG_INT8)
+            parts.append (INT8_STRUCT.pack (value))
+        elif -32768 <= value <= 32767:
+            parts.append (TAG_INT16)
+            parts.append (INT16_STRUCT.pack (value))
+        elif -2147483648 <= value <= 2147483647:
+            parts.append (TAG_INT32)
+            parts.append (INT32_STRUCT.pack (value))
+        elif INT_MIN <= value <= INT_MAX:
+            parts.append (TAG_INT)
+            parts.append (INT_STRUCT.pack (value))
+        else:
+            raise ValueError ("Integer %d does not fit in 64 bits" % (value))
+    elif isinstance (value, float):
+        parts.append (TAG_FLOAT)
+        parts.append (FLOAT_STRUCT.pack (value))
+    elif isinstance (value, basestring):
+        if isinstance (value, unicode):
+            value = value.encode ('utf-8')
+        parts.append (TAG_STRING)
+        parts.append (LENGTH_STRUCT.pack (len (value)))
+        parts.append (value)
+    elif isinstance (value, (list, tuple)):
+        parts.append (TAG_LIST)
+        parts.append (LENGTH_STRUCT.pack (len (value)))
+        for item in value:
+            _encode_value (item, parts)
+    else:
+        raise TypeError ("Cannot encode value of type %s" % (type (value).__name__))
+
+def decode (data_bytes):
+    """
+    Return the data in a binary encoded message.
+    Lists and tuples are decoded as lists.
+    Raises ValueError if the message is truncated or malformed.
+    """
+    if len (data_bytes) < 2 or data_bytes [0] != MAGIC:
+        raise ValueError ("Not a binary encoded message")
+    version = ord (data_bytes [1])
+    if version < 1 or version > PROTOCOL_VERSION:
+        raise ValueError ("Unsupported codec version %d" % (version))
+    try:
+        value, offset = _decode_value (data_bytes, 2)
+    except (struct.error, IndexError):
+        raise ValueError ("Truncated binary encoded message")
+    if offset != len (data_bytes):
+        raise ValueError ("Trailing bytes in binary encoded message")
+    return value
+
+def _decode_value (data_bytes, offset):
+    tag = data_bytes [offset]
+    offset += 1
+    if tag == TAG_INT8:
+        return INT8_STRUCT.unpack_from (data_bytes, offset) [0], offset + INT8_STRUCT.size
+    elif tag == TAG_INT16:
+        return INT16_STRUCT.unpack_from (data_bytes, offset) [0], offset + INT16_STRUCT.size
+    elif tag == TAG_INT32:
+        return INT32_STRUCT.unpack_from (data_bytes, offset) [0], offset + INT32_STRUCT.size
+    elif tag == TAG_INT:
+        return INT_STRUCT.unpack_from (data_bytes, offset) [0], offset + INT_STRUCT.size
+    elif tag == TAG_FLOAT:
+        return FLOAT_STRUCT.unpack_from (data_bytes, offset) [0], offset + FLOAT_STRUCT.size
+    elif tag == TAG_STRING:
+        length = LENGTH_STRUCT.unpack_from (data_bytes, offset) [0]
+        offset += LENGTH_STRUCT.size
+        if offset + length > len (data_bytes):
+            raise IndexError ("string past the end of the message")
+        return data_bytes [offset:offset + length], offset + length
+    elif tag == TAG_LIST:
+        length = LENGTH_STRUCT.unpack_from (data_bytes, offset) [0]
+        offset += LENGTH_STRUCT.size
+        result = []
+        for _ in xrange (length):
+            item, offset = _decode_value (data_bytes, offset)
+            result.append (item)
+        return result, offset
+    elif tag == TAG_NONE:
+        return None, offset
+    elif tag == TAG_TRUE:
+        return True, offset
+    elif tag == TAG_FALSE:
+        return False, offset
+    else:
+        raise ValueError ("Invalid tag %r at offset %d" % (tag, offset - 1))
+
+def dumps (data, version = PICKLE):
+    """
+    Return the encoding of data with pickle or with the given binary codec version.
+    """
+    if version == PICKLE:
+        return pickle.dumps (data, -1)
+    return encode (data, version)
+
+def encoding (data_bytes):
+    """
+    Return the encoding of a message: PICKLE or the binary codec version in its header.
+    """
+    if data_bytes [:1] == MAGIC and len (data_bytes) > 1:
+        return ord (data_bytes [1])
+    return PICKLE
+
+def loads (data_bytes, accept_pickle = True):
+    """
+    Return a tuple with the data in a message and the encoding of the message.
+    Raises ValueError if the message is not binary encoded and pickle is not accepted.
+    """
+    if data_bytes [:1] == MAGIC:
+        return decode (data_bytes), ord (data_bytes [1])
+    if not accept_pickle:
+        raise ValueError ("Pickle encoded message rejected")
+    return pickle.loads (data_bytes), PICKLE
 
 def send (socket, data):
-    data_bytes = pickle.dumps (data, -1)
+    data_bytes = dumps (data, get_protocol (socket))
     socket.send (data_bytes)
 
 def recv (socket):
     data_bytes = socket.recv ()
-    data = pickle.loads (data_bytes)
+    data, version = loads (data_bytes)
+    set_protocol (socket, version)
     return data
 
+def recv_routed (socket, accept_pickle = True):
+    """
+    Receive a request through a ROUTER socket.
+    Returns a tuple with the data and the return address of the request, which holds its routing frames and its encoding.
+    Raises InvalidMessage if the request cannot be decoded or is pickle encoded and pickle is not accepted.
+    """
+    frames = socket.recv_multipart ()
+    version = encoding (frames [-1])
+    if version > PROTOCOL_VERSION:
+        version = PROTOCOL_VERSION
+    try:
+        data, _ = loads (frames [-1], accept_pickle)
+    except Exception as error:
+        # unpickling garbage raises many exception types besides ValueError
+        raise InvalidMessage ("%s: %s" % (type (error).__name__, str (error)), (frames [:-1], version))
+    return data, (frames [:-1], version)
+
+def send_routed (socket, address, data):
+    """
+    Send the reply to the request with the given return address through a ROUTER socket.
+    """
+    frames, version = address
+    socket.send_multipart (frames + [dumps (data, version)])
+
 def send_recv (socket, data):
     send (socket, data)
     return recv (socket)
@@ -0,0 +1,71 @@
+"""
+Benchmark the image comparison backends of the arenas.
+
+The images of the last iteration video split in folder tmp are compared
+with the convert program and with the in-process NumPy backend.  The
+NumPy backend uses the compiled masks saved in the arena folder.  The
+script reports the time taken by each backend and the largest
+difference between the pixel counts they produce.
+
+Usage:
+PYTHONPATH=src python util/benchmark-image-comparison.py EPISODE_PATH ARENA_PATH NUMBER_ROIS NUMBER_FRAMES [SAME_COLOUR_THRESHOLD [DELTA_IMAGE]]
+"""
+
+import arena
+import image_comparison
+
+import sys
+import time
+
+class BenchmarkArena (arena.AbstractArena):
+    """
+    Arena whose properties are given by the command line arguments instead of being asked to the user.
+    """
+    def __init__ (self, episode_path, img_path, number_rois, same_colour_threshold, delta_image, comparison_backend):
+        self.workers = [None] * number_rois
+        self.episode_path = episode_path
+        self.background_filename = image_comparison.background_filename (episode_path)
+        self.background_image = None
+        self.img_path = img_path
+        self.same_colour_threshold = '%d%%' % (same_colour_threshold)
+        self.same_colour_threshold_value = same_colour_threshold
+        self.delta_image = delta_image
+        self.comparison_backend = comparison_backend
+        self.pixel_format = 'rgb24'
+        self.analysis_scale = 1
+        self.compiled_masks = image_comparison.load_compiled_masks (img_path + 'masks.npz')
+        self.compiled_masks_geometry = None
+        self.frame_cache = None
+        self.background_regions = None
+
+    def compile_masks (self):
+        pass
+
+def run (an_arena, number_frames):
+    start = time.time ()
+    an_arena.reset_frame_cache ()
+    rows = [an_arena.compare_images (i) for i in xrange (1, number_frames + 1)]
+    return (time.time () - start, rows)
+
+if __name__ == '__main__':
+    if len (sys.argv) < 5:
+        print __doc__
+        sys.exit (1)
+    episode_path = sys.argv [1]
+    img_path = sys.argv [2]
+    number_rois = int (sys.argv [3])
+    number_frames = int (sys.argv [4])
+    same_colour_threshold = int (sys.argv [5]) if len (sys.argv) > 5 else 25
+    delta_image = int (sys.argv [6]) if len (sys.argv) > 6 else 10
+    results = {}
+    for backend in ['convert', 'numpy']:
+        an_arena = BenchmarkArena (episode_path, img_path, number_rois, same_colour_threshold, delta_image, backend)
+        results [backend] = run (an_arena, number_frames)
+        print ("%-8s %8.2fs %8.2fms per frame" % (backend, results [backend][0], 1000.0 * results [backend][0] / number_frames))
+    differences = [
+        abs (vc - vn)
+        for rc, rn in zip (results ['convert'][1], results ['numpy'][1])
+        for vc, vn in zip (rc, rn)]
+    print ("Speedup: %.1f" % (results ['convert'][0] / results ['numpy'][0]))
+    print ("Maximum pixel count difference: %d" % (max (differences)))
+    print ("Mean pixel count difference: %f" % (float (sum (differences)) / len (differences)))
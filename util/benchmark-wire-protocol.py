@@ -0,0 +1,98 @@
+"""
+Benchmark the encodings of the messages exchanged by the master and the workers.
+
+Each command and reply of the master-worker protocol is encoded and
+decoded with pickle and with the binary codec of module zmq_sock_utils.
+The script reports the encoded size and the encode and decode time per
+message.  It then measures the round trip latency of each command through
+a pair of ZMQ REQ and REP sockets, with the REP socket in a thread that
+replies with the reply of the command, as a worker does.
+
+Usage:
+PYTHONPATH=src python util/benchmark-wire-protocol.py [NUMBER_REPETITIONS [ADDRESS]]
+"""
+
+import worker
+import zmq_sock_utils
+
+import sys
+import threading
+import time
+import zmq
+
+MESSAGES = [
+    ('INITIALISE',   [worker.INITIALISE, 30, 10, 0, 30, 4, 'Zagreb', 'SinglePulseGenesPulse'], [worker.WORKER_OK, zmq_sock_utils.PROTOCOL_VERSION]),
+    ('ACTIVE_CASU',  [worker.ACTIVE_CASU, [440, 500, 500, 50]],                                  [worker.WORKER_OK, 1490000000.125]),
+    ('PASSIVE_CASU', [worker.PASSIVE_CASU],                                                      [worker.WORKER_OK]),
+    ('CASU_STATUS',  [worker.CASU_STATUS],                                                       28.0625),
+    ('SPREAD_BEES',  [worker.SPREAD_BEES, 30],                                                   [worker.WORKER_OK]),
+    ('STANDBY_CASU', [worker.STANDBY_CASU],                                                      [worker.WORKER_OK]),
+    ('TERMINATE',    [worker.TERMINATE],                                                         [worker.WORKER_OK]),
+    ]
+
+ENCODINGS = [('pickle', zmq_sock_utils.PICKLE), ('binary', zmq_sock_utils.PROTOCOL_VERSION)]
+
+def time_codec (data, version, number_repetitions):
+    start = time.time ()
+    for _ in xrange (number_repetitions):
+        data_bytes = zmq_sock_utils.dumps (data, version)
+    encode_time = time.time () - start
+    start = time.time ()
+    for _ in xrange (number_repetitions):
+        zmq_sock_utils.loads (data_bytes)
+    decode_time = time.time () - start
+    if zmq_sock_utils.loads (data_bytes) [0] != data:
+        print ("  Round trip mismatch: %s" % (str (data)))
+    return len (data_bytes), encode_time / number_repetitions, decode_time / number_repetitions
+
+def reply_server (context, address, replies, number_messages):
+    """
+    Reply to the given number of messages with the reply of their command.
+    """
+    socket = context.socket (zmq.REP)
+    socket.bind (address)
+    for _ in xrange (number_messages):
+        message = zmq_sock_utils.recv (socket)
+        zmq_sock_utils.send (socket, replies [message [0]])
+    socket.close ()
+
+def time_round_trips (address, number_repetitions):
+    context = zmq.Context ()
+    replies = dict ([(command [0], reply) for _, command, reply in MESSAGES])
+    number_messages = len (MESSAGES) * len (ENCODINGS) * number_repetitions
+    server = threading.Thread (target = reply_server, args = (context, address, replies, number_messages))
+    server.start ()
+    socket = context.socket (zmq.REQ)
+    socket.connect (address)
+    result = {}
+    for name, command, _ in MESSAGES:
+        for encoding, version in ENCODINGS:
+            zmq_sock_utils.set_protocol (socket, version)
+            start = time.time ()
+            for _ in xrange (number_repetitions):
+                zmq_sock_utils.send_recv (socket, command)
+            result [(name, encoding)] = (time.time () - start) / number_repetitions
+    server.join ()
+    socket.close ()
+    context.term ()
+    return result
+
+if __name__ == '__main__':
+    if len (sys.argv) > 3 or (len (sys.argv) > 1 and not sys.argv [1].isdigit ()):
+        print __doc__
+        sys.exit (1)
+    number_repetitions = int (sys.argv [1]) if len (sys.argv) > 1 else 10000
+    address = sys.argv [2] if len (sys.argv) > 2 else 'tcp://127.0.0.1:15555'
+    print ("Encode and decode, %d repetitions" % (number_repetitions))
+    print ("  %-18s %-8s %6s %10s %10s" % ('message', 'encoding', 'bytes', 'encode us', 'decode us'))
+    for name, command, reply in MESSAGES:
+        for message_name, data in [(name, command), (name + ' reply', reply)]:
+            for encoding, version in ENCODINGS:
+                size, encode_time, decode_time = time_codec (data, version, number_repetitions)
+                print ("  %-18s %-8s %6d %10.2f %10.2f" % (message_name, encoding, size, encode_time * 1e6, decode_time * 1e6))
+    number_round_trips = max (1, number_repetitions // 10)
+    print ("Round trip latency through %s, %d round trips" % (address, number_round_trips))
+    latency = time_round_trips (address, number_round_trips)
+    print ("  %-14s %10s %10s" % ('message', 'pickle us', 'binary us'))
+    for name, _, _ in MESSAGES:
+        print ("  %-14s %10.1f %10.1f" % (name, latency [(name, 'pickle')] * 1e6, latency [(name, 'binary')] * 1e6))
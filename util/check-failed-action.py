@@ -0,0 +1,98 @@
+"""
+Check that an action of a command that fails does not stop the worker.
+
+The script runs a program in the worker with a CASU that raises an
+exception when the airflow is turned on.  It checks that the scheduler
+keeps running the actions that are not part of the command, that the
+remaining actions of the command are cancelled, that the CASU is put in
+standby, and that the command request is answered with WORKER_ERROR.
+
+Usage:
+PYTHONPATH=src python util/check-failed-action.py
+"""
+
+import scheduler
+import worker
+
+import sys
+
+PROGRAM = [
+    [0.5, 'led', 1, 0, 0],
+    [0.75, 'led_standby'],
+    [1.0, 'airflow', 1],
+    [2.0, 'airflow_standby'],
+    [2.5, 'led', 1, 0, 0],
+    ]
+
+STANDBY = ['diagnostic_led_standby', 'airflow_standby', 'speaker_standby']
+
+TICK = 0.25
+
+class Clock:
+    """
+    Clock that only moves when it is told to.
+    """
+    def __init__ (self, now):
+        self.now = now
+
+    def __call__ (self):
+        return self.now
+
+class FailingCasu:
+    """
+    CASU that records the names of the methods called and fails to turn the airflow on.
+    """
+    def __init__ (self):
+        self.calls = []
+
+    def set_airflow_intensity (self, intensity):
+        self.calls.append ('set_airflow_intensity')
+        raise IOError ("airflow actuator not responding")
+
+    def __getattr__ (self, name):
+        def method (*arguments):
+            self.calls.append (name)
+        return method
+
+def check ():
+    clock = Clock (1000.0)
+    scheduler.monotonic = clock
+    replies = []
+    other_actions = []
+    worker.casu_number = 0
+    worker.a_casu = FailingCasu ()
+    worker.a_scheduler = scheduler.Scheduler (worker.action_failed)
+    worker.running_command = None
+    worker.request_address = None
+    worker.reply = lambda data, address = None : replies.append (data)
+    worker.message = [worker.PROGRAM, PROGRAM]
+    worker.cmd_program ()
+    for when in [0.9, 1.1, 3.0]:
+        worker.a_scheduler.at (1000.0 + when, lambda when = when : other_actions.append (when))
+    while len (worker.a_scheduler.queue) > 0:
+        clock.now += TICK
+        worker.a_scheduler.run_due ()
+    ok = True
+    expected_calls = ['set_diagnostic_led_rgb', 'diagnostic_led_standby', 'set_airflow_intensity'] + STANDBY
+    if worker.a_casu.calls != expected_calls:
+        print ("FAILED: the CASU calls were %s instead of %s" % (str (worker.a_casu.calls), str (expected_calls)))
+        ok = False
+    if other_actions != [0.9, 1.1, 3.0]:
+        print ("FAILED: the other actions that ran were %s" % (str (other_actions)))
+        ok = False
+    if len (replies) != 1 or replies [0][0] != worker.WORKER_ERROR:
+        print ("FAILED: the replies were %s" % (str (replies)))
+        ok = False
+    if worker.running_command is not None:
+        print ("FAILED: the command is still running")
+        ok = False
+    return ok
+
+if __name__ == '__main__':
+    if len (sys.argv) != 1:
+        print __doc__
+        sys.exit (1)
+    if check ():
+        print ("OK: the failed command was ended with WORKER_ERROR and the CASU put in standby")
+        sys.exit (0)
+    sys.exit (1)
@@ -0,0 +1,78 @@
+"""
+Check that the vectorized image processing functions give the same
+values as the scalar ones on recorded evaluations.
+
+Each file is the pixel counts of an evaluation, either a NumPy file or
+a CSV file in the format written by the evaluator.  Every image
+processing function is computed with each CASU as the active one, over
+the whole evaluation and over random segments, with the scalar function
+applied row by row and with the vectorized function.  The script prints
+the mismatches and the time taken by both versions.
+
+Usage:
+PYTHONPATH=src python util/check-image-processing-functions.py BACKGROUND_THRESHOLD PREVIOUS_FRAME_THRESHOLD FILE [FILE ...]
+"""
+
+import evaluator
+
+import numpy
+import random
+import sys
+import time
+
+class Thresholds:
+    def __init__ (self, pixel_count_background_threshold, pixel_count_previous_frame_threshold):
+        self.pixel_count_background_threshold = pixel_count_background_threshold
+        self.pixel_count_previous_frame_threshold = pixel_count_previous_frame_threshold
+
+class PickedArena:
+    def __init__ (self, selected_worker_index):
+        self.selected_worker_index = selected_worker_index
+
+def random_segments (number_frames, number_segments):
+    result = [numpy.ones (number_frames, dtype = numpy.bool_)]
+    for _ in xrange (number_segments):
+        first = random.randint (0, number_frames - 1)
+        last = random.randint (first, number_frames)
+        segment = numpy.zeros (number_frames, dtype = numpy.bool_)
+        segment [first:last] = True
+        result.append (segment)
+    return result
+
+def check_file (filename, config):
+    results = evaluator.read_image_processing (filename)
+    mismatches = 0
+    scalar_time = 0
+    vectorized_time = 0
+    for selected_worker_index in [0, 1]:
+        picked_arena = PickedArena (selected_worker_index)
+        for segment in random_segments (len (results), 10):
+            for function, vectorized_function in evaluator.VECTORIZED_IPF.items ():
+                start = time.time ()
+                scalar = sum (function (config, picked_arena, row) for row in results [segment])
+                scalar_time += time.time () - start
+                start = time.time ()
+                vectorized = vectorized_function (config, picked_arena, results, segment)
+                vectorized_time += time.time () - start
+                if scalar != vectorized:
+                    mismatches += 1
+                    print ("%s: %s with active CASU %d: scalar %s vectorized %s" % (
+                        filename, function.__name__, selected_worker_index, str (scalar), str (vectorized)))
+    return mismatches, scalar_time, vectorized_time
+
+if __name__ == '__main__':
+    if len (sys.argv) < 4:
+        print __doc__
+        sys.exit (1)
+    config = Thresholds (int (sys.argv [1]), int (sys.argv [2]))
+    total_mismatches = 0
+    total_scalar_time = 0
+    total_vectorized_time = 0
+    for filename in sys.argv [3:]:
+        mismatches, scalar_time, vectorized_time = check_file (filename, config)
+        total_mismatches += mismatches
+        total_scalar_time += scalar_time
+        total_vectorized_time += vectorized_time
+    print ("Files: %d  Mismatches: %d" % (len (sys.argv) - 3, total_mismatches))
+    print ("Scalar time: %.3fs  Vectorized time: %.3fs" % (total_scalar_time, total_vectorized_time))
+    sys.exit (1 if total_mismatches > 0 else 0)
@@ -0,0 +1,97 @@
+"""
+Check that live analysis does not block the recording process when the
+comparison of the frames fails.
+
+A child process plays the role of the recording process: it writes raw
+frames to its standard output, many more than fit in the pipe buffer.
+The live analysis thread compares the frames with an arena that raises an
+exception part way through the stream.  The script checks that the child
+process finishes, which requires the analysis thread to keep reading the
+stream, and that method result raises the exception of the comparison.
+
+Usage:
+PYTHONPATH=src python util/check-live-analysis.py [NUMBER_FRAMES [FAILING_FRAME]]
+"""
+
+import evaluator
+import timeline
+
+import subprocess
+import sys
+import time
+
+WIDTH = 100
+HEIGHT = 100
+TIMEOUT = 30
+
+class Config:
+    def __init__ (self):
+        self.image_width = WIDTH
+        self.image_height = HEIGHT
+        self.analysis_scale = 1
+        self.pixel_format = 'gray'
+        self.frame_per_second = 10
+        self.spreading_waiting_time = 1
+        self.no_stimuli_run_time = 1
+        self.vibration_run_time = 1
+        self.has_blip = True
+        self.worker_program = False
+
+class ComparisonError (Exception):
+    pass
+
+class FailingArena:
+    """
+    Arena whose comparison of the frames raises an exception at the given frame.
+    """
+    def __init__ (self, failing_frame):
+        self.workers = [None, None]
+        self.failing_frame = failing_frame
+
+    def reset_frame_cache (self):
+        pass
+
+    def compare_video_frames (self, frames, selection):
+        for ith_image, _ in frames:
+            if ith_image == self.failing_frame:
+                raise ComparisonError ("comparison failed at frame %d" % (ith_image))
+            yield (ith_image, [0] * (2 * len (self.workers)))
+
+class Selection:
+    def __init__ (self, number_frames):
+        self.number_frames = number_frames
+
+def recording_process (number_frames):
+    """
+    Start a process that writes the given number of gray frames to its standard output.
+    """
+    script = 'import sys\nfor _ in range (%d):\n    sys.stdout.write (%d * "\\x80")\n' % (number_frames, WIDTH * HEIGHT)
+    return subprocess.Popen ([sys.executable, '-c', script], stdout = subprocess.PIPE)
+
+def check (number_frames, failing_frame):
+    config = Config ()
+    process = recording_process (number_frames)
+    live_analysis = evaluator.LiveAnalysis (config, FailingArena (failing_frame), process.stdout, Selection (number_frames), timeline.Timeline (config))
+    live_analysis.start ()
+    start = time.time ()
+    while process.poll () is None and time.time () - start < TIMEOUT:
+        time.sleep (0.1)
+    if process.poll () is None:
+        process.kill ()
+        print ("FAILED: the recording process did not finish within %ds" % (TIMEOUT))
+        return False
+    try:
+        live_analysis.result ()
+    except ComparisonError as error:
+        print ("OK: the recording process finished and the analysis raised: %s" % (str (error)))
+        return True
+    print ("FAILED: the analysis did not raise the comparison error")
+    return False
+
+if __name__ == '__main__':
+    if len (sys.argv) > 3 or not all (arg.isdigit () for arg in sys.argv [1:]):
+        print __doc__
+        sys.exit (1)
+    number_frames = int (sys.argv [1]) if len (sys.argv) > 1 else 500
+    failing_frame = int (sys.argv [2]) if len (sys.argv) > 2 else 10
+    sys.exit (0 if check (number_frames, failing_frame) else 1)
@@ -0,0 +1,126 @@
+"""
+Check that the actions of a PROGRAM command run at their planned offsets
+when the wall clock of the CASU computer changes.
+
+The script first checks that the clock of module scheduler is not the
+wall clock.  Then it replaces that clock with one that it advances by
+hand, schedules a program in the worker, and moves the wall clock back
+and forth while it advances the monotonic clock.  It checks that the
+deadlines of the scheduled actions do not move, that every action runs
+at its planned offset, and that the worker replies to the command when
+the program is done.
+
+Usage:
+PYTHONPATH=src python util/check-program-clock.py
+"""
+
+import scheduler
+import worker
+
+import sys
+import time
+
+PROGRAM = [
+    [0.5, 'led', 1, 0, 0],
+    [0.75, 'led_standby'],
+    [1.0, 'vibration', [900, 100], [440, 1], [50, 0]],
+    [4.0, 'speaker_standby'],
+    [4.5, 'airflow', 1],
+    [6.0, 'airflow_standby'],
+    ]
+
+WALL_CLOCK_JUMPS = [3600, -7200, 0.5, -86400]
+"""
+Seconds added to the wall clock each time the monotonic clock advances.
+"""
+
+TICK = 0.25
+
+CASU_METHODS = {
+    'set_diagnostic_led_rgb' : 'led',
+    'diagnostic_led_standby' : 'led_standby',
+    'set_vibration_pattern'  : 'vibration',
+    'speaker_standby'        : 'speaker_standby',
+    'set_airflow_intensity'  : 'airflow',
+    'airflow_standby'        : 'airflow_standby',
+    }
+"""
+Program action run by each CASU method.
+"""
+
+class Clock:
+    """
+    Clock that only moves when it is told to.
+    """
+    def __init__ (self, now):
+        self.now = now
+
+    def __call__ (self):
+        return self.now
+
+class RecordingCasu:
+    """
+    CASU that records the time of the monotonic clock when each method is called.
+    """
+    def __init__ (self, clock):
+        self.clock = clock
+        self.calls = []
+
+    def __getattr__ (self, name):
+        def method (*arguments):
+            self.calls.append ((self.clock (), name))
+        return method
+
+def check_clock ():
+    if scheduler.monotonic is time.time:
+        print ("FAILED: the scheduler uses the wall clock")
+        return False
+    return True
+
+def check_program ():
+    clock = Clock (1000.0)
+    wall_clock = Clock (time.time ())
+    scheduler.monotonic = clock
+    time.time = wall_clock
+    replies = []
+    worker.casu_number = 0
+    worker.a_casu = RecordingCasu (clock)
+    worker.a_scheduler = scheduler.Scheduler ()
+    worker.running_command = None
+    worker.request_address = None
+    worker.reply = lambda data, address = None : replies.append (data)
+    worker.message = [worker.PROGRAM, PROGRAM]
+    worker.cmd_program ()
+    deadlines = sorted (item [0] for item in worker.a_scheduler.queue)
+    ok = True
+    jumps = 0
+    while len (worker.a_scheduler.queue) > 0:
+        wall_clock.now += WALL_CLOCK_JUMPS [jumps % len (WALL_CLOCK_JUMPS)]
+        jumps += 1
+        if sorted (item [0] for item in worker.a_scheduler.queue) != deadlines [-len (worker.a_scheduler.queue):]:
+            print ("FAILED: the deadlines moved when the wall clock changed")
+            ok = False
+        clock.now += TICK
+        worker.a_scheduler.run_due ()
+    expected = [(1000.0 + action [0], action [1]) for action in PROGRAM]
+    actual = [(when, CASU_METHODS.get (name, name)) for (when, name) in worker.a_casu.calls]
+    if actual != expected:
+        print ("FAILED: the CASU actions ran at %s instead of %s" % (str (actual), str (expected)))
+        ok = False
+    if len (replies) != 1 or replies [0][0] != worker.WORKER_OK:
+        print ("FAILED: unexpected replies %s" % (str (replies)))
+        return False
+    timings = replies [0][2]
+    if any (planned != actual for planned, actual in timings):
+        print ("FAILED: the program timings are %s" % (str (timings)))
+        ok = False
+    return ok
+
+if __name__ == '__main__':
+    if len (sys.argv) != 1:
+        print __doc__
+        sys.exit (1)
+    if check_clock () and check_program ():
+        print ("OK: the program actions ran at their planned offsets while the wall clock changed")
+        sys.exit (0)
+    sys.exit (1)
@@ -0,0 +1,115 @@
+"""
+Check that the worker rejects invalid PROGRAM commands before it
+schedules any action.
+
+The script sends the worker programs with missing or negative offsets,
+unknown actions, and actions with the wrong number or type of arguments.
+It checks that each one is answered with WORKER_INVALID_PROGRAM, that no
+action is scheduled and that the CASU is not touched.  Then it checks
+that a program sent while another command is running is answered with
+WORKER_BUSY and leaves the start time of the vibration of the running
+command alone.
+
+Usage:
+PYTHONPATH=src python util/check-program-validation.py
+"""
+
+import scheduler
+import worker
+
+import sys
+
+VALID_PROGRAM = [
+    [0.0, 'led', 1, 0, 0],
+    [0.25, 'led_standby'],
+    [0.5, 'vibration', [900, 100], [440, 1], [50, 0]],
+    [1.0, 'speaker_standby'],
+    [1.0, 'airflow', 1],
+    [2.0, 'airflow_standby'],
+    ]
+
+INVALID_PROGRAMS = [
+    None,
+    42,
+    [42],
+    [[]],
+    [[0.5]],
+    ['led'],
+    [['0.5', 'led_standby']],
+    [[None, 'led_standby']],
+    [[-0.5, 'led_standby']],
+    [[float ('nan'), 'led_standby']],
+    [[float ('inf'), 'led_standby']],
+    [[True, 'led_standby']],
+    [[0.5, 'blip']],
+    [[0.5, ['led']]],
+    [[0.5, 'led', 1, 0]],
+    [[0.5, 'led', 1, 0, '0']],
+    [[0.5, 'led_standby', 1]],
+    [[0.5, 'airflow']],
+    [[0.5, 'airflow', [1]]],
+    [[0.5, 'vibration', [900, 100], [440, 1]]],
+    [[0.5, 'vibration', [900, 100], [440, 1], [50]]],
+    [[0.5, 'vibration', [900, 100], [440, 1], 50]],
+    [[0.5, 'vibration', [900, 100], [440, 'x'], [50, 0]]],
+    VALID_PROGRAM + [[3.0, 'airflow', 'on']],
+    ]
+
+class RecordingCasu:
+    """
+    CASU that records the names of the methods called.
+    """
+    def __init__ (self):
+        self.calls = []
+
+    def __getattr__ (self, name):
+        def method (*arguments):
+            self.calls.append (name)
+        return method
+
+def setup ():
+    replies = []
+    worker.casu_number = 0
+    worker.a_casu = RecordingCasu ()
+    worker.a_scheduler = scheduler.Scheduler ()
+    worker.running_command = None
+    worker.request_address = None
+    worker.reply = lambda data, address = None : replies.append (data)
+    return replies
+
+def check_invalid_programs ():
+    ok = True
+    for program in INVALID_PROGRAMS:
+        replies = setup ()
+        worker.message = [worker.PROGRAM, program]
+        try:
+            worker.cmd_program ()
+        except Exception as error:
+            print ("FAILED: program %s raised %s" % (str (program), repr (error)))
+            ok = False
+            continue
+        if replies != [[worker.WORKER_INVALID_PROGRAM]] or len (worker.a_scheduler.queue) > 0 or len (worker.a_casu.calls) > 0 or worker.running_command is not None:
+            print ("FAILED: program %s was not rejected, replies %s" % (str (program), str (replies)))
+            ok = False
+    return ok
+
+def check_busy ():
+    replies = setup ()
+    worker.message = [worker.PROGRAM, VALID_PROGRAM]
+    worker.cmd_program ()
+    worker.time_start_vibration_pattern = 1234.5
+    number_actions = len (worker.a_scheduler.queue)
+    worker.cmd_program ()
+    if replies != [[worker.WORKER_BUSY]] or worker.time_start_vibration_pattern != 1234.5 or len (worker.a_scheduler.queue) != number_actions:
+        print ("FAILED: busy program replied %s and changed the start time of the vibration to %s" % (str (replies), str (worker.time_start_vibration_pattern)))
+        return False
+    return True
+
+if __name__ == '__main__':
+    if len (sys.argv) != 1:
+        print __doc__
+        sys.exit (1)
+    results = [check () for check in [check_invalid_programs, check_busy]]
+    if all (results):
+        print ("OK: invalid programs are rejected before scheduling and busy programs keep the running command")
+    sys.exit (0 if all (results) else 1)
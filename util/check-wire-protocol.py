@@ -0,0 +1,118 @@
+"""
+Check that the binary codec of module zmq_sock_utils rejects malformed
+input with ValueError.
+
+The script checks that the messages exchanged by the master and the
+workers survive a round trip, that every truncation of their encoding
+raises ValueError when decoded, that integers that do not fit in 64 bits
+raise ValueError when encoded, and that a ROUTER socket rejects pickle
+messages when it does not accept pickle and garbage messages when it
+does, with a reply to their sender.
+
+Usage:
+PYTHONPATH=src python util/check-wire-protocol.py
+"""
+
+import worker
+import zmq_sock_utils
+
+import pickle
+import sys
+import zmq
+
+MESSAGES = [
+    [worker.INITIALISE, 30, 10, 0, 30, 4, 'Zagreb', 'SinglePulseGenesPulse'],
+    [worker.ACTIVE_CASU, [440, 0.9, 0.1, 100, 1.5]],
+    [worker.PROGRAM, [[0.5, 'blip_on'], [0.75, 'blip_off']]],
+    [worker.WORKER_OK, 1234567.875, None, True, False, -2 ** 63, 2 ** 63 - 1],
+    28.5,
+    ]
+
+OVERSIZED_INTEGERS = [2 ** 63, -2 ** 63 - 1, 2 ** 70, [1, 2 ** 70]]
+
+GARBAGE = ['', 'garbage', '\x80\x02garbage', '(lp0\nI1\na', 'cos\nnosuchfunction\n.', '\xeb', '\xeb\x09']
+"""
+Messages that neither pickle nor the binary codec can decode.
+"""
+
+def check_round_trip ():
+    ok = True
+    for data in MESSAGES:
+        if zmq_sock_utils.decode (zmq_sock_utils.encode (data)) != data:
+            print ("FAILED: round trip of %s" % (str (data)))
+            ok = False
+    return ok
+
+def check_truncated ():
+    ok = True
+    for data in MESSAGES:
+        data_bytes = zmq_sock_utils.encode (data)
+        for length in xrange (len (data_bytes)):
+            try:
+                zmq_sock_utils.decode (data_bytes [:length])
+            except ValueError:
+                continue
+            except Exception as error:
+                print ("FAILED: truncation to %d bytes of %s raised %s" % (length, str (data), repr (error)))
+            else:
+                print ("FAILED: truncation to %d bytes of %s was decoded" % (length, str (data)))
+            ok = False
+    return ok
+
+def check_oversized ():
+    ok = True
+    for data in OVERSIZED_INTEGERS:
+        try:
+            zmq_sock_utils.encode (data)
+        except ValueError:
+            continue
+        except Exception as error:
+            print ("FAILED: encoding %s raised %s" % (str (data), repr (error)))
+        else:
+            print ("FAILED: encoding %s did not raise" % (str (data)))
+        ok = False
+    return ok
+
+def check_rejected (data_bytes, accept_pickle):
+    """
+    Check that a ROUTER socket rejects the given request and that the sender gets the reply to the rejected request.
+    """
+    context = zmq.Context ()
+    router = context.socket (zmq.ROUTER)
+    port = router.bind_to_random_port ('tcp://127.0.0.1')
+    request = context.socket (zmq.REQ)
+    request.connect ('tcp://127.0.0.1:%d' % (port))
+    request.send (data_bytes)
+    ok = False
+    try:
+        zmq_sock_utils.recv_routed (router, accept_pickle)
+        print ("FAILED: request %r was accepted" % (data_bytes))
+    except zmq_sock_utils.InvalidMessage as error:
+        zmq_sock_utils.send_routed (router, error.address, [worker.WORKER_INVALID_MESSAGE])
+        if request.poll (5000) == 0:
+            print ("FAILED: no reply to the rejected request")
+        else:
+            reply, _ = zmq_sock_utils.loads (request.recv ())
+            ok = reply == [worker.WORKER_INVALID_MESSAGE]
+            if not ok:
+                print ("FAILED: unexpected reply %s" % (str (reply)))
+    for socket in [request, router]:
+        socket.setsockopt (zmq.LINGER, 0)
+        socket.close ()
+    context.term ()
+    return ok
+
+def check_rejected_pickle ():
+    return check_rejected (pickle.dumps ([worker.CASU_STATUS], -1), False)
+
+def check_rejected_garbage ():
+    return all ([check_rejected (data_bytes, True) for data_bytes in GARBAGE])
+
+if __name__ == '__main__':
+    if len (sys.argv) != 1:
+        print __doc__
+        sys.exit (1)
+    results = [check () for check in [check_round_trip, check_truncated, check_oversized, check_rejected_pickle, check_rejected_garbage]]
+    if all (results):
+        print ("OK: the binary codec rejects malformed input with ValueError")
+    sys.exit (0 if all (results) else 1)
@@ -0,0 +1,283 @@
+"""
+Sweep the pixel count thresholds over the evaluations of experimental runs.
+
+The pixel counts of every evaluation of the given runs are loaded into a
+single array with one row per evaluation and frame.  Each fitness
+function is then computed for every pair of background threshold and
+previous frame threshold in a grid, with one broadcast computation over
+all the evaluations, frames and threshold pairs.  Besides the fitness
+functions of the configuration file, the sweep includes the evaluation
+computed by the evaluator, where each segment of the timeline has its
+own image processing function.
+
+For each fitness function and threshold pair the script reports the
+distribution of the evaluation values and the rank stability, which is
+the mean Spearman correlation between the rankings of the chromosomes
+given by each pair of their evaluations.  A threshold pair with a high
+rank stability ranks the chromosomes the same way in every evaluation.
+The results are written to a CSV file and the most stable threshold
+pairs of each fitness function are printed.
+
+The active CASU is the first CASU of the arena, as in the evaluator.
+Only arenas with two CASUs and evaluations with all the frames of the
+timeline are used.
+
+Usage:
+PYTHONPATH=src python util/threshold-sweep.py [--config-file FILE] [--background START:STOP:STEP] [--previous START:STOP:STEP] RUN_FOLDER [RUN_FOLDER ...]
+"""
+
+import config
+import evaluator
+import rescore
+import timeline
+
+import argparse
+import csv
+import numpy
+import sys
+
+# Name of the evaluation computed by the evaluator in the sweep results
+ONLINE_EVALUATION = 'online_evaluation'
+
+class Evaluations:
+    """
+    The pixel counts of the evaluations of some experimental runs.
+
+    Attribute results is an array with shape (evaluations, frames,
+    columns).  Attribute replicates is a list with the indexes of the
+    evaluations of each chromosome that was evaluated the number of
+    evaluations per chromosome.
+    """
+    def __init__ (self, results, replicates):
+        self.results = results
+        self.replicates = replicates
+
+def parse_range (text):
+    """
+    Return the thresholds from START to STOP inclusive given a string START:STOP:STEP.
+    """
+    start, stop, step = [float (value) for value in text.split (':')]
+    return numpy.arange (start, stop + step / 2.0, step)
+
+def load_runs (experiment_folders, a_timeline, number_evaluations_per_chromosome):
+    results = []
+    replicates = []
+    skipped = 0
+    for experiment_folder in experiment_folders:
+        if not experiment_folder.endswith ('/'):
+            experiment_folder += '/'
+        evaluation_rows = rescore.read_csv_rows (experiment_folder + "evaluation.csv")
+        for _, indexes in rescore.group_chromosome_evaluations (evaluation_rows, number_evaluations_per_chromosome):
+            chromosome = []
+            for index in indexes:
+                row = evaluation_rows [index]
+                filename = rescore.image_processing_filename (experiment_folder, int (row [evaluator.EVA_EPISODE]), int (row [evaluator.EVA_ITERATION]))
+                if filename is None:
+                    skipped += 1
+                    continue
+                an_evaluation = evaluator.read_image_processing (filename)
+                if an_evaluation.shape [0] < a_timeline.number_frames or an_evaluation.shape [1] != 4:
+                    skipped += 1
+                    continue
+                chromosome.append (len (results))
+                results.append (an_evaluation [:a_timeline.number_frames])
+            if len (chromosome) == number_evaluations_per_chromosome:
+                replicates.append (chromosome)
+    print ("Loaded %d evaluations, skipped %d, %d chromosomes with %d evaluations" % (
+        len (results), skipped, len (replicates), number_evaluations_per_chromosome))
+    return Evaluations (numpy.array (results, dtype = numpy.float64), replicates)
+
+def segment_columns (results, a_timeline, name):
+    """
+    Return the background and previous frame columns of the active and passive CASUs of the frames of the segments with the given name.
+    Each column has shape (evaluations, frames).
+    """
+    rows = results [:, a_timeline.mask (name, results.shape [1])]
+    return rows [:, :, 0], rows [:, :, 1], rows [:, :, 2], rows [:, :, 3]
+
+# Grid image processing functions.  Each function computes the sum of the
+# corresponding ipf function over the frames of a segment for every
+# evaluation and threshold pair.  The columns have shape (evaluations,
+# frames) and the result has shape (evaluations, background thresholds,
+# previous frame thresholds).
+
+def resting (background, previous, background_thresholds, previous_thresholds):
+    """
+    Return the frames where the bees in a ROI are resting as a pair of arrays: one over the background thresholds and one over the previous frame thresholds.
+    A frame is resting for a threshold pair if both arrays are one.
+    """
+    return \
+        (background [:, :, None] > background_thresholds).astype (numpy.float64), \
+        (previous   [:, :, None] < previous_thresholds  ).astype (numpy.float64)
+
+def resting_pixels (background, previous, background_thresholds, previous_thresholds):
+    over_background, under_previous = resting (background, previous, background_thresholds, previous_thresholds)
+    return numpy.einsum ('ef,efb,efp->ebp', background, over_background, under_previous)
+
+def still_frames (previous, background_thresholds, previous_thresholds):
+    count = (previous [:, :, None] < previous_thresholds).sum (axis = 1)
+    return numpy.repeat (count [:, None, :], len (background_thresholds), axis = 1)
+
+def gipf_stopped_frames (columns, background_thresholds, previous_thresholds):
+    active_background, active_previous, _, _ = columns
+    return resting_pixels (active_background, active_previous, background_thresholds, previous_thresholds)
+
+def gipf_frames_with_no_movement_active_casu_roi (columns, background_thresholds, previous_thresholds):
+    _, active_previous, _, _ = columns
+    return still_frames (active_previous, background_thresholds, previous_thresholds)
+
+def gipf_frames_with_no_movement_active_passive_casu_rois (columns, background_thresholds, previous_thresholds):
+    _, active_previous, _, passive_previous = columns
+    return \
+        + still_frames (active_previous,  background_thresholds, previous_thresholds) \
+        - still_frames (passive_previous, background_thresholds, previous_thresholds)
+
+def gipf_penalize_passive_casu (columns, background_thresholds, previous_thresholds):
+    active_background, active_previous, passive_background, passive_previous = columns
+    return \
+        + resting_pixels (active_background,  active_previous,  background_thresholds, previous_thresholds) \
+        - resting_pixels (passive_background, passive_previous, background_thresholds, previous_thresholds)
+
+def gipf_penalize_resting_bees (columns, background_thresholds, previous_thresholds):
+    """
+    As in function ipf_penalize_resting_bees, the passive CASU is only
+    penalised in frames where the active CASU is not penalised.
+    """
+    active_background, active_previous, passive_background, passive_previous = columns
+    active_over, active_under = resting (active_background, active_previous, background_thresholds, previous_thresholds)
+    passive_over, passive_under = resting (passive_background, passive_previous, background_thresholds, previous_thresholds)
+    return \
+        - numpy.einsum ('ef,efb,efp->ebp', active_background, active_over, active_under) \
+        - numpy.einsum ('ef,efb,efp->ebp', passive_background, passive_over, passive_under) \
+        + numpy.einsum ('ef,efb,efp,efb,efp->ebp', passive_background, passive_over, passive_under, active_over, active_under)
+
+GRID_IPF = {
+    evaluator.ipf_stopped_frames                                    : gipf_stopped_frames,
+    evaluator.ipf_frames_with_no_movement_active_casu_roi           : gipf_frames_with_no_movement_active_casu_roi,
+    evaluator.ipf_frames_with_no_movement_active_passive_casu_rois  : gipf_frames_with_no_movement_active_passive_casu_rois,
+    evaluator.ipf_penalize_passive_casu                             : gipf_penalize_passive_casu,
+    evaluator.ipf_penalize_resting_bees                             : gipf_penalize_resting_bees,
+    }
+
+def sweep (cfg, a_timeline, results, background_thresholds, previous_thresholds):
+    """
+    Return a dictionary with the evaluation values of each fitness function, an array with shape (evaluations, background thresholds, previous frame thresholds).
+    """
+    columns = {}
+    for name in [timeline.NO_STIMULI, timeline.VIBRATION]:
+        columns [name] = segment_columns (results, a_timeline, name)
+    result = {}
+    for name, function in evaluator.image_processing_functions (cfg).items ():
+        values = GRID_IPF [function.vibration] (columns [timeline.VIBRATION], background_thresholds, previous_thresholds)
+        if function.no_stimuli is not None:
+            values_no_stimuli = GRID_IPF [function.no_stimuli] (columns [timeline.NO_STIMULI], background_thresholds, previous_thresholds)
+            values = function.combine (cfg, values, values_no_stimuli)
+        result [name] = values
+    result [ONLINE_EVALUATION] = sum (
+        GRID_IPF [function] (columns [name], background_thresholds, previous_thresholds)
+        for name, function in evaluator.SEGMENT_FUNCTIONS.items ())
+    return result
+
+def average_ranks (values):
+    """
+    Return the ranks of the values along the first axis.  Tied values get the average of their ranks.
+    """
+    less = numpy.zeros (values.shape)
+    equal = numpy.zeros (values.shape)
+    for value in values:
+        less += value < values
+        equal += value == values
+    return less + (equal + 1) / 2.0
+
+def rank_stability (values, replicates):
+    """
+    Return the mean Spearman correlation between the rankings of the chromosomes given by each pair of their evaluations.
+    The values have shape (evaluations, background thresholds, previous frame thresholds) and so does the result without the first axis.
+    Returns NaN where a ranking has all chromosomes tied.
+    """
+    ranks = [average_ranks (values [[chromosome [k] for chromosome in replicates]]) for k in xrange (len (replicates [0]))]
+    ranks = [r - r.mean (axis = 0) for r in ranks]
+    result = []
+    for k1 in xrange (len (ranks)):
+        for k2 in xrange (k1 + 1, len (ranks)):
+            with numpy.errstate (divide = 'ignore', invalid = 'ignore'):
+                result.append ((ranks [k1] * ranks [k2]).sum (axis = 0) / numpy.sqrt ((ranks [k1] ** 2).sum (axis = 0) * (ranks [k2] ** 2).sum (axis = 0)))
+    return numpy.mean (result, axis = 0)
+
+def report (scores, replicates, background_thresholds, previous_thresholds, filename, number_best):
+    grid_shape = (len (background_thresholds), len (previous_thresholds))
+    with open (filename, 'w') as fp:
+        f = csv.writer (fp, delimiter = ',', quoting = csv.QUOTE_NONNUMERIC, quotechar = '"')
+        f.writerow (["fitness_function", "background_threshold", "previous_frame_threshold",
+                     "mean", "std", "percentile_5", "median", "percentile_95", "rank_stability"])
+        for name in sorted (scores.keys ()):
+            values = scores [name].astype (numpy.float64)
+            percentiles = numpy.percentile (values, [5, 50, 95], axis = 0)
+            if len (replicates) > 2 and len (replicates [0]) > 1:
+                stability = rank_stability (values, replicates)
+            else:
+                stability = numpy.empty (grid_shape)
+                stability.fill (numpy.nan)
+            mean = values.mean (axis = 0)
+            std = values.std (axis = 0)
+            for ib, background_threshold in enumerate (background_thresholds):
+                for ip, previous_threshold in enumerate (previous_thresholds):
+                    f.writerow ([name, background_threshold, previous_threshold,
+                                 mean [ib, ip], std [ib, ip],
+                                 percentiles [0, ib, ip], percentiles [1, ib, ip], percentiles [2, ib, ip],
+                                 stability [ib, ip]])
+            print ("%s" % (name))
+            ranked = numpy.argsort (numpy.where (numpy.isnan (stability), -numpy.inf, stability), axis = None) [::-1]
+            for index in ranked [:number_best]:
+                ib, ip = numpy.unravel_index (index, grid_shape)
+                print ("  background %7g  previous frame %7g  rank stability %6.3f  median %10g  [%g, %g]" % (
+                    background_thresholds [ib], previous_thresholds [ip], stability [ib, ip],
+                    percentiles [1, ib, ip], percentiles [0, ib, ip], percentiles [2, ib, ip]))
+        fp.close ()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser (
+        description = 'Sweep the pixel count thresholds over the evaluations of experimental runs.',
+        argument_default = None
+    )
+    parser.add_argument (
+        'run_folders',
+        nargs = '+',
+        metavar = 'RUN_FOLDER',
+        help = 'folder of an experimental run')
+    parser.add_argument (
+        '--config-file',
+        default = 'config',
+        type = str,
+        help = 'the file name with the experiment configuration')
+    parser.add_argument (
+        '--background',
+        default = '0:5000:250',
+        type = str,
+        help = 'background thresholds as START:STOP:STEP')
+    parser.add_argument (
+        '--previous',
+        default = '0:5000:250',
+        type = str,
+        help = 'previous frame thresholds as START:STOP:STEP')
+    parser.add_argument (
+        '--output',
+        default = 'threshold-sweep.csv',
+        type = str,
+        help = 'the file name where the sweep results are written')
+    parser.add_argument (
+        '--best',
+        default = 5,
+        type = int,
+        help = 'how many threshold pairs with the highest rank stability to print per fitness function')
+    args = parser.parse_args ()
+    cfg = config.Config (args.config_file)
+    a_timeline = timeline.Timeline (cfg)
+    evaluations = load_runs (args.run_folders, a_timeline, cfg.number_evaluations_per_chromosome)
+    if len (evaluations.results) == 0:
+        print ("There are no evaluations to sweep")
+        sys.exit (1)
+    background_thresholds = parse_range (args.background)
+    previous_thresholds = parse_range (args.previous)
+    scores = sweep (cfg, a_timeline, evaluations.results, background_thresholds, previous_thresholds)
+    report (scores, evaluations.replicates, background_thresholds, previous_thresholds, args.output, args.best)
@@ -0,0 +1,90 @@
+"""
+Validate the NumPy image comparison functions against the convert program.
+
+The frame triples are read from a text file with one triple per line:
+the filename of a mask image followed by the filenames of the two images
+that are compared.  Each triple is compared with the multiply and fuzz
+metric used by the arenas and with the subtract and threshold metric.
+For each metric the script reports the time taken by convert and by
+NumPy, the speedup, the number of triples with the same value, and the
+maximum and mean difference between the values.
+
+A triples file for the last iteration of an episode can be created with
+
+ls tmp/iteration-image-*.jpg | awk '{print "ARENA_PATH/Mask-0.jpg EPISODE_PATH/Background.jpg " $1}' > triples.txt
+
+Usage:
+PYTHONPATH=src python util/validate-image-comparison.py TRIPLES_FILE [SAME_COLOUR_THRESHOLD [THRESHOLD]]
+"""
+
+import arena
+import image_comparison
+
+import sys
+import time
+
+def read_triples (filename):
+    result = []
+    with open (filename, 'r') as fp:
+        for line in fp:
+            fields = line.split ()
+            if len (fields) == 3:
+                result.append (tuple (fields))
+            elif len (fields) != 0:
+                print ("Ignoring line: %s" % (line.strip ()))
+    return result
+
+def run_convert (triples, same_colour_threshold, threshold):
+    start = time.time ()
+    plsm = [arena.convert_compare_plsm (mask, image1, image2, '%d%%' % (same_colour_threshold)) for mask, image1, image2 in triples]
+    plsm_time = time.time () - start
+    start = time.time ()
+    thomas = [arena.convert_compare_thomas (mask, image1, image2, threshold) for mask, image1, image2 in triples]
+    thomas_time = time.time () - start
+    return (plsm_time, plsm), (thomas_time, thomas)
+
+def run_numpy (triples, same_colour_threshold, threshold):
+    start = time.time ()
+    plsm = []
+    for mask, image1, image2 in triples:
+        plsm.append (image_comparison.count_different_pixels (
+            image_comparison.read_image (mask),
+            image_comparison.read_image (image1),
+            image_comparison.read_image (image2),
+            same_colour_threshold))
+    plsm_time = time.time () - start
+    start = time.time ()
+    thomas = []
+    for mask, image1, image2 in triples:
+        thomas.append (image_comparison.subtract_threshold_count (
+            image_comparison.read_image (mask),
+            image_comparison.read_image (image1),
+            image_comparison.read_image (image2),
+            threshold))
+    thomas_time = time.time () - start
+    return (plsm_time, plsm), (thomas_time, thomas)
+
+def report (name, (convert_time, convert_values), (numpy_time, numpy_values)):
+    differences = [abs (vc - vn) for vc, vn in zip (convert_values, numpy_values)]
+    print ("%s metric" % (name))
+    print ("  convert %8.2fs %8.2fms per triple" % (convert_time, 1000.0 * convert_time / len (differences)))
+    print ("  numpy   %8.2fs %8.2fms per triple" % (numpy_time, 1000.0 * numpy_time / len (differences)))
+    print ("  Speedup: %.1f" % (convert_time / numpy_time))
+    print ("  Identical values: %d of %d" % (len ([d for d in differences if d == 0]), len (differences)))
+    print ("  Maximum difference: %f" % (max (differences)))
+    print ("  Mean difference: %f" % (float (sum (differences)) / len (differences)))
+
+if __name__ == '__main__':
+    if len (sys.argv) < 2:
+        print __doc__
+        sys.exit (1)
+    triples = read_triples (sys.argv [1])
+    same_colour_threshold = int (sys.argv [2]) if len (sys.argv) > 2 else 25
+    threshold = int (sys.argv [3]) if len (sys.argv) > 3 else image_comparison.THOMAS_THRESHOLD
+    if len (triples) == 0:
+        print ("There are no frame triples in %s" % (sys.argv [1]))
+        sys.exit (1)
+    convert_plsm, convert_thomas = run_convert (triples, same_colour_threshold, threshold)
+    numpy_plsm, numpy_thomas = run_numpy (triples, same_colour_threshold, threshold)
+    report ("Multiply and fuzz", convert_plsm, numpy_plsm)
+    report ("Subtract and threshold", convert_thomas, numpy_thomas)